@@ -0,0 +1,3 @@
+"""
+Benchmarks, run against generated file trees. See `__main__.py`.
+"""
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+"""
+Time the expensive operations against a synthetic file tree.
+
+Results are compared against a stored baseline, and any benchmark slower
+than its baseline by more than the given tolerance is reported as a
+regression, with a non-zero exit status. Run from the project root:
+
+    python3 -m benchmarks --preset small
+    python3 -m benchmarks --preset small --save     # Update baseline
+"""
+
+import argparse
+import json
+import logging
+from pathlib import Path
+import platform
+from pprint import pprint as pp
+import sys
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Callable, Dict, List, Optional
+
+from mimicry.database import DB
+from mimicry.file import File
+from mimicry.tree import Tree
+from mimicry.updater import Updater
+
+from .generate import PRESETS, TreeSpec, generate, mutate
+
+
+BASELINE = Path(__file__).parent / 'baseline.json'
+
+# Files added one at a time by the 'db_add' benchmark
+DB_ADD_FILES = 500
+
+
+class Benchmarks:
+    """
+    Run every benchmark against one synthetic tree.
+    """
+    def __init__(self, root: Path, spec: TreeSpec, repeat: int=3):
+        self.root = root
+        self.spec = spec
+        self.repeat = repeat
+        self.db_path = root / Updater.db_file
+        self.paths: List[Path] = []
+
+    def run(self) -> Dict[str, float]:
+        """
+        Run every benchmark, in order.
+
+        Returns:
+            Dictionary of best time in seconds, keyed by benchmark name.
+        """
+        # Walked once, up front, so only the benchmarks that walk time it
+        self.paths = [self.root / entry.relpath for entry in self.entries()]
+        benchmarks = {
+            'walk': (None, self.walk),
+            'sha256': (None, self.sha256),
+            'db_add': (self.remove_db, self.db_add),
+            'update_full': (self.remove_db, self.update),
+            'update_unchanged': (None, self.update),
+            'update_incremental': (self.mutate, self.update),
+            'duplicates': (None, self.duplicates),
+        }
+        results = {}
+        for name, (setup, function) in benchmarks.items():
+            results[name] = self.time(function, setup)
+            print(f"{name:<20} {results[name]:10.3f}s", flush=True)
+        return results
+
+    def time(self, function: Callable, setup: Optional[Callable]=None) -> float:
+        best = float('inf')
+        for _ in range(self.repeat):
+            if setup is not None:
+                setup()
+            started = perf_counter()
+            function()
+            best = min(best, perf_counter() - started)
+        return best
+
+    # Setup
+    def mutate(self) -> None:
+        mutate(self.root, self.spec)
+
+    def remove_db(self) -> None:
+        for suffix in ('', '-wal', '-shm'):
+            path = Path(str(self.db_path) + suffix)
+            if path.exists():
+                path.unlink()
+
+    # Benchmarks
+    def db_add(self) -> None:
+        db = DB(self.db_path)
+        for path in self.paths[:DB_ADD_FILES]:
+            db.add(path)
+        db.connection.close()
+
+    def duplicates(self) -> None:
+        db = DB(self.db_path)
+        db.duplicates()
+        db.connection.close()
+
+    def entries(self) -> List:
+        return list(Tree(self.root, precount=False, ignore=[Updater.db_file]).entries())
+
+    def sha256(self) -> None:
+        for path in self.paths:
+            File(path).sha256
+
+    def update(self) -> None:
+        Updater(self.root).update()
+
+    def walk(self) -> None:
+        self.entries()
+
+
+def compare(results: Dict[str, float], baseline: Dict[str, float], tolerance: float) -> List[str]:
+    """
+    Find benchmarks slower than their baseline by more than given fraction.
+
+    Returns:
+        List of messages, one per regression.
+    """
+    regressions = []
+    for name, seconds in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        change = (seconds - expected) / expected if expected else 0.0
+        print(f"{name:<20} {expected:10.3f}s -> {seconds:10.3f}s  {change:+7.1%}")
+        if change > tolerance:
+            regressions.append(f"{name} is {change:.0%} slower than baseline")
+    return regressions
+
+
+def load_baseline(path: Path) -> dict:
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text())
+
+
+def main(options) -> int:
+    spec = PRESETS[options.preset]
+    with TemporaryDirectory(prefix='mimicry-bench-', dir=options.dir) as folder:
+        root = Path(folder)
+        print(f"Generate {options.preset!r} tree under {root}", flush=True)
+        started = perf_counter()
+        total = generate(root, spec)
+        elapsed = perf_counter() - started
+        print(f"Generated {total:,} bytes in {elapsed:.1f}s", flush=True)
+        results = Benchmarks(root, spec, repeat=options.repeat).run()
+
+    baselines = load_baseline(options.baseline)
+    if options.save:
+        baselines[options.preset] = {
+            'machine': f"{platform.machine()} {platform.system()} {platform.release()}",
+            'python': platform.python_version(),
+            'results': {name: round(seconds, 4) for name, seconds in results.items()},
+        }
+        options.baseline.write_text(json.dumps(baselines, indent=4, sort_keys=True) + '\n')
+        print(f"Saved baseline to {options.baseline}")
+        return 0
+
+    baseline = baselines.get(options.preset)
+    if baseline is None:
+        print(f"No baseline for {options.preset!r} preset, use --save to create one")
+        return 0
+    regressions = compare(results, baseline['results'], options.tolerance)
+    for message in regressions:
+        print(f"REGRESSION: {message}")
+    return 1 if regressions else 0
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        prog='benchmarks',
+        description="Benchmark mimicry against a synthetic file tree.")
+    parser.add_argument(
+        '--preset', choices=PRESETS, default='tiny',
+        help="size of tree to generate (default: %(default)s)")
+    parser.add_argument(
+        '--repeat', metavar='N', type=int, default=3,
+        help="runs of each benchmark, best is kept (default: %(default)s)")
+    parser.add_argument(
+        '--tolerance', metavar='FRACTION', type=float, default=0.25,
+        help="slowdown allowed before failing, eg. 0.25 (default: %(default)s)")
+    parser.add_argument(
+        '--baseline', metavar='FILE', type=Path, default=BASELINE,
+        help="baseline results file (default: %(default)s)")
+    parser.add_argument(
+        '--save', action='store_true',
+        help="save results as new baseline for preset, instead of comparing")
+    parser.add_argument(
+        '--dir', metavar='FOLDER',
+        help="create tree under FOLDER, eg. on the drive to be measured")
+    return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format="%(message)s", level=logging.WARNING)
+    sys.exit(main(parse_args(sys.argv[1:])))
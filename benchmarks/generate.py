@@ -0,0 +1,152 @@
+"""
+Generate deterministic, synthetic file trees to benchmark against.
+
+The same specification always produces the same tree: same folders, same
+names, same sizes, and the same contents, byte for byte.
+"""
+
+from dataclasses import dataclass
+import os
+from pathlib import Path
+from pprint import pprint as pp
+import random
+from typing import Dict, List, Tuple
+
+
+@dataclass(frozen=True)
+class TreeSpec:
+    """
+    Shape of a synthetic file tree.
+    """
+    num_files: int                      # Number of small files
+    min_size: int                       # Smallest size of small files, in bytes
+    max_size: int                       # Largest size of small files, in bytes
+    num_huge: int = 0                   # Number of huge files
+    huge_size: int = 0                  # Size of each huge file, in bytes
+    depth: int = 3                      # Most levels of folders below root
+    fanout: int = 8                     # Sub-folders per folder
+    duplicate_ratio: float = 0.1        # Fraction of small files that are copies
+    seed: int = 1
+
+
+# Named specifications, from quick to slow
+PRESETS: Dict[str, TreeSpec] = {
+    'tiny': TreeSpec(
+        num_files=500, min_size=0, max_size=16_384,
+        num_huge=1, huge_size=8 * 2**20, depth=3, fanout=3),
+    'small': TreeSpec(
+        num_files=5_000, min_size=0, max_size=65_536,
+        num_huge=2, huge_size=64 * 2**20, depth=5, fanout=3),
+    'large': TreeSpec(
+        num_files=2_000_000, min_size=0, max_size=16_384,
+        num_huge=4, huge_size=4 * 2**30, depth=12, fanout=2, duplicate_ratio=0.2),
+}
+
+# Bytes of random data per generated block
+BLOCK_SIZE = 64 * 1024
+
+
+def contents(seed: int, size: int) -> bytes:
+    """
+    Deterministic, incompressible contents for a small file.
+    """
+    return random.Random(seed).randbytes(size)
+
+
+def folders(spec: TreeSpec) -> List[str]:
+    """
+    Relative paths of every folder in tree, root first.
+    """
+    relpaths = ['']
+    level = ['']
+    for depth in range(spec.depth):
+        level = [
+            os.path.join(parent, f'd{depth}-{index:02}')
+            for parent in level
+            for index in range(spec.fanout)
+        ]
+        relpaths.extend(level)
+    return relpaths
+
+
+def plan(spec: TreeSpec) -> List[Tuple[str, int, int]]:
+    """
+    Plan every file in tree, without creating anything.
+
+    Files are spread over every folder, deepest folders included. A fraction
+    of files, `duplicate_ratio`, reuse the contents of an earlier file.
+
+    Returns:
+        List of 3-tuples, each file's relative path, size, and contents seed.
+    """
+    rng = random.Random(spec.seed)
+    all_folders = folders(spec)
+    files = []
+    for index in range(spec.num_files):
+        folder = rng.choice(all_folders)
+        if files and rng.random() < spec.duplicate_ratio:
+            _, size, seed = files[rng.randrange(len(files))]
+        else:
+            size = rng.randint(spec.min_size, spec.max_size)
+            seed = rng.getrandbits(64)
+        files.append((os.path.join(folder, f'f{index:07}.bin'), size, seed))
+    for index in range(spec.num_huge):
+        files.append((f'huge-{index}.bin', spec.huge_size, rng.getrandbits(64)))
+    return files
+
+
+def generate(root: Path, spec: TreeSpec) -> int:
+    """
+    Create synthetic tree under root, which must exist and be empty.
+
+    Returns:
+        Total number of bytes written.
+    """
+    for relpath in folders(spec):
+        (root / relpath).mkdir(exist_ok=True, parents=True)
+
+    total = 0
+    for relpath, size, seed in plan(spec):
+        path = root / relpath
+        if size > BLOCK_SIZE:
+            write_huge(path, size, seed)
+        else:
+            path.write_bytes(contents(seed, size))
+        total += size
+    return total
+
+
+def mutate(root: Path, spec: TreeSpec, fraction: float=0.01) -> List[str]:
+    """
+    Change contents of a deterministic selection of small files.
+
+    Sizes are kept, so that changes can only be found by their times.
+
+    Returns:
+        Relative paths of changed files.
+    """
+    rng = random.Random(spec.seed + 1)
+    small = plan(spec)[:spec.num_files]
+    changed = rng.sample(small, int(len(small) * fraction))
+    for relpath, size, seed in changed:
+        (root / relpath).write_bytes(contents(seed + 1, size))
+    return [relpath for relpath, size, seed in changed]
+
+
+def write_huge(path: Path, size: int, seed: int) -> None:
+    """
+    Write a large file, block by block, without holding it in memory.
+
+    Each block differs, so hashing cannot be short-circuited by any cache.
+    """
+    rng = random.Random(seed)
+    block = bytearray(rng.randbytes(BLOCK_SIZE))
+    with open(path, 'wb') as f:
+        remaining = size
+        counter = 0
+        while remaining > 0:
+            block[:8] = counter.to_bytes(8, 'little')
+            count = min(remaining, BLOCK_SIZE)
+            f.write(block[:count])
+            remaining -= count
+            counter += 1
@@ -1,34 +1,39 @@
+#!/usr/bin/env python3
 
+"""
+Find duplicate files across the databases of many drives.
+"""
+
+import argparse
+import logging
+from pathlib import Path
 import sys
 
-from dupes.cache import Cache
+from mimicry.catalog import Catalog
+from mimicry.utils import file_size
 
 
-def main():
+def main(options):
     """
     Actually try and find duplicates.
     """
-    db_path = './files.db'
-    c = Cache(db_path)
-    duplicates = c.calculate_duplicates()
+    catalog = Catalog(Path(path) for path in options.databases)
 
     total_count = 0
     total_bytes = 0
     redundant_count = 0
     redundant_bytes = 0
-    for sha256 in duplicates:
-        files = duplicates[sha256]
-        for count, f in enumerate(files):
+    for group in catalog.duplicate_groups(across=not options.all):
+        size = group[0][1].size
+        print(f"{group[0][1].sha256.hex()[:16]} ({file_size(size)})")
+        for count, (label, record) in enumerate(group):
+            print(f"    [{label}] {record.relpath}")
             total_count += 1
-            total_bytes += f.size
-
-            if (f.path).startswith('/srv/library'):
-                if count > 0:
-                    print("    {}".format(f.path))
-                    redundant_count += 1
-                    redundant_bytes += f.size
-                else:
-                    print(f.path)
+            total_bytes += record.size
+            if count > 0:
+                redundant_count += 1
+                redundant_bytes += record.size
+    catalog.close()
 
     print("{:,} duplicated files".format(total_count))
     print("{:,} duplicated bytes".format(total_bytes))
@@ -37,10 +42,18 @@ def main():
     print("{:,} redundant bytes".format(redundant_bytes))
 
 
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        description="Find duplicate files across the databases of many drives.")
+    parser.add_argument(
+        'databases', metavar='DATABASE', nargs='+',
+        help="path to a drive's 'mimicry.db' file, or a copy of it")
+    parser.add_argument(
+        '--all', action='store_true',
+        help="include duplicates found within a single drive")
+    return parser.parse_args(args)
+
+
 if __name__ == '__main__':
-    if len(sys.argv) != 1:
-        print("Examine duplicate files within database")
-        print("usage: {}".format(sys.argv[0]))
-        sys.exit(1)
-    else:
-        main()
+    logging.basicConfig(format="%(message)s", level=logging.WARNING)
+    main(parse_args(sys.argv[1:]))
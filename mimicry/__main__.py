@@ -4,6 +4,8 @@
 Walk the file system, reading file metadata along the way.
 """
 
+import argparse
+import cProfile
 import logging
 import os
 from pathlib import Path
@@ -11,13 +13,125 @@ from pprint import pprint as pp
 import sys
 import textwrap
 
+from . import hashing
+from .progress import JsonLinesSink, TerminalRenderer, combine
+from .schedule import ORDERS
 from .updater import Updater
 
 
-def main(path):
-    root = Path(path)
-    updater = Updater(root)
-    updater.update()
+def main(options):
+    root = Path(options.path)
+    sinks = []
+    if options.progress:
+        sinks.append(TerminalRenderer())
+    events = None
+    if options.events:
+        events = JsonLinesSink(options.events)
+        sinks.append(events)
+    updater = Updater(
+        root,
+        lazy=options.lazy,
+        workers=options.workers,
+        batch_size=options.batch_size,
+        check_inodes=not options.ignore_inodes,
+        streaming=options.streaming,
+        pipeline=options.pipeline,
+        chunking=options.chunking,
+        label=options.label,
+        export_index=options.export_index,
+        bloom_error_rate=options.bloom,
+        algorithm=options.algorithm,
+        order=options.order,
+        max_bytes_per_second=options.max_bytes,
+        max_files_per_second=options.max_files,
+        idle_priority=options.idle,
+        on_progress=combine(*sinks) if sinks else None,
+        metrics_path=options.metrics,
+    )
+    profile = cProfile.Profile() if options.profile else None
+    try:
+        if profile is None:
+            updater.update()
+        else:
+            profile.runcall(updater.update)
+    finally:
+        if profile is not None:
+            profile.dump_stats(options.profile)
+            logging.info(f"Saved profile to: {options.profile}")
+        if events is not None:
+            events.close()
+
+
+def parse_args(args):
+    program_name = os.path.basename(os.path.dirname(sys.argv[0]))
+    parser = argparse.ArgumentParser(
+        prog=program_name,
+        description="Update metadata database for the file tree under PATH.")
+    parser.add_argument('path', metavar='PATH')
+    parser.add_argument(
+        '--label', metavar='LABEL',
+        help="label for database, eg. the drive's name (default: folder name)")
+    parser.add_argument(
+        '--lazy', action='store_true',
+        help="only hash files whose size matches another file's")
+    parser.add_argument(
+        '--workers', metavar='N', type=int, default=1,
+        help="number of files to hash concurrently (default: %(default)s)")
+    parser.add_argument(
+        '--batch-size', metavar='N', type=int, default=1000,
+        help="records written per database transaction (default: %(default)s)")
+    parser.add_argument(
+        '--ignore-inodes', action='store_true',
+        help="don't treat changed inode numbers as changed files, eg. for FAT drives")
+    parser.add_argument(
+        '--streaming', action='store_true',
+        help="compare tree to database as both are read, using constant memory")
+    parser.add_argument(
+        '--pipeline', action='store_true',
+        help="walk, stat, hash, and write all at once, eg. for network drives")
+    parser.add_argument(
+        '--chunking', action='store_true',
+        help="also store content-defined chunks, to find files sharing most bytes")
+    parser.add_argument(
+        '--export-index', action='store_true',
+        help="export memory-mappable index of hashes alongside database")
+    parser.add_argument(
+        '--bloom', metavar='RATE', type=float,
+        help="save filter of hashes alongside database, with given false-positive rate")
+    parser.add_argument(
+        '--algorithm', metavar='NAME', choices=hashing.available(),
+        help=(
+            "hash algorithm, one of: %(choices)s. Changing it re-hashes every "
+            "file (default: database's existing algorithm, else sha256)"))
+    parser.add_argument(
+        '--order', choices=ORDERS, default='name',
+        help=(
+            "order to hash files in: %(choices)s. Use 'extent' or 'inode' "
+            "to cut seeking on spinning drives (default: %(default)s)"))
+    parser.add_argument(
+        '--max-bytes', metavar='RATE', type=float,
+        help="most bytes to read per second while hashing, eg. 50e6")
+    parser.add_argument(
+        '--max-files', metavar='RATE', type=float,
+        help="most files to hash per second")
+    parser.add_argument(
+        '--idle', action='store_true',
+        help="hash at idle CPU and I/O priority, to leave a busy machine responsive")
+    parser.add_argument(
+        '--progress', action='store_true',
+        help="show progress of each phase, with throughput and time remaining")
+    parser.add_argument(
+        '--events', metavar='FILE',
+        help="append progress events to FILE, as lines of JSON")
+    parser.add_argument(
+        '--metrics', metavar='FILE',
+        help="write counters for each phase of the update to FILE, as JSON")
+    parser.add_argument(
+        '--profile', metavar='FILE',
+        help=(
+            "profile update with cProfile, saving stats to FILE, eg. "
+            "'update.pstats'. Only the main thread is profiled"))
+    return parser.parse_args(args)
 
 
 def setup_logging():
@@ -25,10 +139,6 @@ def setup_logging():
 
 
 if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        program_name = os.path.basename(os.path.dirname(sys.argv[0]))
-        print("usage: {} PATH".format(program_name))
-        sys.exit(1)
-
+    options = parse_args(sys.argv[1:])
     setup_logging()
-    main(sys.argv[1])
+    main(options)
@@ -0,0 +1,152 @@
+"""
+Probabilistic filter of the file hashes held by a database.
+
+Checking a filter first rules out most drives without having to open
+their databases at all. False positives are possible, at a configurable
+rate, but false negatives are not.
+"""
+
+from __future__ import annotations
+
+import logging
+import math
+import os
+from pathlib import Path
+from pprint import pprint as pp
+import struct
+from typing import Optional
+
+from .database import DB
+from .exceptions import MimicryError
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'MIMBLM01'
+HEADER = struct.Struct('<8sQQQd')
+
+
+def filter_path(db_path: Path) -> Path:
+    """
+    Path to the filter file kept alongside the given database file.
+    """
+    return db_path.with_suffix('.bloom')
+
+
+def remove_filter(db: DB) -> None:
+    """
+    Delete any filter saved alongside database, before it can go stale.
+
+    A filter that misses hashes added since it was written would give
+    false negatives, so every update removes it, and only those updates
+    asked for a filter write a fresh one once finished.
+    """
+    path = filter_path(db.path)
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        return
+    logger.debug("Removed filter: %s", path)
+
+
+def write_filter(db: DB, error_rate: float, path: Optional[Path]=None) -> Path:
+    """
+    Build filter from every hashed file in database, and save it to disk.
+
+    Args:
+        db (DB): Database to read hashes from.
+        error_rate (float): Acceptable rate of false positives, eg. 0.01
+        path (Path): Filter file to write, defaults to alongside database.
+
+    Returns:
+        Path to filter file.
+    """
+    path = filter_path(db.path) if path is None else path
+    bloom = BloomFilter(db.files_count(), error_rate)
+    for sha256 in db.hashes():
+        bloom.add(sha256)
+    bloom.save(path)
+    logger.info(f"Saved filter of {bloom.count:,} hashes to: {path}")
+    return path
+
+
+class BloomFilter:
+    """
+    Bloom filter of binary hashes.
+
+    The hashes stored are already uniformly distributed, so the bit
+    positions are taken directly from them, by double hashing with two
+    64-bit slices, rather than hashing them again.
+    """
+    def __init__(self, capacity: int, error_rate: float=0.01):
+        """
+        Initialiser.
+
+        Args:
+            capacity (int): Expected number of hashes to be added.
+            error_rate (float): Acceptable rate of false positives.
+        """
+        if not 0.0 < error_rate < 1.0:
+            raise ValueError(f"Error rate must be between zero and one, given: {error_rate}")
+        capacity = max(capacity, 1)
+        self.error_rate = error_rate
+        self.num_bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.count = 0
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def __contains__(self, sha256: bytes) -> bool:
+        bits = self.bits
+        for position in self._positions(sha256):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def __len__(self) -> int:
+        return self.count
+
+    def add(self, sha256: bytes) -> None:
+        bits = self.bits
+        for position in self._positions(sha256):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    @classmethod
+    def load(cls, path: Path) -> BloomFilter:
+        """
+        Load filter previously saved to the given path.
+        """
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+            if len(header) != HEADER.size or header[:len(MAGIC)] != MAGIC:
+                raise MimicryError(f"Not a filter file: '{path!s}'")
+            _, num_bits, num_hashes, count, error_rate = HEADER.unpack(header)
+            bits = bytearray(f.read())
+        if len(bits) != (num_bits + 7) // 8:
+            raise MimicryError(f"Truncated filter file: '{path!s}'")
+        bloom = cls.__new__(cls)
+        bloom.error_rate = error_rate
+        bloom.num_bits = num_bits
+        bloom.num_hashes = num_hashes
+        bloom.count = count
+        bloom.bits = bits
+        return bloom
+
+    def save(self, path: Path) -> None:
+        """
+        Save filter to the given path, replacing any existing file.
+        """
+        temporary = path.with_name(path.name + '.tmp')
+        header = HEADER.pack(
+            MAGIC, self.num_bits, self.num_hashes, self.count, self.error_rate)
+        with open(temporary, 'wb') as f:
+            f.write(header)
+            f.write(self.bits)
+        os.replace(temporary, path)
+
+    def _positions(self, sha256: bytes):
+        h1 = int.from_bytes(sha256[:8], 'little')
+        h2 = int.from_bytes(sha256[8:16], 'little') | 1
+        num_bits = self.num_bits
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % num_bits
@@ -0,0 +1,186 @@
+"""
+Search the databases of many drives at once.
+"""
+
+import heapq
+import itertools
+import logging
+from operator import itemgetter
+from pathlib import Path
+from pprint import pprint as pp
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from .bloom import BloomFilter, filter_path
+from .database import DB, FileRecord
+from .exceptions import MimicryError, NotAFile
+from .hashing import DEFAULT_ALGORITHM
+from .links import distinct
+
+
+logger = logging.getLogger(__name__)
+
+
+class Catalog:
+    """
+    Collection of `mimicry.db` files, usually one per removable drive.
+
+    Databases are never loaded into memory. Each one streams its hashes
+    out of its index, in order, and the streams are merged together.
+    SQLite's ATTACH could do the same job inside a single query, but
+    it is limited to ten databases by default, whereas we have dozens.
+
+    Databases are opened read-only, and never upgraded - run an update
+    on any whose schema is out-of-date.
+    """
+    def __init__(self, paths: Iterable[Path]):
+        """
+        Initialiser.
+
+        Databases are only opened when first needed.
+
+        Args:
+            paths: Paths to existing database files.
+        """
+        self.paths = [Path(path) for path in paths]
+        for path in self.paths:
+            if not path.is_file():
+                raise NotAFile(f"Database not found: '{path!s}'")
+        self._dbs: Dict[int, DB] = {}
+
+    def close(self) -> None:
+        for db in self._dbs.values():
+            db.connection.close()
+        self._dbs.clear()
+
+    def db(self, index: int) -> DB:
+        """
+        Return database with given index, opening it if needed.
+        """
+        if index not in self._dbs:
+            logger.debug("Open database: %s", self.paths[index])
+            self._dbs[index] = DB(self.paths[index], readonly=True)
+        return self._dbs[index]
+
+    def duplicate_groups(
+        self, across: bool=True, hardlinks: bool=True,
+    ) -> Iterator[List[Tuple[str, FileRecord]]]:
+        """
+        Generate groups of files with identical contents, from every database.
+
+        Databases are only read, never written to, as they may be copies, or
+        belong to drives not connected. Files without a full hash, eg. from
+        lazy updates, are left out, with a warning giving their number.
+
+        Args:
+            across (bool):
+                Only yield groups spread over more than one database. If
+                false, duplicates found within a single database are
+                yielded too.
+            hardlinks (bool):
+                Include every hard link to a file. If false, only the first
+                name of each file in each database is kept.
+
+        Yields:
+            List of 2-tuples, the database's label and a `FileRecord`.
+
+        Raises:
+            MimicryError: If databases use different hash algorithms.
+        """
+        self.check_algorithms()
+        streams = []
+        for index in range(len(self.paths)):
+            db = self.db(index)
+            unhashed = db.unhashed_count()
+            if unhashed:
+                logger.warning(
+                    "Leaving out %s files without a hash from '%s', "
+                    "update it without '--lazy' to include them", f"{unhashed:,}", db.label)
+            streams.append(zip(db.hashes(), itertools.repeat(index)))
+
+        for sha256, group in itertools.groupby(heapq.merge(*streams), key=itemgetter(0)):
+            count = 0
+            indexes = set()
+            for _, index in group:
+                count += 1
+                indexes.add(index)
+            if count < 2 or (across and len(indexes) < 2):
+                continue
+            found = {index: self.db(index).find(sha256) for index in sorted(indexes)}
+            if not hardlinks:
+                found = {index: distinct(records) for index, records in found.items()}
+                if sum(map(len, found.values())) < 2:
+                    continue
+            yield [
+                (self.db(index).label, record)
+                for index, records in found.items()
+                for record in records
+            ]
+
+    def check_algorithms(self) -> str:
+        """
+        Check that every database uses the same hash algorithm.
+
+        Hashes from different algorithms never match, so comparing such
+        databases would silently find nothing.
+
+        Raises:
+            MimicryError: If algorithms differ.
+
+        Returns:
+            Name of the common algorithm.
+        """
+        algorithms: Dict[str, List[str]] = {}
+        for index in range(len(self.paths)):
+            db = self.db(index)
+            algorithms.setdefault(db.algorithm, []).append(db.label)
+        if len(algorithms) > 1:
+            used = '; '.join(
+                f"{algorithm}: {', '.join(labels)}"
+                for algorithm, labels in sorted(algorithms.items()))
+            message = (
+                f"Databases use different hash algorithms ({used}). "
+                "Update them with the same '--algorithm' to re-hash.")
+            raise MimicryError(message)
+        return next(iter(algorithms), DEFAULT_ALGORITHM)
+
+    @property
+    def labels(self) -> List[str]:
+        return [self.db(index).label for index in range(len(self.paths))]
+
+    def locate(self, hashes: Iterable[bytes]) -> Dict[bytes, List[Tuple[str, FileRecord]]]:
+        """
+        Find which databases hold files with any of the given hashes.
+
+        Each database's filter, if it has one, is checked first. Only those
+        databases whose filters match at least one hash are opened, to
+        confirm the match and fetch the file records. Databases without a
+        filter are always opened. Filters are removed by any update that
+        does not write a fresh one, so are never stale.
+
+        Files without a hash, eg. from lazy updates, cannot be found.
+
+        Args:
+            hashes: Binary hashes to look for.
+
+        Returns:
+            Dictionary of confirmed matches, keyed by hash, of lists of
+            2-tuples, the database's label and a `FileRecord`.
+        """
+        hashes = list(dict.fromkeys(hashes))
+        found: Dict[bytes, List[Tuple[str, FileRecord]]] = {}
+        for index, path in enumerate(self.paths):
+            candidates = hashes
+            bloom_path = filter_path(path)
+            if bloom_path.exists():
+                bloom = BloomFilter.load(bloom_path)
+                candidates = [sha256 for sha256 in hashes if sha256 in bloom]
+            else:
+                logger.debug("No filter found for: %s", path)
+            if not candidates:
+                continue
+
+            db = self.db(index)
+            for sha256 in candidates:
+                for record in db.find(sha256):
+                    found.setdefault(sha256, []).append((db.label, record))
+        return found
@@ -0,0 +1,159 @@
+"""
+Split files into content-defined chunks, to find files sharing most bytes.
+
+Whole-file hashes only find exact copies. Virtual machine images, archives,
+and edited videos may share nearly all their contents without being equal.
+Cutting every file into chunks where the *contents* say so, rather than at
+fixed offsets, means an insertion near the start of a file only changes the
+chunks around it: the rest are cut in the same places, and hash the same.
+
+Cut points are found using a 'gear' rolling hash, as described for FastCDC:
+the first `min_size` bytes of each chunk are skipped, a stricter mask is
+used until the chunk reaches `avg_size`, and a looser one after, keeping
+chunk sizes close to average. Chunks never exceed `max_size`.
+
+The chunker is fed the same buffers used to calculate a file's full hash,
+see `File`, so no file is read twice.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+import hashlib
+import logging
+from pprint import pprint as pp
+import random
+from typing import List
+
+
+logger = logging.getLogger(__name__)
+
+# Bytes in the hash of each chunk
+CHUNK_DIGEST_SIZE = 16
+
+# Default limits on the sizes of chunks, in bytes
+MIN_SIZE = 16 * 1024
+AVG_SIZE = 64 * 1024
+MAX_SIZE = 256 * 1024
+
+# Random, but fixed, value for every byte. Changing these changes every chunk!
+_rng = random.Random(0x6d696d696372)
+GEAR = tuple(_rng.getrandbits(64) for _ in range(256))
+del _rng
+
+MASK_64 = 2**64 - 1
+
+
+@dataclass(frozen=True)
+class Chunk:
+    """
+    Single content-defined chunk of a file.
+    """
+    offset: int
+    size: int
+    digest: bytes
+
+
+def threshold(bits: int) -> int:
+    """
+    Hashes below this have their given number of highest bits all zero.
+
+    High bits of a gear hash depend on more of the preceding bytes than low
+    bits do, so make for a wider rolling window. Comparing against a
+    threshold is the same as masking those bits, only quicker.
+    """
+    return 1 << (64 - bits)
+
+
+class Chunker:
+    """
+    Find content-defined chunks in data fed to it, one buffer at a time.
+    """
+    def __init__(self, min_size: int=MIN_SIZE, avg_size: int=AVG_SIZE, max_size: int=MAX_SIZE):
+        if not 0 < min_size <= avg_size <= max_size:
+            raise ValueError(
+                f"Chunk sizes must increase, given: {min_size}, {avg_size}, {max_size}")
+        self.min_size = min_size
+        self.avg_size = avg_size
+        self.max_size = max_size
+        bits = avg_size.bit_length() - 1
+        self.threshold_small = threshold(bits + 2)
+        self.threshold_large = threshold(max(bits - 2, 1))
+        self.chunks: List[Chunk] = []
+        self._offset = 0                    # Offset of current chunk in file
+        self._length = 0                    # Bytes in current chunk so far
+        self._hash = 0
+        self._hasher = self._new_hasher()
+
+    def feed(self, data: memoryview) -> None:
+        """
+        Find chunks in the next buffer of data.
+
+        Only the data's contents are used, during the call, so the buffer
+        may be reused afterwards. Rolling the hash is pure Python, so runs at
+        a few megabytes per second, holding the GIL, unlike hashing.
+        """
+        gear = GEAR
+        start = 0
+        position = 0
+        end = len(data)
+        while position < end:
+            # Skip minimum size, no chunk can end within it
+            if self._length < self.min_size:
+                skip = min(self.min_size - self._length, end - position)
+                position += skip
+                self._length += skip
+                continue
+
+            # Roll hash until a cut point, the chunk's limit, or end of data
+            if self._length < self.avg_size:
+                below = self.threshold_small
+                limit = min(end, position + self.avg_size - self._length)
+            else:
+                below = self.threshold_large
+                limit = min(end, position + self.max_size - self._length)
+            h = self._hash
+            cut = None
+            for index, byte in enumerate(data[position:limit], position + 1):
+                h = ((h << 1) + gear[byte]) & MASK_64
+                if h < below:
+                    cut = index
+                    break
+            self._hash = h
+            stop = limit if cut is None else cut
+            self._length += stop - position
+            position = stop
+            if cut is not None or self._length >= self.max_size:
+                self._hasher.update(data[start:position])
+                start = position
+                self._cut()
+        self._hasher.update(data[start:end])
+
+    def finish(self) -> List[Chunk]:
+        """
+        End the final chunk, if any, returning every chunk found.
+        """
+        if self._length:
+            self._cut()
+        return self.chunks
+
+    def _cut(self) -> None:
+        self.chunks.append(Chunk(self._offset, self._length, self._hasher.digest()))
+        self._offset += self._length
+        self._length = 0
+        self._hash = 0
+        self._hasher = self._new_hasher()
+
+    def _new_hasher(self):
+        return hashlib.blake2b(digest_size=CHUNK_DIGEST_SIZE)
+
+
+def chunk_bytes(data: bytes, **kwargs) -> List[Chunk]:
+    """
+    Split bytes already in memory into chunks.
+
+    Keyword arguments are passed to `Chunker`.
+    """
+    chunker = Chunker(**kwargs)
+    chunker.feed(memoryview(data))
+    return chunker.finish()
@@ -0,0 +1,209 @@
+"""
+Confirm duplicates by comparing files byte-for-byte, without hashing.
+
+Candidate files, those sharing a size, are read together, a chunk at a
+time, and split into smaller groups as soon as their chunks differ. Like
+`filecmp.cmp()`, but for any number of files at once. A large file that
+differs from the others early on costs a single chunk, rather than a full
+pass to hash it.
+
+Chunks start small, as most differences show up early, and double with
+each read, up to a limit. Every file in a group must be open at once, so
+very large groups are first split by hash, see `identical()`.
+"""
+
+from collections import defaultdict
+import logging
+from pathlib import Path
+from pprint import pprint as pp
+from typing import BinaryIO, Dict, Iterable, Iterator, List
+
+from .database import DB, FileRecord
+from .exceptions import NotAFile
+from .file import File
+from .links import distinct
+
+
+logger = logging.getLogger(__name__)
+
+# Most files open at once, per group compared
+MAX_OPEN = 64
+
+# Limits on bytes read from each file at a time
+CHUNK_SIZE_MIN = 64 * 1024
+CHUNK_SIZE_MAX = 1024 * 1024
+
+
+def identical(paths: Iterable[Path], max_open: int=MAX_OPEN) -> List[List[Path]]:
+    """
+    Find groups of files with identical contents, among those given.
+
+    Args:
+        paths:
+            Files to compare, usually all of the same size.
+        max_open:
+            Most files to hold open at once. Larger groups are split by
+            fingerprint, then by full hash, until small enough to compare.
+
+    Returns:
+        List of groups of two or more paths, in the order given. Files that
+        cannot be read are left out.
+    """
+    paths = list(paths)
+    if len(paths) < 2:
+        return []
+    if len(paths) > max_open:
+        return _identical_hashed(paths, max_open)
+
+    files: Dict[Path, BinaryIO] = {}
+    try:
+        for path in paths:
+            try:
+                files[path] = open(path, 'rb')
+            except OSError as e:
+                logger.warning("Could not compare %s: %s", path, e)
+        confirmed = _compare(files)
+    finally:
+        for file_ in files.values():
+            file_.close()
+
+    # Restore given order
+    order = {path: index for index, path in enumerate(paths)}
+    confirmed.sort(key=lambda group: order[group[0]])
+    return confirmed
+
+
+def duplicate_groups(
+    db: DB,
+    hardlinks: bool=True,
+    max_open: int=MAX_OPEN,
+) -> Iterator[List[FileRecord]]:
+    """
+    Generate lists of records for files with identical contents.
+
+    An alternative to `DB.duplicate_groups()` that needs no hashes at all,
+    suited to databases updated lazily, where most files have none. Files
+    are compared in groups of the same size. Groups whose every file has
+    already been hashed are split by hash instead, without reading any.
+
+    Args:
+        db:
+            Database to search, whose files must be present on disk.
+        hardlinks:
+            As for `DB.duplicate_groups()`. Each file is only read once,
+            whatever the number of its hard links.
+        max_open:
+            See `identical()`.
+    """
+    for records in db.size_groups():
+        if all(record.algorithm == db.algorithm for record in records):
+            yield from _split_hashed(records, hardlinks)
+            continue
+
+        # Compare one name per file, expanding links again afterwards
+        links: Dict[Path, List[FileRecord]] = {}
+        first: Dict[tuple, Path] = {}
+        for record in records:
+            path = db.root / record.relpath
+            if record.device is not None and record.inode is not None:
+                path = first.setdefault((record.device, record.inode), path)
+            links.setdefault(path, []).append(record)
+
+        grouped = set()
+        for group in identical(links, max_open):
+            grouped.update(group)
+            if hardlinks:
+                yield [record for path in group for record in links[path]]
+            else:
+                yield [links[path][0] for path in group]
+
+        if hardlinks:
+            for path, linked in links.items():
+                if path not in grouped and len(linked) > 1:
+                    yield linked
+
+
+def _compare(files: Dict[Path, BinaryIO]) -> List[List[Path]]:
+    """
+    Read open files in lockstep, splitting them up wherever they differ.
+
+    Files are closed, and removed from `files`, as soon as they are found
+    to match no other.
+    """
+    confirmed = []
+    groups = [list(files)]
+    chunk_size = CHUNK_SIZE_MIN
+    while groups:
+        remaining = []
+        for group in groups:
+            for chunk, subgroup in _read_chunks(files, group, chunk_size).items():
+                if len(subgroup) < 2:
+                    for path in subgroup:
+                        files.pop(path).close()
+                elif not chunk:
+                    # End of every file reached together
+                    confirmed.append(subgroup)
+                else:
+                    remaining.append(subgroup)
+        groups = remaining
+        chunk_size = min(chunk_size * 2, CHUNK_SIZE_MAX)
+    return confirmed
+
+
+def _read_chunks(
+    files: Dict[Path, BinaryIO],
+    group: List[Path],
+    chunk_size: int,
+) -> Dict[bytes, List[Path]]:
+    """
+    Read next chunk of every file in group, grouping files by its contents.
+
+    Files that cannot be read are closed, and removed from `files`.
+    """
+    chunks: Dict[bytes, List[Path]] = defaultdict(list)
+    for path in group:
+        try:
+            chunks[files[path].read(chunk_size)].append(path)
+        except OSError as e:
+            logger.warning("Could not compare %s: %s", path, e)
+            files.pop(path).close()
+    return chunks
+
+
+def _identical_hashed(paths: List[Path], max_open: int) -> List[List[Path]]:
+    """
+    Split too large a group by fingerprint, then by full hash if need be.
+    """
+    confirmed = []
+    for subgroup in _split_by(paths, 'fingerprint'):
+        if len(subgroup) <= max_open:
+            confirmed.extend(identical(subgroup, max_open))
+        else:
+            confirmed.extend(_split_by(subgroup, 'sha256'))
+    return [group for group in confirmed if len(group) > 1]
+
+
+def _split_by(paths: List[Path], attribute: str) -> List[List[Path]]:
+    """
+    Group paths by the given `File` attribute, dropping unreadable files.
+    """
+    groups: Dict[bytes, List[Path]] = defaultdict(list)
+    for path in paths:
+        try:
+            groups[getattr(File(path), attribute)].append(path)
+        except (NotAFile, OSError) as e:
+            logger.warning("Could not hash %s: %s", path, e)
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def _split_hashed(records: List[FileRecord], hardlinks: bool) -> List[List[FileRecord]]:
+    """
+    Group records already hashed by their hashes.
+    """
+    groups: Dict[bytes, List[FileRecord]] = defaultdict(list)
+    for record in records:
+        if record.sha256 is not None:
+            groups[record.sha256].append(record)
+    if not hardlinks:
+        groups = {sha256: distinct(group) for sha256, group in groups.items()}
+    return [group for group in groups.values() if len(group) > 1]
@@ -2,17 +2,26 @@
 from __future__ import annotations
 
 from collections import defaultdict
+from contextlib import contextmanager
 from dataclasses import dataclass
+import itertools
 import logging
-from os.path import join, split
+from os.path import basename, join, split
 from pathlib import Path
 from pprint import pprint as pp
 import sqlite3
 import textwrap
-from typing import Iterator, Optional
+import threading
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
-from .exceptions import NotUnderRoot
+from .chunking import Chunk
+from .exceptions import MimicryError, NotAFile, NotUnderRoot
 from .file import File
+from .hashing import DEFAULT_ALGORITHM, new as new_hasher
+from .links import distinct
+from .throttle import Throttle
+from .tree import TreeEntry
+from .utils import chunked
 
 
 logger = logging.getLogger(__name__)
@@ -26,8 +35,16 @@ class FileRecord:
     name: str
     relpath: str
     size: int
-    mtime: int
-    sha256: bytes
+    mtime: float
+    sha256: Optional[bytes] = None
+    fingerprint: Optional[bytes] = None
+    mtime_ns: Optional[int] = None
+    ctime_ns: Optional[int] = None
+    inode: Optional[int] = None
+    algorithm: Optional[str] = None
+    device: Optional[int] = None
+    chunked: Optional[int] = None           # Number of chunks stored, if any
+    chunks: Optional[List[Chunk]] = None    # Chunks to be stored
 
     @classmethod
     def from_database(cls, row: dict) -> FileRecord:
@@ -44,9 +61,50 @@ class FileRecord:
             'size': row['size'],
             'mtime': row['mtime'],
             'sha256': row['sha256'],
+            'fingerprint': row['fingerprint'],
+            'mtime_ns': row['mtime_ns'],
+            'ctime_ns': row['ctime_ns'],
+            'inode': row['inode'],
+            'algorithm': row['algorithm'],
+            'device': row['device'],
+            'chunked': row['chunked'],
         }
         return cls(**kwargs)
 
+    @classmethod
+    def from_file(cls, file_: File, root: Path, hashes: bool=False) -> FileRecord:
+        """
+        Create object from file on disk.
+
+        Args:
+            file_ (File): File to read metadata from.
+            root (Path): Root folder of database.
+            hashes (bool): Calculate file's hashes too.
+        """
+        relpath = file_.relative_to(root)
+        record = cls.from_entry(TreeEntry.from_stat(relpath, file_.path.stat()))
+        if hashes:
+            record.fingerprint = file_.fingerprint
+            record.sha256 = file_.sha256
+            record.algorithm = file_.algorithm
+        return record
+
+    @classmethod
+    def from_entry(cls, entry: TreeEntry) -> FileRecord:
+        """
+        Create object, without any hashes, from file tree entry.
+        """
+        return cls(
+            name=basename(entry.relpath),
+            relpath=entry.relpath,
+            size=entry.size,
+            mtime=entry.mtime,
+            mtime_ns=entry.mtime_ns,
+            ctime_ns=entry.ctime_ns,
+            inode=entry.inode,
+            device=entry.device,
+        )
+
 
 class DB:
     """
@@ -59,38 +117,252 @@ class DB:
     It is an error to try and perform operations outside the file tree's
     root. A `NotUnderRoot` exception will be raised if attempted.
     """
-    def __init__(self, path: Path, verbose: bool=False):
+    # Version of database structure, stored using SQLite's `user_version`
+    schema_version = 8
+
+    # SQL expression identifying a file, the same for all its hard links
+    file_key = "coalesce(device || ':' || inode, id)"
+
+    # Statements to upgrade an existing database *to* the given version
+    migrations = {
+        1: (
+            "ALTER TABLE files ADD COLUMN fingerprint BLOB;",
+        ),
+        2: (
+            "ALTER TABLE files ADD COLUMN mtime_ns INTEGER;",
+            "ALTER TABLE files ADD COLUMN ctime_ns INTEGER;",
+            "ALTER TABLE files ADD COLUMN inode INTEGER;",
+        ),
+        3: (
+            textwrap.dedent("""
+                CREATE TABLE queue (
+                    relpath TEXT PRIMARY KEY,
+                    size    INTEGER
+                );
+            """),
+        ),
+        4: (
+            "CREATE INDEX files_folder_name ON files(folder, name);",
+        ),
+        5: (
+            "CREATE INDEX files_sha256_size ON files(sha256, size);",
+            "CREATE INDEX files_size_fingerprint ON files(size, fingerprint);",
+        ),
+        6: (
+            "ALTER TABLE files ADD COLUMN algorithm TEXT;",
+            "UPDATE files SET algorithm='sha256' WHERE sha256 IS NOT NULL;",
+            # Very old databases have no metadata table at all
+            textwrap.dedent("""
+                CREATE TABLE IF NOT EXISTS metadata (
+                    id              INTEGER PRIMARY KEY,
+                    label           TEXT NOT NULL,
+                    root            TEXT NOT NULL,
+                    device_model    TEXT,
+                    device_serial   TEXT,
+                    created         INTEGER NOT NULL,
+                    updated         INTEGER NOT NULL,
+                    CHECK (rowid=1)
+                );
+            """),
+            "ALTER TABLE metadata ADD COLUMN algorithm TEXT NOT NULL DEFAULT 'sha256';",
+        ),
+        7: (
+            "ALTER TABLE files ADD COLUMN device INTEGER;",
+            "CREATE INDEX files_device_inode ON files(device, inode);",
+        ),
+        8: (
+            "ALTER TABLE files ADD COLUMN chunked INTEGER;",
+            textwrap.dedent("""
+                CREATE TABLE chunks (
+                    file    INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+                    offset  INTEGER NOT NULL,
+                    size    INTEGER NOT NULL,
+                    digest  BLOB NOT NULL,
+                    PRIMARY KEY (file, offset)
+                ) WITHOUT ROWID;
+            """),
+            "CREATE INDEX chunks_digest ON chunks(digest);",
+        ),
+    }
+
+    def __init__(
+        self,
+        path: Path,
+        verbose: bool=False,
+        algorithm: Optional[str]=None,
+        readonly: bool=False,
+    ):
         """
         Open existing, or create database file.
 
         Args:
             path (Path): Path to database file
+            algorithm (str):
+                Hash algorithm for a new database, defaults to SHA-256.
+                Ignored if the database already has one, see `rehash()`.
+            readonly (bool):
+                Open an existing database without ever writing to it, eg.
+                a copy, or one on a write-protected drive. Its schema must
+                be up-to-date, as it cannot be upgraded.
         """
         self.path = path.resolve()
-        self.root = path.parent
+        self.root = self.path.parent
+        self.readonly = readonly
         if not self.root.is_dir():
             message = f"Database root must be an existing folder: '{self.root!s}'"
             raise RuntimeError(message)
-        self.connection = self._connect(path, verbose=verbose)
-        self._check_schema()
+        if readonly and not self.path.is_file():
+            raise NotAFile(f"Database not found: '{self.path!s}'")
+        self.connection = self._connect(self.path, verbose=verbose)
+        if readonly:
+            self._check_version()
+            created = False
+        else:
+            created = self._check_schema()
         self._run_pragmas()
+        metadata = self.metadata()
+        if metadata is not None:
+            algorithm = metadata['algorithm']
+        self.algorithm = algorithm or DEFAULT_ALGORITHM
+        new_hasher(self.algorithm)
+        if created:
+            self._create_metadata()
+
+        # Limits on reading files hashed by database itself, eg. lazily
+        self.throttle: Optional[Throttle] = None
+        self._folder_ids: Dict[str, int] = {}
+        self._load_folder_ids()
+        self._readers = threading.local()
 
-    def add(self, path: Path) -> None:
+    def add(self, path: Path, lazy: bool=False) -> None:
         """
         Add or update single file record in database.
 
         Args:
             path (str): Absolute path to the file
+            lazy (bool):
+                Only calculate the file's hash if another record already has
+                the same size. Files without a size twin cannot be duplicates,
+                so their contents need not be read at all.
         """
         file_ = File(path)
         logger.info(f"Add: %s", path)
+        self.add_many([FileRecord.from_file(file_, self.root)], lazy=lazy)
+
+    def add_many(
+        self,
+        records: Iterable[FileRecord],
+        lazy: bool=False,
+        batch_size: int=1000,
+        on_batch: Optional[Callable[[List[FileRecord]], None]]=None,
+    ) -> int:
+        """
+        Add or update many file records, in batches.
+
+        Each batch is written in its own transaction, using `executemany()`
+        for each statement. Any hashes missing from the given records are
+        calculated as they would be by `add()`. Hashes already present are
+        used as-is, allowing them to be calculated elsewhere - in other
+        threads, for example.
+
+        Args:
+            records (Iterable[FileRecord]):
+                Metadata for files under database root.
+            lazy (bool):
+                See `add()`.
+            batch_size (int):
+                Maximum number of records written per transaction.
+            on_batch (callable):
+                Optional function called with each batch of records, once
+                it has been written.
+
+        Records are removed from the queue of files pending update as they are
+        written, in the same transaction, making every batch a checkpoint
+        from which an interrupted update can resume.
+
+        Returns:
+            Number of records written.
+        """
+        num_added = 0
         cursor = self.connection.cursor()
-        cursor.execute('SAVEPOINT add_file;')
+        for batch in chunked(records, batch_size):
+            cursor.execute('SAVEPOINT add_many;')
+            try:
+                self._do_add(cursor, batch, lazy)
+                cursor.execute("RELEASE add_many;")
+            except sqlite3.Error:
+                cursor.execute("ROLLBACK TO add_many;")
+                cursor.execute("RELEASE add_many;")
+                self._load_folder_ids()
+                raise
+            num_added += len(batch)
+            logger.debug(f"Wrote batch of {len(batch):,} records")
+            if on_batch is not None:
+                on_batch(batch)
+        return num_added
+
+    def backfill(self, entries: Iterable[TreeEntry]) -> None:
+        """
+        Save file metadata missing from the records of unchanged files.
+
+        Records written before nanosecond times, inodes, and devices were
+        stored lack them until their files change. Filling them in from a
+        fresh stat turns on full change detection, and hard link detection,
+        for those records, without reading any files. Hashes are untouched.
+        """
+        query = textwrap.dedent("""
+            UPDATE files SET
+                mtime_ns=:mtime_ns, ctime_ns=:ctime_ns, inode=:inode, device=:device
+                WHERE name=:name
+                    AND folder=(SELECT id FROM folders WHERE relpath=:folder);
+        """).strip()
+        parameters = []
+        for entry in entries:
+            folder, name = split(entry.relpath)
+            parameters.append({
+                'name': name,
+                'folder': folder,
+                'mtime_ns': entry.mtime_ns,
+                'ctime_ns': entry.ctime_ns,
+                'inode': entry.inode,
+                'device': entry.device,
+            })
+        cursor = self.connection.cursor()
+        cursor.execute('BEGIN;')
+        try:
+            cursor.executemany(query, parameters)
+            cursor.execute('COMMIT;')
+        except sqlite3.Error:
+            cursor.execute('ROLLBACK;')
+            raise
+        logger.debug(f"Filled in metadata for {len(parameters):,} records")
+
+    def dequeue(self, relpaths: Iterable[str]) -> None:
+        """
+        Remove files from the queue of files pending update.
+        """
+        query = "DELETE FROM queue WHERE relpath=?;"
+        self.connection.executemany(query, ((relpath,) for relpath in relpaths))
+
+    def delete_many(self, relpaths: Iterable[str]) -> None:
+        """
+        Delete file records with the given relative paths, in one transaction.
+        """
+        query = textwrap.dedent("""
+            DELETE FROM files
+                WHERE name=? AND folder=(SELECT id FROM folders WHERE relpath=?);
+        """).strip()
+        parameters = []
+        for relpath in relpaths:
+            folder, name = split(relpath)
+            parameters.append((name, folder))
+        cursor = self.connection.cursor()
+        cursor.execute('BEGIN;')
         try:
-            self._do_add(cursor, file_)
-            cursor.execute("RELEASE add_file;")
+            cursor.executemany(query, parameters)
+            cursor.execute('COMMIT;')
         except sqlite3.Error:
-            cursor.execute("ROLLBACK TO add_file;")
+            cursor.execute('ROLLBACK;')
             raise
 
     def delete(self, path: Path) -> None:
@@ -103,33 +375,80 @@ class DB:
         self.connection.execute('DELETE FROM files WHERE id=?;', (pk,))
         self.connection.commit()
 
-    def duplicates(self) -> defaultdict:
+    def duplicate_groups(self, hardlinks: bool=True) -> Iterator[List[FileRecord]]:
         """
-        Iterate over duplicate files.
+        Generate lists of records for files with identical contents.
+
+        Args:
+            hardlinks (bool):
+                Include every hard link to a file. If false, only the first
+                name of each file is kept, and groups made up of nothing
+                but links to one file are skipped, leaving only duplicates
+                whose removal would free space.
+
+        Hashes are read in order from an index, and the records for each
+        duplicated hash fetched as soon as it is found, so the first group
+        is yielded almost immediately and memory use stays constant. Hashes
+        are read from a snapshot of the database, so it is safe to write to
+        the database between groups.
+
+        Records added lazily that have since gained a size twin are hashed
+        first, so that no duplicates are missed.
         """
-        duplicates: defaultdict = defaultdict(list)
+        self.hash_pending()
+        for sha256, repeats in itertools.groupby(self.hashes()):
+            next(repeats)
+            if next(repeats, None) is None:
+                continue
+            group = self.find(sha256)
+            if not hardlinks:
+                group = distinct(group)
+                if len(group) < 2:
+                    continue
+            yield group
 
-        query = ("SELECT count(*) AS count, sha256, size FROM "
-                 "files GROUP BY sha256 HAVING count > 1;")
+    def duplicates(self, hardlinks: bool=True) -> defaultdict:
+        """
+        Return all duplicate files, as lists of records keyed by hash.
 
-        query = ("SELECT * FROM files WHERE sha256 IN "
-                 "(SELECT sha256 FROM files GROUP BY sha256 HAVING count(*) > 1);")
-        for row in self.connection.execute(query):
-            f = FileRecord.from_database(row)
-            duplicates[f.sha256].append(f)
+        Prefer `duplicate_groups()` for large databases.
+        """
+        duplicates: defaultdict = defaultdict(list)
+        for group in self.duplicate_groups(hardlinks):
+            duplicates[group[0].sha256] = group
         return duplicates
 
-    def files(self) -> Iterator[FileRecord]:
+    def files(self, ordered: bool=False) -> Iterator[FileRecord]:
         """
         Iterate over every file in database.
+
+        Args:
+            ordered (bool):
+                Order files by their folder's relpath, then by name, to match
+                `Tree.entries(ordered=True)`. Files are read from a separate
+                connection, holding a snapshot of the database taken when
+                iteration starts. This allows records to be written while
+                iterating, without the changes being seen.
         """
+        if not ordered:
+            query = textwrap.dedent("""
+                SELECT files.*, relpath
+                    FROM files INNER JOIN folders ON files.folder = folders.id
+            """).strip()
+            for row in self.connection.execute(query):
+                data = dict(row)
+                yield FileRecord.from_database(data)
+            return
+
+        # Folders first, to scan both indexes in order, without sorting
         query = textwrap.dedent("""
-            SELECT name, size, mtime, sha256, updated, relpath
-                FROM files INNER JOIN folders ON files.folder = folders.id
+            SELECT files.*, relpath
+                FROM folders CROSS JOIN files ON files.folder = folders.id
+                ORDER BY folders.relpath, files.name;
         """).strip()
-        for row in self.connection.execute(query):
-            data = dict(row)
-            yield FileRecord.from_database(data)
+        with self._snapshot() as connection:
+            for row in connection.execute(query):
+                yield FileRecord.from_database(row)
 
     def files_count(self) -> int:
         """
@@ -138,13 +457,235 @@ class DB:
         cursor = self.connection.execute("SELECT count(*) FROM files;")
         return int(cursor.fetchone()[0])
 
+    def unhashed_count(self) -> int:
+        """
+        Return the number of file records without a full hash.
+        """
+        cursor = self.connection.execute("SELECT count(*) FROM files WHERE sha256 IS NULL;")
+        return int(cursor.fetchone()[0])
+
     def files_size(self) -> int:
         """
         Return sum of the bytes accross of all file records.
         """
-        cursor = self.connection.execute("SELECT sum(size) FROM files;")
+        cursor = self.connection.execute("SELECT coalesce(sum(size), 0) FROM files;")
         return int(cursor.fetchone()[0])
 
+    def find(self, sha256: bytes) -> List[FileRecord]:
+        """
+        Return records for every file with the given hash.
+        """
+        query = textwrap.dedent("""
+            SELECT files.*, relpath
+                FROM files INNER JOIN folders ON files.folder = folders.id
+                WHERE sha256=?
+                ORDER BY relpath, name;
+        """).strip()
+        rows = self.connection.execute(query, (sha256,))
+        return [FileRecord.from_database(row) for row in rows]
+
+    def hash_records(self) -> Iterator[Tuple[bytes, int, int]]:
+        """
+        Generate hash, size, and id of every hashed file, in hash order.
+
+        Read from a covering index, from a snapshot of the database.
+        """
+        query = "SELECT sha256, size, id FROM files WHERE sha256 IS NOT NULL ORDER BY sha256;"
+        with self._snapshot() as connection:
+            for row in connection.execute(query):
+                yield tuple(row)
+
+    def hashes(self) -> Iterator[bytes]:
+        """
+        Generate the hash of every hashed file, in order, including repeats.
+
+        Read from an index, from a snapshot of the database.
+        """
+        query = "SELECT sha256 FROM files WHERE sha256 IS NOT NULL ORDER BY sha256;"
+        with self._snapshot() as connection:
+            for (sha256,) in connection.execute(query):
+                yield sha256
+
+    @property
+    def label(self) -> str:
+        """
+        User label for database, or the path to its root if it has none.
+        """
+        metadata = self.metadata()
+        if metadata is None:
+            return str(self.root)
+        return str(metadata['label'])
+
+    def linked(self, entry: TreeEntry, chunks: bool=False) -> Optional[FileRecord]:
+        """
+        Find a hashed record for another name of the given entry's file.
+
+        The record must share the entry's device, inode, size, and
+        modification time, and be hashed using our algorithm. Change times
+        are not compared, as adding a hard link changes them. Lets a new
+        backup snapshot made with `rsync --link-dest` reuse the hashes of
+        the files it links to, without reading them again.
+
+        Safe to call from any thread, each reads using its own connection.
+
+        Args:
+            entry (TreeEntry): File to find another name for.
+            chunks (bool): Only accept a chunked record, loading its chunks.
+
+        Returns:
+            Record found, or `None`.
+        """
+        if entry.device is None or entry.inode is None:
+            return None
+        query = textwrap.dedent("""
+            SELECT files.*, relpath
+                FROM files INNER JOIN folders ON files.folder = folders.id
+                WHERE device=:device AND inode=:inode AND size=:size
+                    AND mtime_ns=:mtime_ns AND sha256 IS NOT NULL
+                    AND algorithm=:algorithm
+        """).strip()
+        if chunks:
+            query += " AND chunked IS NOT NULL"
+        parameters = {
+            'device': entry.device,
+            'inode': entry.inode,
+            'size': entry.size,
+            'mtime_ns': entry.mtime_ns,
+            'algorithm': self.algorithm,
+        }
+        connection = self._reader()
+        row = connection.execute(query + " LIMIT 1;", parameters).fetchone()
+        if row is None:
+            return None
+        record = FileRecord.from_database(row)
+        if chunks:
+            query = "SELECT offset, size, digest FROM chunks WHERE file=? ORDER BY offset;"
+            record.chunks = [Chunk(*values) for values in connection.execute(query, (row['id'],))]
+        return record
+
+    def metadata(self) -> Optional[dict]:
+        """
+        Return database metadata, or `None` if not yet set.
+        """
+        cursor = self.connection.execute("SELECT * FROM metadata WHERE id=1;")
+        row = cursor.fetchone()
+        return None if row is None else dict(row)
+
+    def change_algorithm(self, algorithm: str) -> None:
+        """
+        Change database's hash algorithm, without re-hashing any files.
+
+        Every record notes the algorithm used for its hash, so those hashed
+        using another can be found and updated later, see `rehash()`.
+        """
+        new_hasher(algorithm)
+        logger.info(f"Change hash algorithm from {self.algorithm} to {algorithm}")
+        self.algorithm = algorithm
+        self.connection.execute(
+            "UPDATE metadata SET algorithm=? WHERE id=1;", (algorithm,))
+
+    def rehash(self, algorithm: str) -> int:
+        """
+        Change database's hash algorithm, re-hashing every hashed file.
+
+        Every record notes the algorithm used for its hash, so an
+        interrupted rehash picks up where it left off if run again.
+
+        Args:
+            algorithm (str): Name of new hash algorithm.
+
+        Returns:
+            Number of records re-hashed.
+        """
+        self.change_algorithm(algorithm)
+        query = textwrap.dedent("""
+            SELECT files.id AS id, name, relpath, device, inode
+                FROM files INNER JOIN folders ON files.folder = folders.id
+                WHERE sha256 IS NOT NULL AND algorithm IS NOT :algorithm;
+        """).strip()
+        num_hashed = self._hash_rows(query, 'sha256', {'algorithm': algorithm})
+        logger.info(f"Re-hashed {num_hashed:,} files using {algorithm}")
+        return num_hashed
+
+    def queued(self) -> List[str]:
+        """
+        Return relative paths of every file queued for update, in queued order.
+        """
+        query = "SELECT relpath FROM queue ORDER BY rowid;"
+        return [row['relpath'] for row in self.connection.execute(query)]
+
+    def queued_size(self) -> int:
+        """
+        Return sum of the bytes across every file queued for update.
+        """
+        cursor = self.connection.execute("SELECT coalesce(sum(size), 0) FROM queue;")
+        return int(cursor.fetchone()[0])
+
+    def queue(self, entries: Iterable[TreeEntry]) -> None:
+        """
+        Save queue of files pending update to database, in a single transaction.
+
+        Files are removed from the queue by `add_many()` as they are written.
+        """
+        query = "INSERT OR IGNORE INTO queue (relpath, size) VALUES (?, ?);"
+        cursor = self.connection.cursor()
+        cursor.execute('BEGIN;')
+        try:
+            cursor.executemany(query, ((e.relpath, e.size) for e in entries))
+            cursor.execute('COMMIT;')
+        except sqlite3.Error:
+            cursor.execute('ROLLBACK;')
+            raise
+
+    def hash_pending(self) -> int:
+        """
+        Calculate missing hashes for records that might have a duplicate.
+
+        Lazily added records are only hashed as far as is needed to tell them
+        apart from the records present when they were added. This catches the
+        rest, in two tiers: records sharing their size with another get a
+        fingerprint, then records sharing their fingerprint get a full hash.
+        Hard links to the same file are not counted as sharing anything.
+
+        Records that already have a full hash are never read again, even if
+        they have no fingerprint, eg. from before fingerprints were added.
+        Records sharing their size with such a record get a full hash, as
+        their fingerprints have nothing to be compared with.
+
+        Returns:
+            Number of records hashed.
+        """
+        # Only lazy updates leave records without a full hash
+        cursor = self.connection.execute("SELECT 1 FROM files WHERE sha256 IS NULL LIMIT 1;")
+        if cursor.fetchone() is None:
+            return 0
+
+        fingerprints = textwrap.dedent(f"""
+            SELECT files.id AS id, name, relpath, device, inode
+                FROM files INNER JOIN folders ON files.folder = folders.id
+                WHERE fingerprint IS NULL AND sha256 IS NULL AND size IN (
+                    SELECT size FROM files GROUP BY size
+                        HAVING count(DISTINCT {self.file_key}) > 1);
+        """).strip()
+        sha256s = textwrap.dedent(f"""
+            SELECT files.id AS id, name, relpath, device, inode
+                FROM files INNER JOIN folders ON files.folder = folders.id
+                WHERE sha256 IS NULL AND fingerprint IS NOT NULL AND (
+                    (size, fingerprint) IN (
+                        SELECT size, fingerprint FROM files
+                            WHERE fingerprint IS NOT NULL
+                            GROUP BY size, fingerprint
+                            HAVING count(DISTINCT {self.file_key}) > 1)
+                    OR size IN (
+                        SELECT size FROM files
+                            WHERE fingerprint IS NULL AND sha256 IS NOT NULL));
+        """).strip()
+        self._hash_rows(fingerprints, 'fingerprint')
+        num_hashed = self._hash_rows(sha256s, 'sha256')
+        if num_hashed:
+            logger.info(f"Hashed {num_hashed:,} files with newly found twins")
+        return num_hashed
+
     def folders_count(self) -> int:
         cursor = self.connection.execute("SELECT count(*) FROM folders;")
         return int(cursor.fetchone()[0])
@@ -175,7 +716,7 @@ class DB:
             Raw dictionary of data from database layer.
         """
         query = textwrap.dedent("""
-            SELECT files.id as id, name, relpath, size, mtime, sha256, updated
+            SELECT files.*, relpath
                 FROM files INNER JOIN folders ON files.folder = folders.id
                 WHERE name=:filename AND
                       folder=(SELECT id FROM folders WHERE relpath=:folder);
@@ -186,19 +727,128 @@ class DB:
         except ValueError:
             message = f"Given path not under '{self.root!s}': {path}"
             raise NotUnderRoot(message) from None
-        folder = str(relpath.parent)
+        folder, filename = split(str(relpath))
         cursor = self.connection.cursor()
-        cursor.execute(query, {'folder':  folder, 'filename': relpath.name})
+        cursor.execute(query, {'folder':  folder, 'filename': filename})
         return cursor.fetchone()
 
-    def _check_schema(self) -> None:
+    def shared(self, by: str='file', min_bytes: int=1) -> List[Tuple[str, str, int]]:
+        """
+        Find pairs of files, or folders, sharing chunks of their contents.
+
+        Only chunked files are considered, see `Updater(chunking=True)`. Each
+        distinct chunk counts once per pair, however often it repeats. Chunks
+        repeated within a file, or by files in the same folder, don't count.
+
+        Args:
+            by (str):
+                Either 'file' or 'folder'.
+            min_bytes (int):
+                Leave out pairs sharing fewer bytes than this.
+
+        Returns:
+            List of 3-tuples, each pair's relative paths and the bytes they
+            share, most shared first.
+        """
+        units = {'file': 'files.id', 'folder': 'files.folder'}
+        if by not in units:
+            raise ValueError(f"Can only find bytes shared by 'file' or 'folder', not: {by!r}")
+        query = textwrap.dedent(f"""
+            WITH units AS (
+                SELECT DISTINCT {units[by]} AS unit, digest, chunks.size AS size
+                    FROM chunks INNER JOIN files ON chunks.file = files.id
+            )
+            SELECT first.unit AS first, second.unit AS second, sum(first.size) AS shared
+                FROM units AS first INNER JOIN units AS second
+                    ON first.digest = second.digest AND first.unit < second.unit
+                GROUP BY first.unit, second.unit
+                HAVING shared >= :min_bytes
+                ORDER BY shared DESC, first.unit, second.unit;
+        """).strip()
+        rows = self.connection.execute(query, {'min_bytes': min_bytes}).fetchall()
+
+        # Look up relative paths of units found
+        if by == 'file':
+            query = textwrap.dedent("""
+                SELECT files.id AS id, name, relpath
+                    FROM files INNER JOIN folders ON files.folder = folders.id
+                    WHERE files.id=?;
+            """).strip()
+        else:
+            query = "SELECT id, relpath FROM folders WHERE id=?;"
+        relpaths: Dict[int, str] = {}
+
+        def relpath(unit):
+            if unit not in relpaths:
+                row = self.connection.execute(query, (unit,)).fetchone()
+                relpaths[unit] = row['relpath']
+                if by == 'file':
+                    relpaths[unit] = join(row['relpath'], row['name'])
+            return relpaths[unit]
+
+        return [(relpath(row['first']), relpath(row['second']), row['shared']) for row in rows]
+
+    def size_groups(self) -> Iterator[List[FileRecord]]:
+        """
+        Generate lists of records for files sharing their size with another.
+
+        These are the candidates for duplicates, none of which need have been
+        hashed, see `compare.duplicate_groups()`. Hard links to the same file
+        are not counted as sharing their size. Groups are in order of size,
+        read from a snapshot of the database.
+        """
+        query = textwrap.dedent(f"""
+            SELECT files.*, relpath
+                FROM files INNER JOIN folders ON files.folder = folders.id
+                WHERE size IN (
+                    SELECT size FROM files GROUP BY size
+                        HAVING count(DISTINCT {self.file_key}) > 1)
+                ORDER BY size, relpath, name;
+        """).strip()
+        with self._snapshot() as connection:
+            rows = connection.execute(query)
+            for size, group in itertools.groupby(rows, key=lambda row: row['size']):
+                yield [FileRecord.from_database(row) for row in group]
+
+    def update_metadata(self, label: Optional[str]=None) -> None:
+        """
+        Record completion of an update, creating metadata if needed.
+
+        Args:
+            label (str):
+                User label for database. Defaults to the existing label, or
+                else to the name of the database's root folder.
+        """
+        query = textwrap.dedent("""
+            INSERT INTO metadata (id, label, root, algorithm, created, updated)
+                VALUES (1, :label, :root, :algorithm, strftime('%s'), strftime('%s'))
+                ON CONFLICT (id) DO UPDATE SET
+                    label=coalesce(:new_label, label),
+                    root=:root,
+                    updated=strftime('%s');
+        """).strip()
+        parameters = {
+            'label': label or self.root.name or str(self.root),
+            'new_label': label,
+            'root': str(self.root),
+            'algorithm': self.algorithm,
+        }
+        self.connection.execute(query, parameters)
+
+    def _check_schema(self) -> bool:
         """
-        Create database structure, if required.
+        Create database structure, or upgrade an existing database's structure.
 
         All times are Unix epoch's.
 
-        Should only be run on an empty database file.
+        Returns:
+            True if a new database was created.
         """
+        cursor = self.connection.execute("SELECT count(*) FROM sqlite_master;")
+        if cursor.fetchone()[0]:
+            self._migrate()
+            return False
+
         schema = textwrap.dedent("""
 
         CREATE TABLE IF NOT EXISTS files (
@@ -207,34 +857,120 @@ class DB:
             name            TEXT NOT NULL,          -- File's name
             size            INTEGER,                -- File's size in bytes
             mtime           INTEGER,                -- File's contents changed
-            sha256          BLOB,                   -- Binary sha256 hash
+            mtime_ns        INTEGER,                -- mtime, in nanoseconds
+            ctime_ns        INTEGER,                -- File's metadata changed, ns
+            inode           INTEGER,                -- File's inode number
+            device          INTEGER,                -- Device holding inode
+            sha256          BLOB,                   -- Binary hash of contents
+            algorithm       TEXT,                   -- Algorithm used for hash
+            fingerprint     BLOB,                   -- Hash of size and ends of file
+            chunked         INTEGER,                -- Number of chunks, if chunked
             updated         INTEGER,                -- This record last updated
             folder          INTEGER NOT NULL,       -- Link to parent folder
             FOREIGN KEY(folder) REFERENCES folders(id),
             UNIQUE  (name, folder)
         );
 
+        CREATE INDEX IF NOT EXISTS files_folder_name ON files(folder, name);
+        CREATE INDEX IF NOT EXISTS files_sha256_size ON files(sha256, size);
+        CREATE INDEX IF NOT EXISTS files_size_fingerprint ON files(size, fingerprint);
+        CREATE INDEX IF NOT EXISTS files_device_inode ON files(device, inode);
+
+        CREATE TABLE IF NOT EXISTS chunks (
+            -- Content-defined chunks of files, see `chunking`
+            file            INTEGER NOT NULL        -- Link to file
+                REFERENCES files(id) ON DELETE CASCADE,
+            offset          INTEGER NOT NULL,       -- Start of chunk in file
+            size            INTEGER NOT NULL,       -- Chunk's size in bytes
+            digest          BLOB NOT NULL,          -- Hash of chunk's contents
+            PRIMARY KEY (file, offset)
+        ) WITHOUT ROWID;
+
+        CREATE INDEX IF NOT EXISTS chunks_digest ON chunks(digest);
+
         CREATE TABLE IF NOT EXISTS folders (
             -- Every folder found under database root
             id              INTEGER PRIMARY KEY,
             relpath         TEXT UNIQUE NOT NULL    -- Path relative to database
         );
 
+        CREATE TABLE IF NOT EXISTS queue (
+            -- Queue of files still to be hashed by an unfinished update
+            relpath         TEXT PRIMARY KEY,       -- Path relative to database
+            size            INTEGER                 -- File's size in bytes
+        );
+
         CREATE TABLE IF NOT EXISTS metadata (
             -- Single entry table containing DB metadata
             id              INTEGER PRIMARY KEY,
             label           TEXT NOT NULL,          -- User label
             root            TEXT NOT NULL,          -- Full path to last mount point
+            algorithm       TEXT NOT NULL DEFAULT 'sha256', -- Hash algorithm
             device_model    TEXT,                   -- Storage device model
             device_serial   TEXT,                   -- Storage device serial number
             created         INTEGER NOT NULL,       -- Database creation time
-            updated         INTEGER NOT NULL,       -- Time of completed update
+            updated         INTEGER NOT NULL,       -- Time of completed update, or 0
             CHECK (rowid=1)                         -- Only one row allowed
         );
 
         """)
         self.connection.executescript(schema)
-        self.connection.commit()
+        self.connection.execute(f"PRAGMA user_version = {self.schema_version};")
+        return True
+
+    def _create_metadata(self) -> None:
+        """
+        Save metadata for a new database, before any update completes.
+
+        Saves the hash algorithm straight away, so an interrupted first
+        update resumes using the same one.
+        """
+        query = textwrap.dedent("""
+            INSERT INTO metadata (id, label, root, algorithm, created, updated)
+                VALUES (1, :label, :root, :algorithm, strftime('%s'), 0);
+        """).strip()
+        parameters = {
+            'label': self.root.name or str(self.root),
+            'root': str(self.root),
+            'algorithm': self.algorithm,
+        }
+        self.connection.execute(query, parameters)
+
+    def _check_version(self) -> None:
+        """
+        Check a database opened read-only needs no upgrade.
+        """
+        version = self.connection.execute("PRAGMA user_version;").fetchone()[0]
+        if version != self.schema_version:
+            message = (
+                f"Database schema version {version} does not match "
+                f"supported version {self.schema_version}, so cannot be read "
+                f"without upgrading it, by an update: '{self.path!s}'")
+            raise MimicryError(message)
+
+    def _migrate(self) -> None:
+        """
+        Upgrade database structure to the current schema version.
+        """
+        cursor = self.connection.execute("PRAGMA user_version;")
+        version = cursor.fetchone()[0]
+        if version > self.schema_version:
+            message = (
+                f"Database schema version {version} is newer than "
+                f"supported version {self.schema_version}: '{self.path!s}'")
+            raise MimicryError(message)
+
+        for version in range(version + 1, self.schema_version + 1):
+            logger.info("Upgrade database schema to version %s", version)
+            cursor.execute('BEGIN;')
+            try:
+                for statement in self.migrations[version]:
+                    cursor.execute(statement)
+                cursor.execute(f"PRAGMA user_version = {version};")
+                cursor.execute('COMMIT;')
+            except sqlite3.Error:
+                cursor.execute('ROLLBACK;')
+                raise
 
     def _clean_path(self, path: Path) -> Path:
         """
@@ -258,42 +994,226 @@ class DB:
         Args:
             path
         """
-        connection = sqlite3.connect(path, isolation_level=None)
+        if self.readonly:
+            connection = sqlite3.connect(
+                f"{path.as_uri()}?mode=ro", uri=True, isolation_level=None)
+        else:
+            connection = sqlite3.connect(path, isolation_level=None)
         connection.row_factory = sqlite3.Row
         if verbose:
             connection.set_trace_callback(logger.debug)
         return connection
 
-    def _do_add(self, cursor, file_):
-        relpath = file_.relative_to(self.root)
-        folder, filename = split(relpath)
+    def _reader(self) -> sqlite3.Connection:
+        """
+        Connection for reads by the current thread, opened when first needed.
+        """
+        connection = getattr(self._readers, 'connection', None)
+        if connection is None:
+            connection = self._readers.connection = self._connect(self.path)
+        return connection
+
+    @contextmanager
+    def _snapshot(self) -> Iterator[sqlite3.Connection]:
+        """
+        Context manager providing read-only snapshot of database.
+
+        A separate connection is opened, with a read transaction held open
+        until the context is exited. Writes made by our main connection
+        in the meantime are not seen.
+        """
+        connection = self._connect(self.path)
+        try:
+            connection.execute('BEGIN;')
+            yield connection
+            connection.execute('COMMIT;')
+        finally:
+            connection.close()
 
-        cursor.execute("INSERT OR IGNORE INTO folders(relpath) VALUES (?)", (folder,))
-        cursor.execute("SELECT id FROM folders WHERE relpath=?;", (folder,))
-        folder_id = cursor.fetchone()['id']
+    def _do_add(self, cursor, records, lazy=False):
+        # Find or create folders
+        folder_ids = self._folder_ids
+        folders = {split(record.relpath)[0] for record in records}
+        new_folders = folders - folder_ids.keys()
+        if new_folders:
+            query = "INSERT OR IGNORE INTO folders(relpath) VALUES (?)"
+            cursor.executemany(query, ((folder,) for folder in new_folders))
+            for folder in new_folders:
+                cursor.execute("SELECT id FROM folders WHERE relpath=?;", (folder,))
+                folder_ids[folder] = cursor.fetchone()['id']
 
         # Build parameters
-        parameters = {
-            'name': file_.name,
-            'size': file_.size,
-            'mtime': file_.mtime,
-            'folder': folder_id,
-            'sha256': file_.sha256,
-        }
+        parameters = []
+        for record in records:
+            folder, name = split(record.relpath)
+            logger.debug("Add: %s", record.relpath)
+            parameters.append(self._hash_parameters(cursor, {
+                'name': name,
+                'size': record.size,
+                'mtime': record.mtime,
+                'mtime_ns': record.mtime_ns,
+                'ctime_ns': record.ctime_ns,
+                'inode': record.inode,
+                'device': record.device,
+                'folder': folder_ids[folder],
+                'sha256': record.sha256,
+                'fingerprint': record.fingerprint,
+                'algorithm': record.algorithm if record.sha256 is not None else None,
+                'chunked': None if record.chunks is None else len(record.chunks),
+            }, record.relpath, lazy))
 
-        # Create bare file
+        # Create bare files
         query = "INSERT OR IGNORE INTO files (name, folder) VALUES (:name, :folder);"
-        cursor.execute(query, parameters)
+        cursor.executemany(query, parameters)
+
+        # Remove from queue, a few hundred at a time to stay well under
+        # SQLite's limit on the number of variables
+        for relpaths in chunked([record.relpath for record in records], 500):
+            placeholders = ', '.join('?' * len(relpaths))
+            query = f"DELETE FROM queue WHERE relpath IN ({placeholders});"
+            cursor.execute(query, relpaths)
 
-        # Update file
+        # Update files
         # (We do this in two steps to preserve the file's rowid. Running a single
         # 'INSERT OR REPLACE' increments that.)
         query = textwrap.dedent("""
             UPDATE files SET
-                size=:size, mtime=:mtime, sha256=:sha256, updated=strftime('%s')
+                size=:size, mtime=:mtime, mtime_ns=:mtime_ns, ctime_ns=:ctime_ns,
+                inode=:inode, device=:device, sha256=:sha256, algorithm=:algorithm,
+                fingerprint=:fingerprint, chunked=:chunked, updated=strftime('%s')
                 WHERE name=:name AND folder=:folder;
         """).strip()
-        cursor.execute(query, parameters)
+        cursor.executemany(query, parameters)
+
+        # Replace chunks, removing any left from before the file changed. Only
+        # needed if chunking, or if chunks were ever stored.
+        chunking = any(record.chunks is not None for record in records)
+        if chunking or cursor.execute("SELECT 1 FROM chunks LIMIT 1;").fetchone():
+            query = textwrap.dedent("""
+                DELETE FROM chunks
+                    WHERE file=(SELECT id FROM files WHERE name=:name AND folder=:folder);
+            """).strip()
+            cursor.executemany(query, parameters)
+        query = "INSERT INTO chunks (file, offset, size, digest) VALUES (?, ?, ?, ?);"
+        for record, values in zip(records, parameters):
+            if record.chunks:
+                cursor.execute(
+                    "SELECT id FROM files WHERE name=:name AND folder=:folder;", values)
+                file_id = cursor.fetchone()['id']
+                cursor.executemany(query, (
+                    (file_id, chunk.offset, chunk.size, chunk.digest)
+                    for chunk in record.chunks))
+
+    def _file(self, path: Path) -> File:
+        """
+        Create `File` to be hashed, using our algorithm and throttle.
+        """
+        on_read = None
+        if self.throttle is not None:
+            self.throttle.file()
+            on_read = self.throttle.read
+        return File(path, self.algorithm, on_read)
+
+    def _has_twin(self, cursor, parameters, fingerprint=False) -> bool:
+        """
+        Does any *other* file record have the same size as the one given?
+
+        If `fingerprint` is true, the other record must share its fingerprint
+        too. Hard links to the same file are not twins.
+        """
+        query = textwrap.dedent("""
+            SELECT 1 FROM files
+                WHERE size=:size AND NOT (name=:name AND folder=:folder)
+                    AND NOT coalesce(device=:device AND inode=:inode, 0)
+        """).strip()
+        if fingerprint:
+            query += " AND fingerprint=:fingerprint"
+        cursor.execute(query + " LIMIT 1;", parameters)
+        return cursor.fetchone() is not None
+
+    def _hash_parameters(self, cursor, parameters, relpath, lazy):
+        """
+        Calculate any missing hashes needed for the given query parameters.
+
+        Returns the given parameters, updated in place. Files that cannot be
+        read are logged and left without hashes, to be tried again later.
+        """
+        file_ = None
+        try:
+            if not lazy and parameters['sha256'] is None:
+                # Full hash first, the fingerprint comes from the same read
+                file_ = self._file(self.root / relpath)
+                parameters['sha256'] = file_.sha256
+                parameters['algorithm'] = file_.algorithm
+
+            if parameters['fingerprint'] is None:
+                if not lazy or self._has_twin(cursor, parameters):
+                    file_ = file_ or self._file(self.root / relpath)
+                    parameters['fingerprint'] = file_.fingerprint
+
+            if parameters['sha256'] is None and parameters['fingerprint'] is not None:
+                if not lazy or self._has_twin(cursor, parameters, fingerprint=True):
+                    file_ = file_ or self._file(self.root / relpath)
+                    parameters['sha256'] = file_.sha256
+                    parameters['algorithm'] = file_.algorithm
+        except (MimicryError, OSError) as e:
+            logger.warning("Could not hash %s: %s", self.root / relpath, e)
+        return parameters
+
+    def _hash_rows(self, query, column, parameters=()) -> int:
+        """
+        Calculate and save either the 'fingerprint' or 'sha256' column.
+
+        Args:
+            query (str):
+                Query selecting `id`, `name`, `relpath`, `device`, and `inode`
+                for files to hash. Hard links are only read once.
+            column (str):
+                Either 'fingerprint' or 'sha256'.
+            parameters:
+                Optional parameters for query.
+
+        Returns:
+            Number of records updated.
+        """
+        assert column in ('fingerprint', 'sha256')
+        rows = self.connection.execute(query, parameters).fetchall()
+        assignments = f"{column}=:value"
+        if column == 'sha256':
+            assignments += ", algorithm=:algorithm"
+        update = f"UPDATE files SET {assignments}, updated=strftime('%s') WHERE id=:id;"
+        num_hashed = 0
+        linked: Dict[Tuple[int, int], bytes] = {}
+        for row in rows:
+            key: Optional[Tuple[int, int]] = None
+            if row['device'] is not None and row['inode'] is not None:
+                key = (row['device'], row['inode'])
+            path = self.root / row['relpath'] / row['name']
+            if key in linked:
+                value = linked[key]
+            else:
+                try:
+                    value = getattr(self._file(path), column)
+                except (MimicryError, OSError) as e:
+                    logger.warning("Could not hash %s: %s", path, e)
+                    continue
+                if key is not None:
+                    linked[key] = value
+            self.connection.execute(
+                update, {'value': value, 'id': row['id'], 'algorithm': self.algorithm})
+            num_hashed += 1
+        return num_hashed
+
+    def _load_folder_ids(self) -> None:
+        """
+        Load cache of folder ids, keyed by relpath, from the database.
+
+        Must be called again if a transaction that created folders is rolled
+        back, as the cache would then contain ids that no longer exist.
+        """
+        query = "SELECT id, relpath FROM folders;"
+        self._folder_ids = {
+            row['relpath']: row['id'] for row in self.connection.execute(query)}
 
     def _run_pragmas(self):
         """
@@ -302,6 +1222,7 @@ class DB:
         cursor = self.connection.cursor()
         self.connection.execute('PRAGMA cache_size = -16384;')    # 16MiB
         cursor.execute("PRAGMA foreign_keys = ON;")
-        cursor.execute('PRAGMA journal_mode = WAL;')
+        if not self.readonly:
+            cursor.execute('PRAGMA journal_mode = WAL;')
         cursor.execute("PRAGMA synchronous = OFF;")
         cursor.execute('PRAGMA temp_store = MEMORY;')
@@ -16,6 +16,10 @@ class NotAFolder(MimicryError):
     pass
 
 
+class NotSupported(MimicryError):
+    pass
+
+
 class NotUnderRoot(MimicryError):
     """
     The metadata database (say *that* quickly 17 times) should only operate
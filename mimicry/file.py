@@ -2,23 +2,63 @@
 import hashlib
 from pathlib import Path
 from pprint import pprint as pp
+import threading
+from typing import Callable, List, Optional
 
-from typing import Optional
-
+from . import hashing
+from .chunking import Chunk, Chunker
 from .exceptions import NotAbsolute, NotAFile
 from .utils import file_size
 
 
+# Each thread's reusable read buffer
+_local = threading.local()
+
+
+def read_buffer(size: int) -> memoryview:
+    """
+    Return view of current thread's read buffer, at least `size` bytes long.
+
+    The buffer is only ever replaced by a larger one, so a thread hashing
+    many files allocates memory for the first few only.
+    """
+    view = getattr(_local, 'view', None)
+    if view is None or len(view) < size:
+        view = memoryview(bytearray(size))
+        _local.view = view
+    return view[:size]
+
+
 class File:
     """
     Interface to an actual file on the current file system.
     """
-    def __init__(self, path: Path):
+    # Bytes read from each end of the file to calculate its fingerprint
+    fingerprint_sample = 64 * 1024
+
+    # Limits on size of read buffer, which otherwise matches file size
+    read_size_min = 64 * 1024
+    read_size_max = 4 * 1024 * 1024
+
+    def __init__(
+        self,
+        path: Path,
+        algorithm: str=hashing.DEFAULT_ALGORITHM,
+        on_read: Optional[Callable[[int], None]]=None,
+        chunking: bool=False,
+    ):
         """
         Initialiser.
 
         Args:
             path: Path to file
+            algorithm: Name of algorithm used to hash file's full contents.
+            on_read:
+                Optional function called with the number of bytes read, after
+                every read while hashing, eg. to throttle reading.
+            chunking:
+                Also split file into content-defined chunks while hashing,
+                see `chunks`.
         """
         # Check path
         path = Path(path)
@@ -28,12 +68,52 @@ class File:
         if not path.exists():
             raise NotAFile(path)
         self.path = path
+        self.algorithm = algorithm
+        self.on_read = on_read
+        self.chunking = chunking
 
         # Cached attributes
+        self._chunks: Optional[List[Chunk]] = None
+        self._fingerprint: Optional[bytes] = None
         self._mtime: Optional[float] = None
         self._sha256: Optional[bytes] = None
         self._size: Optional[int] = None
 
+    @property
+    def chunks(self) -> List[Chunk]:
+        """
+        Split file's contents into content-defined chunks.
+
+        Calculated in the same pass as the file's full hash, if `chunking`
+        was set, otherwise by a pass of its own.
+
+        Returns: List of chunks, in order, empty for an empty file.
+        """
+        if self._chunks is None:
+            if not self.chunking:
+                self.chunking = True
+                self._sha256 = None
+            self._update_sha256()
+        assert self._chunks is not None
+        return self._chunks
+
+    @property
+    def fingerprint(self) -> bytes:
+        """
+        Calculate and return a cheap fingerprint of file's contents.
+
+        Only the file's size and the first and last `fingerprint_sample` bytes
+        are considered. Files with different fingerprints cannot be the same,
+        but files with the same fingerprint may still differ. Comes free
+        with the full hash, if that is calculated first.
+
+        Returns (bytes): Binary hash of the file's size and sampled contents.
+        """
+        if self._fingerprint is None:
+            self._update_fingerprint()
+        assert self._fingerprint is not None
+        return self._fingerprint
+
     @property
     def mtime(self) -> float:
         if self._mtime is None:
@@ -51,9 +131,12 @@ class File:
     @property
     def sha256(self) -> bytes:
         """
-        Calculate and return file's SHA256 hash.
+        Calculate and return hash of file's full contents.
 
-        Returns (bytes): SHA256 binary hash of file's contents.
+        Named for the default algorithm, SHA-256, but calculated using the
+        file's `algorithm`, which may be another.
+
+        Returns (bytes): Binary hash of file's contents.
         """
         if self._sha256 is None:
             self._update_sha256()
@@ -74,13 +157,66 @@ class File:
         size = file_size(self.size)
         return f"{self.name} ({size})"
 
-    def _update_sha256(self) -> None:
-        BUFFSIZE = 4096 * 1024
-        sha256 = hashlib.sha256()
+    def _new_fingerprint(self):
+        return hashlib.blake2b(self.size.to_bytes(8, 'little'), digest_size=16)
+
+    def _update_fingerprint(self) -> None:
+        sample = self.fingerprint_sample
+        size = self.size
+        hasher = self._new_fingerprint()
         with open(self.path, 'rb') as f:
-            for chunk in iter(lambda: f.read(BUFFSIZE), b''):
-                sha256.update(chunk)
+            chunks = [f.read(sample)]
+            if size > sample:
+                f.seek(max(sample, size - sample))
+                chunks.append(f.read(sample))
+        for chunk in chunks:
+            hasher.update(chunk)
+            if self.on_read is not None:
+                self.on_read(len(chunk))
+        self._fingerprint = hasher.digest()
+
+    def _update_sha256(self) -> None:
+        """
+        Hash file's contents, reading them straight into a reused buffer.
+
+        Unbuffered reads, using `readinto()`, avoid both a new bytes object
+        and a copy for every chunk read. Files smaller than the buffer are
+        read in a single call. If `chunking` is set, each buffer is passed to
+        the chunker too, so the file is still read only once.
+
+        The fingerprint is calculated along the way, from the same bytes at
+        each end of the file that `_update_fingerprint()` would read, unless
+        the file's size changes while it is being read.
+        """
+        size = min(max(self.size, self.read_size_min), self.read_size_max)
+        view = read_buffer(size)
+        sha256 = hashing.new(self.algorithm)
+        chunker = Chunker() if self.chunking else None
+        sample = self.fingerprint_sample
+        tail = max(sample, self.size - sample)
+        fingerprint = self._new_fingerprint()
+        offset = 0
+        with open(self.path, 'rb', buffering=0) as f:
+            while True:
+                num_read = f.readinto(view)
+                if not num_read:
+                    break
+                data = view[:num_read]
+                sha256.update(data)
+                if chunker is not None:
+                    chunker.feed(data)
+                if offset < sample:
+                    fingerprint.update(data[:sample - offset])
+                if offset + num_read > tail:
+                    fingerprint.update(data[max(tail - offset, 0):])
+                offset += num_read
+                if self.on_read is not None:
+                    self.on_read(num_read)
         self._sha256 = sha256.digest()
+        if chunker is not None:
+            self._chunks = chunker.finish()
+        if self._fingerprint is None and offset == self.size:
+            self._fingerprint = fingerprint.digest()
 
     def _update_stat(self) -> None:
         stat = self.path.stat()
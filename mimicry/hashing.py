@@ -0,0 +1,68 @@
+"""
+Hash algorithms available for hashing file contents.
+
+SHA-256 is the default, and is what older databases hold. On fast storage
+it is the bottleneck, so faster algorithms may be chosen instead. BLAKE2b
+is always available. The xxHash and BLAKE3 algorithms are used if their
+(optional) packages are installed.
+
+Hashes from different algorithms can never be compared, so every database
+records the algorithm it uses. See `DB.rehash()` to change it.
+"""
+
+import hashlib
+import logging
+from pprint import pprint as pp
+from typing import Callable, Dict, List
+
+from .exceptions import MimicryError
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ALGORITHM = 'sha256'
+
+# Longest digest any algorithm may produce, in bytes
+MAX_DIGEST_SIZE = 32
+
+# Factories for hash objects, keyed by algorithm name
+ALGORITHMS: Dict[str, Callable] = {
+    'sha256': hashlib.sha256,
+    'blake2b': lambda: hashlib.blake2b(digest_size=32),
+}
+
+try:
+    import xxhash  # type: ignore[import-not-found]
+    ALGORITHMS['xxh3_128'] = xxhash.xxh3_128
+except ImportError:
+    pass
+
+try:
+    import blake3  # type: ignore[import-not-found]
+    ALGORITHMS['blake3'] = blake3.blake3
+except ImportError:
+    pass
+
+
+def available() -> List[str]:
+    """
+    Return names of every available hash algorithm.
+    """
+    return sorted(ALGORITHMS)
+
+
+def new(algorithm: str=DEFAULT_ALGORITHM):
+    """
+    Create new hash object for the given algorithm.
+
+    Raises:
+        MimicryError: If algorithm is unknown, or its package not installed.
+    """
+    try:
+        factory = ALGORITHMS[algorithm]
+    except KeyError:
+        message = (
+            f"Unknown hash algorithm: {algorithm!r} "
+            f"(available: {', '.join(available())})")
+        raise MimicryError(message) from None
+    return factory()
@@ -0,0 +1,204 @@
+"""
+Compact, memory-mappable index of a database's file hashes.
+
+Answering 'is this file on drive X?' should not require opening SQLite.
+The index is a small header followed by fixed-width records, sorted by
+hash, which can be searched in place without reading it all into memory::
+
+    header      8-byte magic, record count as a little-endian uint64, then
+                the hash algorithm's name, zero-padded to 16 bytes
+    records     32-byte hash, then file size and file id as little-endian uint64s
+
+Hashes shorter than 32 bytes, from faster algorithms, are zero-padded.
+"""
+
+import logging
+import mmap
+import os
+from pathlib import Path
+from pprint import pprint as pp
+import struct
+from typing import List, Optional, Tuple
+
+from .database import DB
+from .exceptions import MimicryError
+from .hashing import MAX_DIGEST_SIZE
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'MIMIDX02'
+HEADER = struct.Struct('<8sQ16s')
+RECORD = struct.Struct('<32sQQ')
+
+
+def index_path(db_path: Path) -> Path:
+    """
+    Path to the index file kept alongside the given database file.
+    """
+    return db_path.with_suffix('.idx')
+
+
+def remove_index(db: DB) -> None:
+    """
+    Delete any index saved alongside database, before it can go stale.
+
+    Lookups in an index missing hashes added since it was written would
+    silently find nothing, so every update removes it, and only those
+    updates asked for an index write a fresh one once finished.
+    """
+    path = index_path(db.path)
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        return
+    logger.debug("Removed index: %s", path)
+
+
+def write_index(db: DB, path: Optional[Path]=None) -> Path:
+    """
+    Export hash, size, and id of every hashed file in database to an index file.
+
+    The index is written to a temporary file first, then renamed over any
+    existing index, so that readers never see a partial file.
+
+    Args:
+        db (DB): Database to export.
+        path (Path): Index file to write, defaults to alongside database.
+
+    Returns:
+        Path to index file.
+    """
+    path = index_path(db.path) if path is None else path
+    temporary = path.with_name(path.name + '.tmp')
+    count = 0
+    with open(temporary, 'wb') as f:
+        algorithm = db.algorithm.encode()
+        f.write(HEADER.pack(MAGIC, 0, algorithm))
+        for sha256, size, pk in db.hash_records():
+            f.write(RECORD.pack(sha256, size, pk))
+            count += 1
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, count, algorithm))
+    os.replace(temporary, path)
+    logger.info(f"Exported {count:,} hashes to index: {path}")
+    return path
+
+
+class HashIndex:
+    """
+    Read-only, memory-mapped view of an index file.
+
+    Lookups use interpolation search, taking advantage of hashes being
+    uniformly distributed, with alternate bisection steps to bound the
+    worst case.
+    """
+    def __init__(self, path: Path, algorithm: Optional[str]=None):
+        """
+        Initialiser.
+
+        Args:
+            path: Index file to open.
+            algorithm:
+                Algorithm of the hashes to be looked up. Hashes from one
+                algorithm never match another's, so a mismatch is an error,
+                rather than every lookup silently finding nothing.
+        """
+        self.path = Path(path)
+        with open(self.path, 'rb') as f:
+            header = f.read(HEADER.size)
+            if header[:len(MAGIC) - 2] == MAGIC[:-2] and header[:len(MAGIC)] != MAGIC:
+                raise MimicryError(
+                    f"Unsupported hash index version, export it again: '{self.path!s}'")
+            if len(header) != HEADER.size or header[:len(MAGIC)] != MAGIC:
+                raise MimicryError(f"Not a hash index file: '{self.path!s}'")
+            _, self.count, name = HEADER.unpack(header)
+            self.algorithm = name.rstrip(b'\0').decode()
+            if algorithm is not None and algorithm != self.algorithm:
+                raise MimicryError(
+                    f"Hash index uses {self.algorithm}, not {algorithm}: '{self.path!s}'")
+            expected = HEADER.size + self.count * RECORD.size
+            if os.fstat(f.fileno()).st_size != expected:
+                raise MimicryError(f"Truncated hash index file: '{self.path!s}'")
+            # Empty files cannot be mapped, but nor are they ever read
+            self._mmap: Optional[mmap.mmap] = None
+            if self.count:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __contains__(self, sha256: bytes) -> bool:
+        sha256 = sha256.ljust(MAX_DIGEST_SIZE, b'\0')
+        index = self._lower_bound(sha256)
+        return index < self.count and self._digest(index) == sha256
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def close(self) -> None:
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def find(self, sha256: bytes) -> List[Tuple[int, int]]:
+        """
+        Find every file with the given hash.
+
+        Returns:
+            List of 2-tuples, of file size and id, for matching files.
+        """
+        sha256 = sha256.ljust(MAX_DIGEST_SIZE, b'\0')
+        found = []
+        index = self._lower_bound(sha256)
+        while index < self.count and self._digest(index) == sha256:
+            _, size, pk = RECORD.unpack_from(self._mapped(), self._offset(index))
+            found.append((size, pk))
+            index += 1
+        return found
+
+    def _digest(self, index: int) -> bytes:
+        offset = self._offset(index)
+        return self._mapped()[offset:offset + MAX_DIGEST_SIZE]
+
+    def _lower_bound(self, sha256: bytes) -> int:
+        """
+        Index of first record with a hash not less than the one given.
+        """
+        lo = 0
+        hi = self.count
+        key = int.from_bytes(sha256[:8], 'big')
+        interpolate = True
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if interpolate and hi - lo > 8:
+                lo_key = self._prefix(lo)
+                hi_key = self._prefix(hi - 1)
+                if hi_key > lo_key:
+                    guess = lo + (key - lo_key) * (hi - 1 - lo) // (hi_key - lo_key)
+                    mid = min(max(guess, lo), hi - 1)
+            interpolate = not interpolate
+
+            if self._digest(mid) < sha256:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _mapped(self) -> mmap.mmap:
+        """
+        Memory-mapped file, only ever needed if the index has records.
+        """
+        if self._mmap is None:
+            raise MimicryError(f"Hash index file is closed: '{self.path!s}'")
+        return self._mmap
+
+    def _offset(self, index: int) -> int:
+        return HEADER.size + index * RECORD.size
+
+    def _prefix(self, index: int) -> int:
+        offset = self._offset(index)
+        return int.from_bytes(self._mapped()[offset:offset + 8], 'big')
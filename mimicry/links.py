@@ -0,0 +1,142 @@
+"""
+Hard links: several names for the one file, sharing a single inode.
+
+Backup trees made with `rsync --link-dest` or `cp -al` can be mostly hard
+links. Their contents need only be read once, however many names they have,
+and removing one name frees no space, so they are not duplicates worth
+reporting.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+import logging
+from pprint import pprint as pp
+import threading
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from .database import FileRecord
+    from .tree import TreeEntry
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _Slot:
+    """
+    Hashes of one inode, shared by all its names.
+    """
+    remaining: int                          # Names not yet seen
+    record: Optional[FileRecord] = None     # Record for first name hashed
+    done: threading.Event = field(default_factory=threading.Event)
+
+
+class HardLinks:
+    """
+    Hash each file once, however many hard links it has.
+
+    Safe to use from many threads at once. The first thread to reach an inode
+    hashes it, while threads reaching its other names wait, then copy its
+    hashes. Inodes are forgotten once all their names have been seen, so
+    memory use is bounded by the number of partly-seen inodes.
+
+    Links hashed by earlier runs, eg. in the previous snapshot of a backup
+    made with `rsync --link-dest`, are found using the optional `lookup`,
+    so are not read again either.
+    """
+    def __init__(self, lookup: Optional[Callable[[TreeEntry], Optional[FileRecord]]]=None):
+        """
+        Initialiser.
+
+        Args:
+            lookup:
+                Finds an existing, hashed, record for another name of the
+                given entry's file, if there is one. Called from many
+                threads at once.
+        """
+        self.lookup = lookup
+        self.num_shared = 0
+        self._lock = threading.Lock()
+        self._slots: Dict[Tuple[int, int], _Slot] = {}
+
+    def hash(
+        self,
+        entry: TreeEntry,
+        function: Callable[[TreeEntry], FileRecord],
+    ) -> FileRecord:
+        """
+        Hash given entry using function, unless another link already has.
+
+        Args:
+            entry: File to hash.
+            function: Creates record, with its hashes, for a tree entry.
+
+        Returns:
+            Record for given entry.
+        """
+        if entry.links < 2:
+            return function(entry)
+
+        key = (entry.device, entry.inode)
+        with self._lock:
+            existing = self._slots.get(key)
+            if existing is None:
+                slot = self._slots[key] = _Slot(entry.links)
+            else:
+                slot = existing
+            slot.remaining -= 1
+            if slot.remaining <= 0:
+                del self._slots[key]
+
+        if existing is None:
+            try:
+                stored = None if self.lookup is None else self.lookup(entry)
+                if stored is None:
+                    slot.record = function(entry)
+                else:
+                    slot.record = self._copy(stored, entry)
+            finally:
+                slot.done.set()
+            return slot.record
+
+        slot.done.wait()
+        source = slot.record
+        if source is None or source.size != entry.size:
+            # First link failed, or file changed in the meantime
+            return function(entry)
+        return self._copy(source, entry)
+
+    def _copy(self, source: FileRecord, entry: TreeEntry) -> FileRecord:
+        """
+        Create record for entry, with hashes copied from another link's.
+        """
+        record = type(source).from_entry(entry)
+        record.fingerprint = source.fingerprint
+        record.sha256 = source.sha256
+        record.algorithm = source.algorithm
+        record.chunks = source.chunks
+        with self._lock:
+            self.num_shared += 1
+        logger.debug("Hard link, hash shared: %s", entry.relpath)
+        return record
+
+
+def distinct(records: Iterable[FileRecord]) -> List[FileRecord]:
+    """
+    Keep only the first record for each file, dropping its other hard links.
+
+    Records without a device and inode, eg. from older databases, are all
+    kept.
+    """
+    seen = set()
+    kept = []
+    for record in records:
+        if record.device is not None and record.inode is not None:
+            key = (record.device, record.inode)
+            if key in seen:
+                continue
+            seen.add(key)
+        kept.append(record)
+    return kept
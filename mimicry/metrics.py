@@ -0,0 +1,137 @@
+"""
+Collect per-phase counters from an update, for comparison across runs.
+
+A `Metrics` object is a progress callback (see `progress`), measuring from
+each phase's 'start' event to its 'end' event: wall and CPU time, files and
+bytes processed, SQL statements run, and, on Linux, read and write system
+calls and bytes, from `/proc/self/io`.
+
+CPU time and system calls are counted for the whole process, so phases
+that run at the same time, like 'hash' and 'write', include each other's.
+"""
+
+import json
+import logging
+from pathlib import Path
+from pprint import pprint as pp
+import sqlite3
+import time
+from typing import Dict
+
+from .progress import Event
+
+
+logger = logging.getLogger(__name__)
+
+# Counters read from '/proc/self/io', and the names we give them
+PROC_IO_FIELDS = {
+    'syscr': 'read_syscalls',
+    'syscw': 'write_syscalls',
+    'rchar': 'read_bytes',
+    'wchar': 'write_bytes',
+}
+
+
+def proc_io() -> Dict[str, int]:
+    """
+    Read this process's I/O counters, if available.
+
+    Returns:
+        Dictionary of counters, empty if not running on Linux.
+    """
+    counters = {}
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in PROC_IO_FIELDS:
+                    counters[PROC_IO_FIELDS[key]] = int(value)
+    except OSError:
+        pass
+    return counters
+
+
+class Metrics:
+    """
+    Per-phase counters, collected from progress events.
+    """
+    def __init__(self):
+        self.phases: Dict[str, Dict[str, float]] = {}
+        self.statements = 0
+        self.started = time.time()
+        self._samples: Dict[str, Dict[str, float]] = {}
+
+    def __call__(self, event: Event) -> None:
+        if event.status == 'start':
+            self.start(event.phase)
+        elif event.status == 'end':
+            self.stop(event.phase, event.files, event.bytes)
+
+    def start(self, phase: str) -> None:
+        """
+        Start measuring named phase.
+        """
+        self._samples[phase] = self._sample()
+
+    def stop(self, phase: str, files: int=0, num_bytes: int=0) -> None:
+        """
+        Stop measuring named phase, adding to its counters.
+
+        Phases may run more than once, their counters are summed.
+        """
+        before = self._samples.pop(phase, None)
+        if before is None:
+            logger.debug("Phase %r stopped without being started", phase)
+            return
+        after = self._sample()
+        counters = self.phases.setdefault(phase, {'runs': 0, 'files': 0, 'bytes': 0})
+        counters['runs'] += 1
+        counters['files'] += files
+        counters['bytes'] += num_bytes
+        for key, value in after.items():
+            counters[key] = counters.get(key, 0) + value - before[key]
+
+    def summary(self) -> dict:
+        """
+        Return every counter, with derived throughput, as plain data.
+        """
+        phases = {}
+        for name, counters in self.phases.items():
+            phase = dict(counters)
+            wall = phase['wall_seconds']
+            phase['files_per_second'] = phase['files'] / wall if wall else 0.0
+            phase['bytes_per_second'] = phase['bytes'] / wall if wall else 0.0
+            phases[name] = phase
+        return {
+            'started': self.started,
+            'phases': phases,
+        }
+
+    def watch(self, connection: sqlite3.Connection) -> None:
+        """
+        Count the SQL statements run by the given connection.
+
+        Replaces any existing trace callback on the connection.
+        """
+        connection.set_trace_callback(self._count_statement)
+
+    def write(self, path: Path, **extra) -> None:
+        """
+        Write summary to file, as JSON, with any extra top-level keys given.
+        """
+        summary = self.summary()
+        summary.update(extra)
+        Path(path).write_text(json.dumps(summary, indent=4, sort_keys=True) + '\n')
+        logger.info(f"Saved metrics to: {path}")
+
+    def _count_statement(self, statement: str) -> None:
+        self.statements += 1
+
+    def _sample(self) -> Dict[str, float]:
+        sample = {
+            'wall_seconds': time.perf_counter(),
+            'cpu_seconds': time.process_time(),
+            'sql_statements': self.statements,
+        }
+        sample.update(proc_io())
+        return sample
@@ -0,0 +1,320 @@
+"""
+Update a database with every phase running at once, connected by queues.
+
+Listing folders, reading file metadata, hashing, and writing to SQLite all
+run concurrently, as stages of an asyncio pipeline::
+
+    walk  ->  stat  ->  hash  ->  write
+      \\________________________/
+               orphans
+
+The walk runs in a thread of its own, merge-joining the tree with the
+database's records, as a streaming update does. File metadata is read, and
+files hashed, in thread pools. Every write happens in batches, in a thread of
+its own with its own database connection, so the event loop is never blocked
+by SQLite, nor by files read while hashing lazily.
+
+Every queue is bounded. A slow stage makes the stages before it wait,
+keeping memory use flat however large the tree, while hashing starts as
+soon as the first changed file is found.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from dataclasses import dataclass
+import logging
+import os
+from pprint import pprint as pp
+import threading
+from time import perf_counter
+from typing import List, Optional
+
+from .database import DB, FileRecord
+from .progress import Phase
+from .throttle import lower_priority
+from .tree import Tree, TreeEntry
+from .utils import merge_join
+
+
+logger = logging.getLogger(__name__)
+
+# Sentinel marking the end of a queue's items
+DONE = object()
+
+# Signal to the writer to save metadata missing from unchanged records
+BACKFILL = object()
+
+
+@dataclass
+class Listing:
+    """
+    A file found by the walk, not yet stat'ed.
+    """
+    relpath: str
+    entry: os.DirEntry
+
+
+class Pipeline:
+    """
+    Concurrent update engine for an `Updater`.
+    """
+    def __init__(self, updater, queue_size: int=1000, stat_workers: int=8):
+        """
+        Initialiser.
+
+        Args:
+            updater (Updater):
+                Updater, with its database open, whose settings are used.
+            queue_size (int):
+                Most items waiting between any two stages.
+            stat_workers (int):
+                Number of threads reading file metadata.
+        """
+        self.updater = updater
+        self.db = updater.db
+        self.queue_size = queue_size
+        self.stat_workers = stat_workers
+        self._stopping = threading.Event()
+        self._skipped_lock = threading.Lock()
+
+    def run(self) -> None:
+        """
+        Run the pipeline until every stage has finished.
+
+        Must not be called from a running event loop.
+        """
+        started = perf_counter()
+        asyncio.run(self._run())
+        elapsed = perf_counter() - started
+        logger.info(
+            f"Pipelined update of {self._walked:,} files, "
+            f"{self._written:,} updated, {self._deleted:,} orphaned and "
+            f"{self._skipped:,} unreadable, "
+            f"in {elapsed:.3f} seconds")
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        to_stat: asyncio.Queue = asyncio.Queue(self.queue_size)
+        to_hash: asyncio.Queue = asyncio.Queue(self.queue_size)
+        to_write: asyncio.Queue = asyncio.Queue(self.queue_size)
+        self._walked = self._written = self._deleted = self._skipped = 0
+
+        updater = self.updater
+        initializer = lower_priority if updater.idle_priority else None
+        with ThreadPoolExecutor(1, thread_name_prefix='walk') as walk_pool, \
+             ThreadPoolExecutor(1, thread_name_prefix='write') as write_pool, \
+             ThreadPoolExecutor(self.stat_workers, thread_name_prefix='stat') as stat_pool, \
+             ThreadPoolExecutor(
+                 updater.workers, thread_name_prefix='hash',
+                 initializer=initializer) as hash_pool:
+            hasher = FileRecord.from_entry if updater.lazy else self._hash
+            # Our database connection must only be used from this thread
+            estimate = self.db.files_count()
+            tasks = [
+                loop.run_in_executor(
+                    walk_pool, self._walk, loop, to_stat, to_write, estimate),
+                asyncio.ensure_future(
+                    self._stage(self._stat, to_stat, to_hash, stat_pool, self.stat_workers)),
+                asyncio.ensure_future(
+                    self._stage(hasher, to_hash, to_write, hash_pool, updater.workers)),
+                loop.run_in_executor(write_pool, self._write, loop, to_write),
+            ]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                self._stopping.set()
+                for task in tasks:
+                    task.cancel()
+                raise
+
+    async def _stage(self, function, inbox, outbox, executor, concurrency) -> None:
+        """
+        Run function over items from inbox, in executor, passing on results.
+
+        Results of `None` are dropped.
+        """
+        loop = asyncio.get_running_loop()
+
+        async def worker():
+            while True:
+                item = await inbox.get()
+                if item is DONE:
+                    # Leave sentinel for sibling workers
+                    await inbox.put(DONE)
+                    return
+                result = await loop.run_in_executor(executor, function, item)
+                if result is not None:
+                    await outbox.put(result)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        await outbox.put(DONE)
+
+    def _stat(self, item) -> Optional[TreeEntry]:
+        """
+        Read metadata for listed file, returning it only if it needs updating.
+        """
+        listing, record = item
+        try:
+            stat = listing.entry.stat(follow_symlinks=False)
+        except FileNotFoundError:
+            logger.warning("File has disappeared: %s", listing.relpath)
+            return None
+        except OSError as e:
+            logger.warning("Could not read %s: %s", listing.relpath, e)
+            self._skip()
+            return None
+        entry = TreeEntry.from_stat(listing.relpath, stat)
+        if self.updater.should_update(entry, record):
+            return entry
+        return None
+
+    def _hash(self, entry) -> Optional[FileRecord]:
+        """
+        Hash file for given tree entry, or return `None` if it can't be read.
+        """
+        record = self.updater._prepare(entry)
+        if record is None:
+            # Noted for dropping from the update queue, which we don't use
+            self.updater._skipped.popleft()
+            self._skip()
+        return record
+
+    def _skip(self) -> None:
+        """
+        Count a file skipped as unreadable, from any thread.
+        """
+        with self._skipped_lock:
+            self._skipped += 1
+
+    def _walk(self, loop, to_stat, to_write, estimate) -> None:
+        """
+        Walk tree and database records together, in a thread of its own.
+
+        Files are passed on, with their existing records, to be stat'ed.
+        Orphaned records are passed straight on to be deleted. Records are
+        read from a snapshot, on a connection belonging to this thread.
+        """
+        def put(queue, item):
+            self._wait_for(loop, queue.put(item))
+
+        updater = self.updater
+        tree = Tree(
+            updater.root, show_hidden=False, ignore=updater.build_ignored(),
+            precount=False)
+        listings = (Listing(relpath, entry) for relpath, entry in tree.scan(ordered=True))
+        records = self.db.files(ordered=True)
+        with Phase(updater._on_progress, 'walk', estimate or None) as phase:
+            try:
+                for listing, record in merge_join(listings, records, key=merge_key):
+                    if listing is None:
+                        put(to_write, record.relpath)
+                        continue
+                    phase.advance()
+                    put(to_stat, (listing, record))
+                    if phase.files % updater.batch_size == 0 and updater._backfill:
+                        put(to_write, BACKFILL)
+            finally:
+                self._walked = phase.files
+                put(to_stat, DONE)
+
+    def _write(self, loop, inbox) -> None:
+        """
+        Write records, and delete orphaned records, in batches.
+
+        Runs in a thread of its own, on a connection of its own, as SQLite
+        connections may only be used by the thread that created them.
+        """
+        db = DB(self.db.path, algorithm=self.db.algorithm)
+        db.throttle = self.db.throttle
+        if self.updater.metrics is not None:
+            self.updater.metrics.watch(db.connection)
+        try:
+            self._write_batches(db, self._receive(loop, inbox))
+        finally:
+            db.connection.close()
+
+    def _write_batches(self, db, items) -> None:
+        updater = self.updater
+        batch_size = updater.batch_size
+        records: List[FileRecord] = []
+        orphans: List[str] = []
+        hashing = updater.phase('hash')
+        writing = updater.phase('write')
+        deleting = updater.phase('orphans')
+
+        def write():
+            db.add_many(records, lazy=updater.lazy, batch_size=batch_size)
+            writing.advance(len(records), sum(record.size for record in records))
+            records.clear()
+
+        def delete():
+            db.delete_many(orphans)
+            deleting.advance(len(orphans))
+            orphans.clear()
+
+        for item in items:
+            if item is BACKFILL:
+                updater.backfill(db)
+            elif isinstance(item, str):
+                orphans.append(item)
+                if len(orphans) >= batch_size:
+                    delete()
+            else:
+                hashing.advance(1, item.size)
+                records.append(item)
+                if len(records) >= batch_size:
+                    write()
+        write()
+        delete()
+        updater.backfill(db)
+        self._written = writing.files
+        self._deleted = deleting.files
+        for phase in (hashing, writing, deleting):
+            phase.finish()
+
+    def _receive(self, loop, inbox):
+        """
+        Generate items from queue, from another thread, until the sentinel.
+
+        Items are taken as many at a time as are waiting, up to a batch.
+        """
+        while True:
+            for item in self._wait_for(loop, take(inbox, self.updater.batch_size)):
+                if item is DONE:
+                    return
+                yield item
+
+    def _wait_for(self, loop, coroutine):
+        """
+        Run coroutine on the event loop from another thread, returning its result.
+
+        Stops waiting, raising `RuntimeError`, if the pipeline is being torn
+        down, so no thread is left blocked on a queue nobody is serving.
+        """
+        future = asyncio.run_coroutine_threadsafe(coroutine, loop)
+        while True:
+            try:
+                return future.result(timeout=0.1)
+            except TimeoutError:
+                if self._stopping.is_set():
+                    future.cancel()
+                    raise RuntimeError("Pipeline stopped") from None
+
+
+async def take(queue: asyncio.Queue, limit: int) -> list:
+    """
+    Wait for the next item in queue, returning it with any others waiting.
+
+    Stops at the `DONE` sentinel, or once `limit` items have been taken.
+    """
+    items = [await queue.get()]
+    while len(items) < limit and items[-1] is not DONE and not queue.empty():
+        items.append(queue.get_nowait())
+    return items
+
+
+def merge_key(item):
+    """
+    Key to merge-join `Listing` and `FileRecord` objects.
+    """
+    return os.path.split(item.relpath)
@@ -0,0 +1,230 @@
+"""
+Progress events, emitted by long-running operations, and ways to show them.
+
+An update runs in phases: walking the tree ('walk'), loading database
+records ('records'), deleting orphaned records ('orphans'), hashing files
+('hash'), and writing records ('write'). Each phase emits a 'start' event,
+then 'progress' events at most once per interval, then an 'end' event. Every
+event carries running counts, throughput, and an estimated time remaining
+where totals are known, so that a stalled drive or a slow phase stands out
+on runs lasting days.
+
+Any callable taking an `Event` can receive events. Two are provided: a
+`TerminalRenderer` for people, and a `JsonLinesSink` for machines.
+"""
+
+from __future__ import annotations
+
+from dataclasses import asdict, dataclass
+import json
+import logging
+from pathlib import Path
+from pprint import pprint as pp
+import sys
+import time
+from typing import Callable, Optional, TextIO
+
+from .utils import file_size
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Event:
+    """
+    Snapshot of the progress of one phase.
+    """
+    phase: str
+    status: str                                     # 'start', 'progress', or 'end'
+    files: int
+    bytes: int
+    total_files: Optional[int]
+    total_bytes: Optional[int]
+    elapsed: float                                  # Seconds since phase started
+    files_per_second: float
+    bytes_per_second: float
+    eta: Optional[float]                            # Estimated seconds remaining
+    time: float                                     # Unix time of event
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+Callback = Callable[[Event], None]
+
+
+class Phase:
+    """
+    Running counts for one phase of an operation, reported as events.
+
+    Use as a context manager, calling `advance()` as work is done. If no
+    callback is given, counts are kept but nothing is reported.
+    """
+    def __init__(
+        self,
+        callback: Optional[Callback],
+        name: str,
+        total_files: Optional[int]=None,
+        total_bytes: Optional[int]=None,
+        interval: float=1.0,
+    ):
+        """
+        Initialiser.
+
+        Args:
+            callback: Function to receive events.
+            name: Name of phase, eg. 'hash'.
+            total_files: Expected number of files, if known.
+            total_bytes: Expected number of bytes, if known.
+            interval: Least number of seconds between progress events.
+        """
+        self.callback = callback
+        self.name = name
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.interval = interval
+        self.files = 0
+        self.bytes = 0
+        self.finished = False
+        self._started = time.perf_counter()
+        self._last = self._started
+        self._emit('start', self._started)
+
+    def __enter__(self) -> Phase:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.finish()
+
+    def advance(self, files: int=1, num_bytes: int=0) -> None:
+        """
+        Add to running counts, emitting an event if one is due.
+        """
+        self.files += files
+        self.bytes += num_bytes
+        if self.callback is not None:
+            now = time.perf_counter()
+            if now - self._last >= self.interval:
+                self._last = now
+                self._emit('progress', now)
+
+    def finish(self) -> None:
+        """
+        Emit final event, if not already done.
+        """
+        if not self.finished:
+            self.finished = True
+            self._emit('end', time.perf_counter())
+
+    def _emit(self, status: str, now: float) -> None:
+        if self.callback is None:
+            return
+        elapsed = now - self._started
+        files_per_second = self.files / elapsed if elapsed > 0 else 0.0
+        bytes_per_second = self.bytes / elapsed if elapsed > 0 else 0.0
+
+        # Prefer bytes to estimate time remaining, as files vary so in size
+        eta = None
+        if status == 'end':
+            eta = 0.0
+        elif self.total_bytes and bytes_per_second:
+            eta = max(self.total_bytes - self.bytes, 0) / bytes_per_second
+        elif self.total_files and files_per_second:
+            eta = max(self.total_files - self.files, 0) / files_per_second
+
+        event = Event(
+            phase=self.name,
+            status=status,
+            files=self.files,
+            bytes=self.bytes,
+            total_files=self.total_files,
+            total_bytes=self.total_bytes,
+            elapsed=elapsed,
+            files_per_second=files_per_second,
+            bytes_per_second=bytes_per_second,
+            eta=eta,
+            time=time.time(),
+        )
+        try:
+            self.callback(event)
+        except Exception:
+            # Never let reporting break the actual work
+            logger.exception("Progress callback failed")
+
+
+def combine(*callbacks: Callback) -> Callback:
+    """
+    Create a single callback that passes events on to every one given.
+    """
+    def broadcast(event: Event) -> None:
+        for callback in callbacks:
+            callback(event)
+    return broadcast
+
+
+def format_duration(seconds: float) -> str:
+    """
+    Format number of seconds for people, eg. '1d 02:03:04'.
+    """
+    seconds = int(seconds)
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    clock = f"{hours:02}:{minutes:02}:{seconds:02}"
+    return f"{days}d {clock}" if days else clock
+
+
+class JsonLinesSink:
+    """
+    Append every event to a file, as a line of JSON.
+    """
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def __call__(self, event: Event) -> None:
+        self._file.write(json.dumps(event.as_dict()) + '\n')
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class TerminalRenderer:
+    """
+    Show events as a status line, rewritten in place on a terminal.
+
+    If the stream is not a terminal, eg. redirected to a file, every event
+    is written on a line of its own instead.
+    """
+    def __init__(self, stream: Optional[TextIO]=None):
+        self.stream = sys.stderr if stream is None else stream
+        self.interactive = self.stream.isatty()
+
+    def __call__(self, event: Event) -> None:
+        line = self.render(event)
+        if self.interactive:
+            end = '\n' if event.status == 'end' else ''
+            self.stream.write(f"\r{line}\x1b[K{end}")
+        else:
+            self.stream.write(line + '\n')
+        self.stream.flush()
+
+    def render(self, event: Event) -> str:
+        """
+        Build a single line describing event.
+        """
+        parts = [f"{event.phase:<7}", f"{event.files:,}"]
+        if event.total_files:
+            parts.append(f"of {event.total_files:,}")
+        parts.append(f"files, {file_size(event.bytes)}")
+        if event.total_bytes:
+            percent = event.bytes / event.total_bytes
+            parts.append(f"of {file_size(event.total_bytes)} ({percent:.0%})")
+        parts.append(f"at {file_size(int(event.bytes_per_second))}/s")
+        if event.status == 'end':
+            parts.append(f"in {format_duration(event.elapsed)}")
+        elif event.eta is not None:
+            parts.append(f"ETA {format_duration(event.eta)}")
+        return ' '.join(parts)
@@ -0,0 +1,135 @@
+"""
+Limit the impact of an update on a busy machine.
+
+Reading is capped using token buckets, shared between every hashing thread,
+and hashing threads may drop to idle CPU and I/O priority, so that an update
+can run during business hours without starving other work.
+"""
+
+import ctypes
+import logging
+import os
+import platform
+from pprint import pprint as pp
+import threading
+import time
+from typing import Optional
+
+
+logger = logging.getLogger(__name__)
+
+# Number of the ioprio_set() system call, which has no wrapper in libc
+IOPRIO_SET_SYSCALLS = {
+    'x86_64': 251,
+    'aarch64': 30,
+    'i386': 289,
+    'i686': 289,
+    'armv7l': 314,
+}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket, refilled continuously at a fixed rate.
+
+    Taking more tokens than are available borrows against the future: the
+    taker sleeps until the debt has been repaid. A single request may thus
+    be larger than the bucket's capacity, and concurrent takers queue up
+    fairly behind each other.
+    """
+    def __init__(self, rate: float, capacity: Optional[float]=None):
+        """
+        Initialiser.
+
+        Args:
+            rate: Tokens added per second.
+            capacity:
+                Most tokens that can accumulate while idle, limiting bursts.
+                Defaults to one second's worth.
+        """
+        if rate <= 0:
+            raise ValueError(f"Rate must be positive, given: {rate}")
+        self.rate = rate
+        self.capacity = rate if capacity is None else capacity
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self, amount: float=1) -> float:
+        """
+        Take tokens from bucket, sleeping first if there are not enough.
+
+        Returns:
+            Seconds spent sleeping.
+        """
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._updated
+            self._updated = now
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._tokens -= amount
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class Throttle:
+    """
+    Caps on the rate at which files are hashed.
+    """
+    def __init__(
+        self,
+        bytes_per_second: Optional[float]=None,
+        files_per_second: Optional[float]=None,
+    ):
+        """
+        Initialiser.
+
+        Args:
+            bytes_per_second: Most bytes read per second, or `None` for no limit.
+            files_per_second: Most files hashed per second, or `None` for no limit.
+        """
+        self.bytes = None if bytes_per_second is None else TokenBucket(bytes_per_second)
+        self.files = None if files_per_second is None else TokenBucket(files_per_second)
+
+    def file(self) -> None:
+        """
+        Wait, if needed, before starting to hash another file.
+        """
+        if self.files is not None:
+            self.files.take()
+
+    def read(self, num_bytes: int) -> None:
+        """
+        Wait, if needed, after reading the given number of bytes.
+        """
+        if self.bytes is not None:
+            self.bytes.take(num_bytes)
+
+
+def lower_priority() -> None:
+    """
+    Drop current thread to lowest CPU priority, and idle I/O priority.
+
+    Linux schedules threads individually, so other threads are unaffected.
+    Idle I/O priority is only available on Linux, and only honoured by
+    I/O schedulers that support it, eg. BFQ. Failures are logged, not raised.
+    """
+    thread_id = threading.get_native_id()
+    try:
+        os.setpriority(os.PRIO_PROCESS, thread_id, 19)
+    except (AttributeError, OSError) as e:
+        logger.debug("Could not lower CPU priority: %s", e)
+
+    syscall = IOPRIO_SET_SYSCALLS.get(platform.machine())
+    if platform.system() != 'Linux' or syscall is None:
+        logger.debug("Idle I/O priority not supported on this platform")
+        return
+    libc = ctypes.CDLL(None, use_errno=True)
+    priority = IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT
+    if libc.syscall(syscall, IOPRIO_WHO_PROCESS, thread_id, priority) != 0:
+        logger.debug("Could not set idle I/O priority: %s", os.strerror(ctypes.get_errno()))
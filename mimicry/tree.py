@@ -1,4 +1,8 @@
 
+from __future__ import annotations
+
+from dataclasses import dataclass
+import heapq
 import logging
 import os
 from pathlib import Path
@@ -7,17 +11,64 @@ from time import perf_counter
 
 from .exceptions import NotAFolder
 from .file import File
+from .progress import Phase
 from .utils import normalise
 
 
 logger = logging.getLogger(__name__)
 
 
+@dataclass
+class TreeEntry:
+    """
+    Metadata for a single file, as read while walking the tree.
+
+    Much lighter than a full `File` object, and built from a single `lstat()`
+    call on the file's `os.DirEntry`.
+    """
+    relpath: str
+    size: int
+    mtime: float
+    mtime_ns: int
+    ctime_ns: int
+    inode: int
+    device: int
+    links: int = 1                  # Number of hard links to file
+
+    @classmethod
+    def from_path(cls, root: Path, relpath: str) -> TreeEntry:
+        """
+        Create object by reading metadata for file at given path.
+
+        Symbolic links are not followed.
+        """
+        return cls.from_stat(relpath, os.lstat(os.path.join(root, relpath)))
+
+    @classmethod
+    def from_stat(cls, relpath: str, stat: os.stat_result) -> TreeEntry:
+        """
+        Create object from the result of a `stat()` call.
+        """
+        return cls(
+            relpath=relpath,
+            size=stat.st_size,
+            mtime=stat.st_mtime,
+            mtime_ns=stat.st_mtime_ns,
+            ctime_ns=stat.st_ctime_ns,
+            inode=stat.st_ino,
+            device=stat.st_dev,
+            links=stat.st_nlink,
+        )
+
+
 class Tree:
     """
     Tree of folders and files under given root.
     """
-    def __init__(self, root, show_hidden=False, ignore=None):
+    def __init__(
+        self, root, show_hidden=False, ignore=None, precount=True, estimate=None,
+        on_progress=None,
+    ):
         """
         Initialiser.
 
@@ -30,20 +81,89 @@ class Tree:
                 Optional set of paths (relative to given root) to ignore. Not
                 very featureful, but only really intended to skip our own
                 database files (ie. sqlite3 and '.wal' and '.shm' files)
+            precount (bool):
+                Walk the whole tree up-front to calculate totals. If `False`,
+                totals are instead collected while `files()` walks the tree,
+                and are only available once it has finished.
+            estimate (tuple):
+                Optional 2-tuple of the expected number of files and bytes,
+                eg. from a previous run, used for progress when not precounting.
+            on_progress (callable):
+                Optional function to receive `progress.Event` objects for
+                the 'walk' phase, as `entries()` walks the tree.
         """
         self.root = self._clean_root(root)
         self.show_hidden = show_hidden
         self.ignore = self._build_ignore_set(ignore)
         self.total_files = None
         self.total_bytes = None
-        self._calculate_totals()
+        self.walked_files = 0
+        self.walked_bytes = 0
+        self.estimated_files, self.estimated_bytes = estimate or (None, None)
+        self.on_progress = on_progress
+        if precount:
+            self._calculate_totals()
+            self.estimated_files = self.total_files
+            self.estimated_bytes = self.total_bytes
+
+    def entries(self, ordered=False):
+        """
+        Generator over `TreeEntry` objects for every file, top-down order.
+
+        If `ordered` is true, entries are instead ordered by their folder's
+        relpath, then by their name, to match `DB.files(ordered=True)`.
+
+        Running counts of files and bytes are kept in `walked_files` and
+        `walked_bytes`. Totals are set from them once the walk is complete.
+        """
+        self.walked_files = 0
+        self.walked_bytes = 0
+        phase = Phase(
+            self.on_progress, 'walk',
+            self.estimated_files or None, self.estimated_bytes or None)
+        walk = self._walk_ordered() if ordered else self._walk()
+        for relpath, entry in walk:
+            tree_entry = TreeEntry.from_stat(relpath, entry.stat(follow_symlinks=False))
+            self.walked_files += 1
+            self.walked_bytes += tree_entry.size
+            phase.advance(1, tree_entry.size)
+            yield tree_entry
+        self.total_files = self.walked_files
+        self.total_bytes = self.walked_bytes
+        phase.finish()
 
     def files(self):
         """
         Generator over all files under Tree's root, top-down order.
+
+        Prefer `entries()` where possible, as creating a `File` object is
+        relatively expensive.
         """
-        for name, path, rootfd in self._walk():
-            yield File(path)
+        for tree_entry in self.entries():
+            yield File(self.root / tree_entry.relpath)
+
+    def scan(self, ordered=False):
+        """
+        Generator over every file, without reading any file's metadata.
+
+        For callers who would rather call `stat()` themselves, eg. from
+        several threads at once. Neither running counts nor totals are kept.
+
+        Yields:
+            2-tuple with file's path relative to root, and its `os.DirEntry`.
+        """
+        return self._walk_ordered() if ordered else self._walk()
+
+    @property
+    def progress(self):
+        """
+        Fraction of the tree walked so far, from 0.0 to 1.0.
+
+        Returns `None` if no estimate of the tree's size is available.
+        """
+        if not self.estimated_files:
+            return None
+        return min(self.walked_files / self.estimated_files, 1.0)
 
     def __repr__(self):
         root = str(self.root)
@@ -53,6 +173,8 @@ class Tree:
     def __str__(self):
         root = str(self.root)
         root = root if root.endswith('/') else root + '/'
+        if self.total_files is None:
+            return f"{root}: {self.walked_files:,} files, {self.walked_bytes:,} bytes so far"
         return f"{root}: {self.total_files:,} files, {self.total_bytes:,} bytes"
 
     def _build_ignore_set(self, ignore):
@@ -70,16 +192,16 @@ class Tree:
         """
         Update count of files and file sizes.
 
-        For speed, we avoid creating `File` objects by-passing the `files()` method.
+        For speed, we avoid creating `TreeEntry` objects by-passing the
+        `entries()` method.
         """
         logger.debug("Calculate file tree totals under: %s", self.root)
         self.total_files = 0
         self.total_bytes = 0
         started = perf_counter()
-        for name, path, rootfd in self._walk(sort=False):
-            s = os.lstat(name, dir_fd=rootfd)
+        for relpath, entry in self._walk(sort=False):
             self.total_files += 1
-            self.total_bytes += s.st_size
+            self.total_bytes += entry.stat(follow_symlinks=False).st_size
         elapsed = perf_counter() - started
         logger.info(
             f"Calculated file tree totals for {self.total_files} files "
@@ -91,39 +213,93 @@ class Tree:
             raise NotAFolder(f"Given root not a folder: '{root!s}'")
         return root
 
+    def _scan(self, root):
+        """
+        List folder's contents, skipping hidden and non-regular files.
+
+        Folders that cannot be read, eg. for lack of permission, are logged
+        and skipped, along with everything under them.
+
+        Returns:
+            2-tuple with lists of `os.DirEntry` for folders and files.
+        """
+        dirs = []
+        files = []
+        try:
+            with os.scandir(root) as it:
+                for entry in it:
+                    # Skip hidden files and folders?
+                    if (not self.show_hidden) and entry.name.startswith('.'):
+                        logger.debug("Skipping hidden path: %s", entry.path)
+                        continue
+
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry)
+                    elif entry.is_file(follow_symlinks=False):
+                        files.append(entry)
+                    else:
+                        logger.debug("Skipping non-regular file: %s", entry.path)
+        except OSError as e:
+            logger.warning("Skipping unreadable folder %s: %s", root, e)
+            return ([], [])
+        return (dirs, files)
+
     def _walk(self, sort=True):
         """
         Yield tuple for every file under root, skipping hidden files if requested.
 
+        Only regular files are yielded. Symbolic links are neither followed
+        nor yielded.
+
         Yields:
-            3-tuple with file name, full-path, and open descriptor to folder.
+            2-tuple with file's path relative to root, and its `os.DirEntry`.
         """
-        for root, dirs, files, rootfd in os.fwalk(self.root, follow_symlinks=False):
-            # Skip hidden folders?
-            if not self.show_hidden:
-                for index, name in enumerate(dirs):
-                    if name.startswith('.'):
-                        path = os.path.join(root, dirs[index])
-                        logger.debug("Skipping hidden folder: %s", path)
-                        del dirs[index]
+        def sort_key(entry):
+            return (normalise(entry.name), entry.name)
+
+        stack = [('', str(self.root))]
+        while stack:
+            relroot, root = stack.pop()
+            dirs, files = self._scan(root)
 
             # Sort
             if sort:
-                dirs.sort(key=normalise)
-                files.sort(key=normalise)
+                dirs.sort(key=sort_key)
+                files.sort(key=sort_key)
 
             # Check files
-            for name in files:
-                path = os.path.join(root, name)
+            yield from self._unignored(relroot, files)
+
+            # Descend into folders, first folder first
+            for entry in reversed(dirs):
+                stack.append((os.path.join(relroot, entry.name), entry.path))
 
-                # Skip hidden files?
-                if (not self.show_hidden) and name.startswith('.'):
-                    logger.debug("Skipping hidden file: %s", path)
-                    continue
+    def _walk_ordered(self):
+        """
+        Like `_walk()`, but ordered by folder relpath, then by file name.
+
+        Strings are compared by code point, matching SQLite's default
+        collation. Folders are visited in order using a heap: a folder's
+        relpath is always greater than its parent's, so no folder can be
+        found *after* a folder that should follow it.
+        """
+        heap = [('', str(self.root))]
+        while heap:
+            relroot, root = heapq.heappop(heap)
+            dirs, files = self._scan(root)
+            files.sort(key=lambda entry: entry.name)
+            yield from self._unignored(relroot, files)
+            for entry in dirs:
+                heapq.heappush(heap, (os.path.join(relroot, entry.name), entry.path))
 
-                # Skip ignored files
-                if path in self.ignore:
-                    logger.debug("Skipping ignored path: %s", path)
-                    continue
+    def _unignored(self, relroot, files):
+        """
+        Yield tuple of relpath and `os.DirEntry` for files not being ignored.
+        """
+        for entry in files:
+            # Skip ignored files
+            if entry.path in self.ignore:
+                logger.debug("Skipping ignored path: %s", entry.path)
+                continue
 
-                yield (name, path, rootfd)
+            yield (os.path.join(relroot, entry.name), entry)
@@ -1,12 +1,28 @@
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import logging
+import os
+from os.path import split
+from pathlib import Path
 from pprint import pprint as pp
+from stat import S_ISREG
 from time import perf_counter
 from typing import List
 
+from .bloom import filter_path, remove_filter, write_filter
 from .database import DB, FileRecord
-from .tree import Tree
-from .utils import file_size
+from .exceptions import NotAFile
+from .file import File
+from .index import index_path, remove_index, write_index
+from .links import HardLinks
+from .metrics import Metrics
+from .pipeline import Pipeline
+from .progress import Phase, combine
+from .schedule import ORDERS, schedule
+from .throttle import Throttle, lower_priority
+from .tree import Tree, TreeEntry
+from .utils import chunked, file_size, merge_join
 
 
 logger = logging.getLogger(__name__)
@@ -18,16 +34,188 @@ class Updater:
     """
     db_file = 'mimicry.db'
 
-    def __init__(self, root):
+    def __init__(
+        self, root, lazy=False, workers=1, batch_size=1000, check_inodes=True,
+        streaming=False, label=None, export_index=False, bloom_error_rate=None,
+        algorithm=None, order='name', max_bytes_per_second=None,
+        max_files_per_second=None, idle_priority=False, on_progress=None,
+        metrics_path=None, pipeline=False, chunking=False,
+    ):
+        """
+        Initialiser.
+
+        Args:
+            root (Path):
+                Root folder of file tree to update.
+            lazy (bool):
+                Only hash files that share their size with another. Other
+                files are hashed later, on demand, if they gain a size twin.
+            workers (int):
+                Number of threads used to hash files concurrently. Use one
+                for spinning disks, more for SSDs and RAID arrays.
+            batch_size (int):
+                Maximum number of records written per database transaction.
+            check_inodes (bool):
+                Treat a file whose inode number has changed as changed. Turn
+                off for file systems without stable inode numbers, like FAT
+                and exFAT, which otherwise re-hash everything on every mount.
+            streaming (bool):
+                Compare file tree to database records as both are read, using
+                constant memory however large the tree. See `update_streaming()`.
+            label (str):
+                Optional label for database, eg. the drive's name. Used to
+                identify the database when searching many drives at once.
+            export_index (bool):
+                Export a compact, memory-mappable index of file hashes
+                alongside the database after every update.
+            bloom_error_rate (float):
+                Save a filter of file hashes alongside the database after
+                every update, with this false-positive rate, eg. 0.01. Used
+                to quickly rule out drives when searching many at once.
+            algorithm (str):
+                Hash algorithm, eg. 'blake2b'. Defaults to that already used
+                by the database, or SHA-256 for a new database. Files in an
+                existing database using another algorithm are re-hashed as
+                changed files are, queued, scheduled, and in parallel.
+            order (str):
+                Order to read files in for hashing, one of `schedule.ORDERS`.
+                Keep the default, 'name', for SSDs. Use 'extent' or 'inode'
+                for spinning drives, to read files in order of position on
+                disk, to cut down on seeking.
+            max_bytes_per_second (float):
+                Most bytes to read per second while hashing, eg. 50e6.
+            max_files_per_second (float):
+                Most files to hash per second.
+            idle_priority (bool):
+                Hash files in threads running at the lowest CPU priority, and
+                idle I/O priority, so they only read when nothing else is.
+                Files hashed lazily, by the database, are hashed in the
+                calling thread, at normal priority.
+            on_progress (callable):
+                Optional function to receive a `progress.Event` as each
+                phase of the update starts, progresses, and ends.
+            metrics_path (Path):
+                Write counters for each phase of the update to this file,
+                as JSON, once the update has finished. See `metrics`.
+            pipeline (bool):
+                Walk, stat, hash, and write all at once, as stages of a
+                pipeline. See `update_pipeline()`.
+            chunking (bool):
+                Also split files into content-defined chunks, as they are
+                hashed, storing them to find files sharing most of their
+                contents, see `DB.shared()`. Files already hashed, but not
+                chunked, are read again. Much more CPU-bound than hashing,
+                and incompatible with lazy updates.
+        """
         self.root = root.resolve()
         self.db_path = self.root / self.db_file
         self.db = None
+        self.lazy = lazy
+        if chunking and lazy:
+            raise ValueError("Chunking needs every file read, so cannot be lazy")
+        self.chunking = chunking
+        if workers < 1:
+            raise ValueError(f"Need at least one worker, given: {workers}")
+        self.workers = workers
+        if order not in ORDERS:
+            raise ValueError(f"Unknown order {order!r}, expected one of: {', '.join(ORDERS)}")
+        self.order = order
+        self.throttle = None
+        if max_bytes_per_second is not None or max_files_per_second is not None:
+            self.throttle = Throttle(max_bytes_per_second, max_files_per_second)
+        self.idle_priority = idle_priority
+        self.on_progress = on_progress
+        self.metrics_path = metrics_path
+        self.metrics = None
+        self._on_progress = on_progress
+        self.batch_size = batch_size
+        self.check_inodes = check_inodes
+        self.streaming = streaming
+        self.pipeline = pipeline
+        self.label = label
+        self.export_index = export_index
+        self.bloom_error_rate = bloom_error_rate
+        self.algorithm = algorithm
+        self.links = HardLinks()
+        self._skipped: deque = deque()          # Unreadable relpaths
+        self._backfill: deque = deque()         # Entries of records lacking metadata
 
     def update(self) -> None:
+        """
+        Bring database up-to-date with file tree.
+
+        The files to be updated are saved to the database before any are
+        hashed, then removed as each batch is written. If an update is
+        interrupted the next one picks up where it left off, without
+        walking the file tree again, and without re-hashing any files.
+        """
+        # Collect metrics alongside any other progress callback
+        if self.metrics_path is not None:
+            self.metrics = Metrics()
+            callbacks = [self.metrics]
+            if self.on_progress is not None:
+                callbacks.insert(0, self.on_progress)
+            self._on_progress = combine(*callbacks)
+            self.metrics.start('update')
+
         # Create and/or load database
+        self._skipped.clear()
+        self._backfill.clear()
         logger.debug(f"Create database: '{self.db_path}'")
-        self.db = DB(self.db_path)
+        self.db = DB(self.db_path, algorithm=self.algorithm)
+        self.links = HardLinks(lookup=self._linked)
+        self.db.throttle = self.throttle
+        remove_filter(self.db)
+        remove_index(self.db)
+        if self.metrics is not None:
+            self.metrics.watch(self.db.connection)
+        if self.algorithm is not None and self.algorithm != self.db.algorithm:
+            self.db.change_algorithm(self.algorithm)
+
+        # Resume unfinished update?
+        queued = self.db.queued()
+        if queued:
+            size = file_size(self.db.queued_size(), traditional=True)
+            logger.info(
+                f"Resume unfinished update with {len(queued):,} files ({size}) "
+                "still to go")
+            self.update_records(self.read_queued(queued))
+        elif self.pipeline:
+            self.update_pipeline()
+        elif self.streaming:
+            self.update_streaming()
+        else:
+            self.update_full()
+        self.finish()
+
+    def finish(self) -> None:
+        """
+        Record a completed update, then export files and metrics as asked.
+        """
+        if self.links.num_shared:
+            logger.info(
+                f"Shared hashes between hard links, instead of reading "
+                f"{self.links.num_shared:,} files again")
+        self.db.update_metadata(label=self.label)
+        if self.export_index:
+            write_index(self.db)
+        if self.bloom_error_rate is not None:
+            write_filter(self.db, self.bloom_error_rate)
+        if self.metrics is not None:
+            self.metrics.stop('update')
+            database = {
+                'files': self.db.files_count(),
+                'bytes': self.db.files_size(),
+                'algorithm': self.db.algorithm,
+            }
+            self.metrics.write(
+                self.metrics_path, root=str(self.root), label=self.db.label,
+                database=database)
 
+    def update_full(self) -> None:
+        """
+        Bring database up-to-date with file tree, reading both into memory.
+        """
         # Create file tree
         ignored = self.build_ignored()
         files = self.read_files(ignored)
@@ -37,30 +225,169 @@ class Updater:
         orphans = self.find_orphans(records, files)
         if orphans:
             logger.info(f"Delete {len(orphans):,} orphaned records from database")
-        for orphan in orphans:
-            self.db.delete(self.root / orphan)
+        with self.phase('orphans', len(orphans)) as phase:
+            for orphan in orphans:
+                self.db.delete(self.root / orphan)
+                phase.advance()
 
         # Compare files to existing records
         to_update = []
         for relpath in files:
-            file_ = files[relpath]
+            entry = files[relpath]
             record = records.get(relpath)
-            if self.should_update(file_, record):
-                to_update.append(relpath)
+            if self.should_update(entry, record):
+                to_update.append(entry)
+        self.backfill()
 
         # Update database
+        to_update = self.schedule(to_update)
+        self.db.queue(to_update)
         self.update_records(to_update)
 
-    def should_update(self, file_, record):
+    def update_pipeline(self) -> None:
+        """
+        Bring database up-to-date with file tree, every phase at once.
+
+        Like `update_streaming()`, the tree and records are merge-joined,
+        in constant memory, and nothing is queued in the database. Files
+        are stat'ed by several threads at once, while earlier files are
+        being hashed and written, which helps most on network and other
+        high-latency file systems. Files are hashed in the order they are
+        found; `order` is ignored. See `pipeline.Pipeline`.
+        """
+        Pipeline(self).run()
+
+    def update_streaming(self) -> None:
+        """
+        Bring database up-to-date with file tree, in constant memory.
+
+        The file tree is walked in the same order that records are read from
+        the database, and the two merge-joined together. New, changed, and
+        orphaned files are found and dealt with as the walk proceeds,
+        without ever holding all of either in memory.
+
+        Files to be updated are not queued in the database. Should a
+        streaming update be interrupted, the next update must walk the tree
+        again, but still only re-hashes files not yet written.
+        """
+        estimate = (self.db.files_count(), self.db.files_size())
+        tree = Tree(
+            self.root, show_hidden=False, ignore=self.build_ignored(),
+            precount=False, estimate=estimate, on_progress=self._on_progress)
+        records = self.db.files(ordered=True)
+        pairs = merge_join(tree.entries(ordered=True), records, key=merge_key)
+
+        orphans = []
+        orphans_phase = self.phase('orphans')
+
+        def changed():
+            for entry, record in pairs:
+                if entry is None:
+                    orphans.append(record.relpath)
+                    if len(orphans) >= self.batch_size:
+                        self.db.delete_many(orphans)
+                        orphans_phase.advance(len(orphans))
+                        orphans.clear()
+                elif self.should_update(entry, record):
+                    yield entry
+                else:
+                    self.backfill(at_least=self.batch_size)
+
+        started = perf_counter()
+        # Schedule one batch at a time, to keep memory use bounded
+        batches = map(self.schedule, chunked(changed(), self.batch_size))
+        self.update_records(entry for batch in batches for entry in batch)
+        self.backfill()
+        self.db.delete_many(orphans)
+        orphans_phase.advance(len(orphans))
+        orphans_phase.finish()
+        num_orphans = orphans_phase.files
+        elapsed = perf_counter() - started
+        total_size = file_size(tree.total_bytes, traditional=True)
+        logger.info(
+            f"Streamed {tree.total_files:,} files ({total_size}) from file system, "
+            f"deleting {num_orphans:,} orphaned records, in {elapsed:.3f} seconds")
+
+    def phase(self, name, total_files=None, total_bytes=None):
+        """
+        Start reporting progress of a new phase of the update.
+        """
+        return Phase(self._on_progress, name, total_files, total_bytes)
+
+    def schedule(self, entries):
+        """
+        Sort entries into the order their files should be hashed in.
+
+        In lazy mode files are not read by the update, so their order is
+        kept as-is.
+        """
+        if self.lazy or self.order == 'name':
+            return entries
+        started = perf_counter()
+        entries = schedule(entries, self.root, self.order)
+        elapsed = perf_counter() - started
+        logger.debug(
+            f"Scheduled {len(entries):,} files in {self.order} order "
+            f"in {elapsed:.3f} seconds")
+        return entries
+
+    def should_update(self, entry, record):
+        """
+        Has the file changed since its record was last updated?
+
+        A file is considered unchanged only if its size, modification time,
+        status change time, and inode number all match its record. Unchanged
+        files whose records lack any of these are noted, see `backfill()`.
+        """
         if record is None:
             return True
 
-        if file_.size == record.size:
+        # Hash missing from a previous lazy update?
+        if not self.lazy and record.sha256 is None:
+            return True
+
+        # Chunks wanted, but never stored?
+        if self.chunking and record.chunked is None:
+            return True
+
+        # Hash left over from a different algorithm?
+        if record.sha256 is not None and record.algorithm != self.db.algorithm:
+            return True
+
+        if record.mtime_ns is None:
+            # Record from before full-precision times were stored
+            current = (entry.size, entry.mtime)
+            stored = (record.size, record.mtime)
+        else:
+            current = (entry.size, entry.mtime_ns, entry.ctime_ns)
+            stored = (record.size, record.mtime_ns, record.ctime_ns)
+            if self.check_inodes:
+                current += (entry.inode,)
+                stored += (record.inode,)
+
+        if current == stored:
             logger.debug("Skip: %s", record.relpath)
+            if record.mtime_ns is None or record.device is None:
+                self._backfill.append(entry)
             return False
 
         return True
 
+    def backfill(self, db=None, at_least=1):
+        """
+        Save metadata missing from the records of unchanged files.
+
+        Entries are noted by `should_update()`, from any thread, and saved
+        here using the given database, by default our own, once there are at
+        least `at_least` of them.
+        """
+        if len(self._backfill) < at_least:
+            return
+        entries = []
+        while self._backfill:
+            entries.append(self._backfill.popleft())
+        (self.db if db is None else db).backfill(entries)
+
     def build_ignored(self):
         """
         Build list of relative paths to ignore
@@ -70,6 +397,11 @@ class Updater:
         relpaths.append(self.db_file)
         for suffix in ('-wal', '-shm'):
             relpaths.append(self.db_file + suffix)
+
+        # ...and exported files
+        for exported in (index_path, filter_path):
+            name = exported(Path(self.db_file)).name
+            relpaths.extend([name, name + '.tmp'])
         return relpaths
 
     def find_orphans(self, existing, tree) -> List[FileRecord]:
@@ -82,13 +414,87 @@ class Updater:
         orphans = list(existing.keys() - tree.keys())
         return orphans
 
+    def hash_files(self, entries):
+        """
+        Generate `FileRecord` objects, in order, with their hashes calculated.
+
+        Hashing is shared between `workers` threads. Python's `hashlib`
+        releases the GIL while hashing, as does reading files, so threads
+        are enough to keep several cores busy. Only a few files per worker
+        are in-flight at any one time. If `idle_priority` is set, even a
+        single worker gets its own thread, so its priority can be lowered.
+
+        In lazy mode no files are read at all, as the database decides which
+        files need to be hashed.
+
+        Files that cannot be read are logged, dropped from the queue, and
+        skipped, so they cannot block later updates.
+        """
+        for record in self._hash_files(entries):
+            if record is None:
+                self.db.dequeue([self._skipped.popleft()])
+                continue
+            yield record
+
+    def _hash_files(self, entries):
+        if self.lazy:
+            yield from map(FileRecord.from_entry, entries)
+            return
+
+        if self.workers == 1 and not self.idle_priority:
+            yield from map(self._prepare, entries)
+            return
+
+        initializer = lower_priority if self.idle_priority else None
+        with ThreadPoolExecutor(
+                self.workers, thread_name_prefix='hash', initializer=initializer) as executor:
+            pending: deque = deque()
+            for entry in entries:
+                pending.append(executor.submit(self._prepare, entry))
+                if len(pending) >= self.workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def read_queued(self, relpaths):
+        """
+        Read fresh `TreeEntry` objects for queued files.
+
+        Files that have vanished, or can no longer be read, since they were
+        queued are dropped from the queue.
+        """
+        entries = []
+        missing = []
+        for relpath in relpaths:
+            try:
+                stat = os.lstat(os.path.join(self.root, relpath))
+            except FileNotFoundError:
+                logger.warning("Queued file has disappeared: %s", relpath)
+                missing.append(relpath)
+                continue
+            except OSError as e:
+                logger.warning("Could not read queued file %s: %s", relpath, e)
+                missing.append(relpath)
+                continue
+            if not S_ISREG(stat.st_mode):
+                logger.warning("Queued path is no longer a file: %s", relpath)
+                missing.append(relpath)
+                continue
+            entries.append(TreeEntry.from_stat(relpath, stat))
+        self.db.dequeue(missing)
+        return entries
+
     def read_records(self):
         """
         Read every database record into a dictionary, keyed by relpath.
         """
         logger.debug(f"Load records from database")
         started = perf_counter()
-        existing = {record.relpath: record for record in self.db.files()}
+        existing = {}
+        with self.phase('records', self.db.files_count()) as phase:
+            for record in self.db.files():
+                existing[record.relpath] = record
+                phase.advance(1, record.size)
         elapsed = perf_counter() - started
         logger.info(
             f"Loaded {len(existing):,} records from "
@@ -97,15 +503,24 @@ class Updater:
 
     def read_files(self, ignored):
         """
-        Read metadata about every file in root into a dictionary, keyed by relpath.
+        Read `TreeEntry` for every file in root into a dictionary, keyed by relpath.
         """
         logger.debug(f"Load files from file tree")
-        tree = Tree(self.root, show_hidden=False, ignore=ignored)
+
+        # Walk tree just once, using totals from the last run for progress
+        estimate = (self.db.files_count(), self.db.files_size())
+        tree = Tree(
+            self.root, show_hidden=False, ignore=ignored,
+            precount=False, estimate=estimate, on_progress=self._on_progress)
         files = {}
-        started = perf_counter()
-        for file_ in tree.files():
-            relpath = file_.relative_to(self.root)
-            files[relpath] = file_
+        started = last_report = perf_counter()
+        for entry in tree.entries():
+            files[entry.relpath] = entry
+            if tree.progress is not None and perf_counter() - last_report > 10.0:
+                last_report = perf_counter()
+                logger.info(
+                    f"Loaded {tree.walked_files:,} of about {tree.estimated_files:,} "
+                    f"files ({tree.progress:.0%})")
         elapsed = perf_counter() - started
         total_size = file_size(tree.total_bytes, traditional=True)
         logger.info(
@@ -113,12 +528,85 @@ class Updater:
             f"file system in {elapsed:.3f} seconds")
         return files
 
-    def update_records(self, files):
+    def update_records(self, entries):
+        """
+        Update (or create) records for the given `TreeEntry` objects.
+
+        Files are hashed by `hash_files()`, while this thread alone writes to
+        the database, in batches.
+        """
+        total_files = total_bytes = None
+        if isinstance(entries, list):
+            total_files = len(entries)
+            total_bytes = sum(entry.size for entry in entries)
+
+        started = perf_counter()
+        hashing = self.phase('hash', total_files, total_bytes)
+        writing = self.phase('write', total_files, total_bytes)
+
+        def hashed():
+            for record in self.hash_files(entries):
+                hashing.advance(1, record.size)
+                yield record
+            hashing.finish()
+
+        def written(batch):
+            writing.advance(len(batch), sum(record.size for record in batch))
+        num_updated = self.db.add_many(
+            hashed(), lazy=self.lazy, batch_size=self.batch_size, on_batch=written)
+        writing.finish()
+        elapsed = perf_counter() - started
+        logger.info(
+            f"Updated records for {num_updated:,} files "
+            f"in {elapsed:.3f} seconds")
+
+    def _prepare(self, entry):
         """
-        Update (or create) records for every file under root.
+        Calculate hashes for given tree entry.
+
+        A file with several hard links is only read once, the first time
+        any of its names is reached.
+
+        Returns `None` if the file could not be read, after noting its
+        relpath to be dropped from the queue.
         """
-        num_updated = 0
-        for relpath in files:
-            self.db.add(self.root / relpath)
-            num_updated += 1
-        logger.info(f"Updated records for {num_updated:,} files")
+        try:
+            return self.links.hash(entry, self._hash)
+        except (NotAFile, OSError) as e:
+            logger.warning("Could not hash %s: %s", entry.relpath, e)
+            self._skipped.append(entry.relpath)
+            return None
+
+    def _linked(self, entry):
+        """
+        Find hashes already stored for another link to entry's file.
+        """
+        return self.db.linked(entry, chunks=self.chunking)
+
+    def _hash(self, entry):
+        """
+        Read file for given tree entry, calculating its hashes.
+        """
+        record = FileRecord.from_entry(entry)
+        on_read = None
+        if self.throttle is not None:
+            self.throttle.file()
+            on_read = self.throttle.read
+        file_ = File(self.root / entry.relpath, self.db.algorithm, on_read, self.chunking)
+        # Full hash first, the fingerprint comes from the same read
+        record.sha256 = file_.sha256
+        record.fingerprint = file_.fingerprint
+        record.algorithm = file_.algorithm
+        if self.chunking:
+            record.chunks = file_.chunks
+        return record
+
+
+def merge_key(item):
+    """
+    Key to merge-join `TreeEntry` and `FileRecord` objects.
+
+    Returns:
+        2-tuple of folder relpath and file name.
+    """
+    return split(item.relpath)
@@ -1,6 +1,76 @@
 
+import itertools
 import math
 import re
+from typing import Any, Callable, Iterable, Iterator, List, Tuple, TypeVar
+
+
+T = TypeVar('T')
+
+
+def chunked(iterable: Iterable[T], size: int) -> Iterator[List[T]]:
+    """
+    Split iterable into lists of at most the given size.
+
+        >>> list(chunked(range(5), 2))
+        [[0, 1], [2, 3], [4]]
+    """
+    if size < 1:
+        raise ValueError(f"Chunk size must be positive, given: {size}")
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def merge_join(
+    left: Iterable[Any],
+    right: Iterable[Any],
+    key: Callable[[Any], Any],
+) -> Iterator[Tuple[Any, Any]]:
+    """
+    Full outer join of two iterables, both already sorted by the given key.
+
+    Keys must be unique within each iterable. Only one item from each
+    iterable is held at a time, so memory use is constant.
+
+        >>> list(merge_join([1, 2], [2, 3], key=int))
+        [(1, None), (2, 2), (None, 3)]
+
+    Yields:
+        2-tuple of items with equal keys, with `None` in place of a missing item.
+    """
+    missing = object()
+    left_iter = iter(left)
+    right_iter = iter(right)
+    a = next(left_iter, missing)
+    b = next(right_iter, missing)
+    if a is not missing:
+        key_a = key(a)
+    if b is not missing:
+        key_b = key(b)
+
+    while a is not missing or b is not missing:
+        if b is missing or (a is not missing and key_a < key_b):
+            yield (a, None)
+            a = next(left_iter, missing)
+            if a is not missing:
+                key_a = key(a)
+        elif a is missing or key_b < key_a:
+            yield (None, b)
+            b = next(right_iter, missing)
+            if b is not missing:
+                key_b = key(b)
+        else:
+            yield (a, b)
+            a = next(left_iter, missing)
+            b = next(right_iter, missing)
+            if a is not missing:
+                key_a = key(a)
+            if b is not missing:
+                key_b = key(b)
 
 
 def file_size(size: int, traditional: bool = False) -> str:
@@ -0,0 +1,51 @@
+from pathlib import Path
+from pprint import pprint as pp
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from benchmarks.__main__ import compare
+from benchmarks.generate import TreeSpec, folders, generate, mutate, plan
+
+
+SPEC = TreeSpec(
+    num_files=200, min_size=0, max_size=1000, num_huge=1, huge_size=200_000,
+    depth=3, fanout=2, duplicate_ratio=0.25)
+
+
+class TestGenerate(TestCase):
+    def test_folders(self):
+        relpaths = folders(SPEC)
+        self.assertEqual(len(relpaths), 1 + 2 + 4 + 8)
+        self.assertEqual(max(relpath.count('/') for relpath in relpaths), 2)
+
+    def test_plan(self):
+        files = plan(SPEC)
+        self.assertEqual(files, plan(SPEC))
+        self.assertEqual(len(files), 201)
+        self.assertNotEqual(files, plan(TreeSpec(**{**SPEC.__dict__, 'seed': 2})))
+
+        # Roughly a quarter are copies
+        seeds = {seed for relpath, size, seed in files}
+        self.assertTrue(20 < len(files) - len(seeds) < 80)
+
+    def test_generate(self):
+        with TemporaryDirectory() as first, TemporaryDirectory() as second:
+            total = generate(Path(first), SPEC)
+            generate(Path(second), SPEC)
+            for relpath, size, seed in plan(SPEC):
+                data = (Path(first) / relpath).read_bytes()
+                self.assertEqual(len(data), size)
+                self.assertEqual(data, (Path(second) / relpath).read_bytes())
+            self.assertEqual(total, sum(size for _, size, _ in plan(SPEC)))
+
+            changed = mutate(Path(first), SPEC, fraction=0.05)
+            self.assertEqual(len(changed), 10)
+            path = Path(first) / changed[0]
+            self.assertNotEqual(path.read_bytes(), (Path(second) / changed[0]).read_bytes())
+
+
+class TestCompare(TestCase):
+    def test_compare(self):
+        results = {'walk': 1.3, 'hash': 1.1, 'new': 5.0}
+        baseline = {'walk': 1.0, 'hash': 1.0}
+        self.assertEqual(compare(results, baseline, 0.25), ["walk is 30% slower than baseline"])
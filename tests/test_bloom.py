@@ -0,0 +1,58 @@
+import hashlib
+from pathlib import Path
+from pprint import pprint as pp
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from mimicry.bloom import BloomFilter
+from mimicry.exceptions import MimicryError
+
+
+def make_hashes(start, stop):
+    return [hashlib.sha256(str(i).encode()).digest() for i in range(start, stop)]
+
+
+class TestBloomFilter(TestCase):
+    def test_sizing(self):
+        bloom = BloomFilter(1000, error_rate=0.01)
+        self.assertEqual(bloom.num_bits, 9586)
+        self.assertEqual(bloom.num_hashes, 7)
+        self.assertEqual(len(bloom.bits), 1199)
+
+    def test_bad_error_rate(self):
+        with self.assertRaisesRegex(ValueError, "Error rate must be between zero and one"):
+            BloomFilter(1000, error_rate=1.5)
+
+    def test_membership(self):
+        added = make_hashes(0, 2000)
+        bloom = BloomFilter(len(added), error_rate=0.01)
+        for sha256 in added:
+            bloom.add(sha256)
+        self.assertEqual(len(bloom), 2000)
+
+        # No false negatives, and only a few false positives
+        self.assertTrue(all(sha256 in bloom for sha256 in added))
+        false_positives = sum(sha256 in bloom for sha256 in make_hashes(2000, 12000))
+        self.assertLess(false_positives, 200)
+
+    def test_save_load(self):
+        added = make_hashes(0, 100)
+        bloom = BloomFilter(len(added), error_rate=0.001)
+        for sha256 in added:
+            bloom.add(sha256)
+        with TemporaryDirectory(prefix='mimicry-') as folder:
+            path = Path(folder) / 'mimicry.bloom'
+            bloom.save(path)
+            loaded = BloomFilter.load(path)
+        self.assertEqual(loaded.bits, bloom.bits)
+        self.assertEqual(loaded.num_hashes, bloom.num_hashes)
+        self.assertEqual(loaded.error_rate, 0.001)
+        self.assertEqual(len(loaded), 100)
+        self.assertTrue(all(sha256 in loaded for sha256 in added))
+
+    def test_load_bad_file(self):
+        with TemporaryDirectory(prefix='mimicry-') as folder:
+            path = Path(folder) / 'mimicry.bloom'
+            path.write_bytes(b'Nope')
+            with self.assertRaisesRegex(MimicryError, "Not a filter file"):
+                BloomFilter.load(path)
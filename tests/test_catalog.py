@@ -0,0 +1,154 @@
+import hashlib
+from pathlib import Path
+from pprint import pprint as pp
+import sqlite3
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from mimicry.catalog import Catalog
+from mimicry.exceptions import MimicryError, NotAFile
+from mimicry.updater import Updater
+
+
+class TestCatalog(TestCase):
+    """
+    Two drives, each with their own database.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.folders = []
+        cls.db_paths = []
+        drives = {
+            'red': {'shared.txt': b'S' * 100, 'red.txt': b'R' * 50, 'again.txt': b'R' * 50},
+            'blue': {'copy/shared.txt': b'S' * 100, 'blue.txt': b'B' * 70},
+        }
+        for label, files in drives.items():
+            folder = TemporaryDirectory(prefix='mimicry-')
+            root = Path(folder.name)
+            for relpath, contents in files.items():
+                path = root / relpath
+                path.parent.mkdir(exist_ok=True, parents=True)
+                path.write_bytes(contents)
+            Updater(root, label=label, bloom_error_rate=0.01).update()
+            cls.folders.append(folder)
+            cls.db_paths.append(root / Updater.db_file)
+
+    @classmethod
+    def tearDownClass(cls):
+        for folder in cls.folders:
+            folder.cleanup()
+
+    def setUp(self):
+        self.catalog = Catalog(self.db_paths)
+
+    def tearDown(self):
+        self.catalog.close()
+
+    def test_missing_database(self):
+        with self.assertRaisesRegex(NotAFile, "Database not found: '/no/such/mimicry.db'"):
+            Catalog([Path('/no/such/mimicry.db')])
+
+    def test_labels(self):
+        self.assertEqual(self.catalog.labels, ['red', 'blue'])
+
+    def test_duplicates_across(self):
+        groups = list(self.catalog.duplicate_groups())
+        self.assertEqual(len(groups), 1)
+        found = [(label, record.relpath) for label, record in groups[0]]
+        self.assertEqual(found, [('red', 'shared.txt'), ('blue', 'copy/shared.txt')])
+
+    def test_filters_saved(self):
+        for db_path in self.db_paths:
+            self.assertTrue(db_path.with_suffix('.bloom').is_file())
+
+    def test_locate(self):
+        blue = hashlib.sha256(b'B' * 70).digest()
+        shared = hashlib.sha256(b'S' * 100).digest()
+        missing = hashlib.sha256(b'missing').digest()
+        found = self.catalog.locate([blue, shared, missing])
+        self.assertEqual(found.keys(), {blue, shared})
+        self.assertEqual(
+            [(label, record.relpath) for label, record in found[blue]],
+            [('blue', 'blue.txt')])
+        self.assertEqual(len(found[shared]), 2)
+
+    def test_locate_skips_databases(self):
+        blue = hashlib.sha256(b'B' * 70).digest()
+        self.catalog.locate([blue])
+        self.assertEqual(list(self.catalog._dbs), [1])
+
+    def test_stale_filter_removed(self):
+        with TemporaryDirectory(prefix='mimicry-') as folder:
+            root = Path(folder)
+            (root / 'first.txt').write_bytes(b'1' * 10)
+            Updater(root, bloom_error_rate=0.01).update()
+            (root / 'second.txt').write_bytes(b'2' * 20)
+            Updater(root).update()
+            db_path = root / Updater.db_file
+            self.assertFalse(db_path.with_suffix('.bloom').exists())
+            catalog = Catalog([db_path])
+            second = hashlib.sha256(b'2' * 20).digest()
+            self.assertEqual(list(catalog.locate([second])), [second])
+            catalog.close()
+
+    def test_unhashed_left_out(self):
+        # Lazily updated drive is only read, its unhashed files left out
+        with TemporaryDirectory(prefix='mimicry-') as folder:
+            root = Path(folder)
+            (root / 'blue.txt').write_bytes(b'B' * 70)
+            Updater(root, label='green', lazy=True).update()
+            db_path = root / Updater.db_file
+            catalog = Catalog(self.db_paths + [db_path])
+            with self.assertLogs('mimicry.catalog', 'WARNING') as logs:
+                groups = list(catalog.duplicate_groups())
+            self.assertIn("Leaving out 1 files without a hash from 'green'", logs.output[0])
+            self.assertEqual(len(groups), 1)
+            self.assertEqual(catalog.db(2).unhashed_count(), 1)
+            catalog.close()
+
+    def test_algorithm_mismatch(self):
+        with TemporaryDirectory(prefix='mimicry-') as folder:
+            root = Path(folder)
+            (root / 'shared.txt').write_bytes(b'S' * 100)
+            Updater(root, label='green', algorithm='blake2b').update()
+            catalog = Catalog(self.db_paths + [root / Updater.db_file])
+            message = r"different hash algorithms \(blake2b: green; sha256: red, blue\)"
+            with self.assertRaisesRegex(MimicryError, message):
+                list(catalog.duplicate_groups())
+            catalog.close()
+
+    def test_databases_unchanged(self):
+        before = [path.read_bytes() for path in self.db_paths]
+        list(self.catalog.duplicate_groups())
+        self.catalog.locate([hashlib.sha256(b'S' * 100).digest()])
+        self.catalog.close()
+        self.assertEqual([path.read_bytes() for path in self.db_paths], before)
+
+    def test_old_schema(self):
+        # Never upgraded in place, as it may be a copy, or read-only
+        with TemporaryDirectory(prefix='mimicry-') as folder:
+            db_path = Path(folder) / 'mimicry.db'
+            connection = sqlite3.connect(db_path)
+            connection.executescript("""
+                CREATE TABLE files (
+                    id INTEGER PRIMARY KEY, name TEXT NOT NULL, size INTEGER,
+                    mtime INTEGER, sha256 BLOB, updated INTEGER,
+                    folder INTEGER NOT NULL, UNIQUE (name, folder));
+                CREATE TABLE folders (id INTEGER PRIMARY KEY, relpath TEXT UNIQUE NOT NULL);
+            """)
+            connection.close()
+            catalog = Catalog(self.db_paths + [db_path])
+            with self.assertRaisesRegex(MimicryError, "schema version 0 does not match"):
+                list(catalog.duplicate_groups())
+            catalog.close()
+            connection = sqlite3.connect(db_path)
+            version = connection.execute('PRAGMA user_version;').fetchone()[0]
+            connection.close()
+            self.assertEqual(version, 0)
+
+    def test_duplicates_all(self):
+        groups = list(self.catalog.duplicate_groups(across=False))
+        self.assertEqual(len(groups), 2)
+        found = {(label, record.relpath) for group in groups for label, record in group}
+        self.assertIn(('red', 'again.txt'), found)
+        self.assertIn(('red', 'red.txt'), found)
@@ -0,0 +1,67 @@
+import hashlib
+from pprint import pprint as pp
+import random
+from unittest import TestCase
+
+from mimicry.chunking import CHUNK_DIGEST_SIZE, Chunker, chunk_bytes
+
+
+def random_bytes(size, seed=1):
+    return random.Random(seed).randbytes(size)
+
+
+class TestChunker(TestCase):
+    def setUp(self):
+        self.data = random_bytes(1_000_000)
+        self.options = {'min_size': 2048, 'avg_size': 8192, 'max_size': 32768}
+        self.chunks = chunk_bytes(self.data, **self.options)
+
+    def test_chunks(self):
+        self.assertGreater(len(self.chunks), 50)
+        offset = 0
+        for chunk in self.chunks:
+            self.assertEqual(chunk.offset, offset)
+            data = self.data[offset:offset + chunk.size]
+            digest = hashlib.blake2b(data, digest_size=CHUNK_DIGEST_SIZE).digest()
+            self.assertEqual(chunk.digest, digest)
+            offset += chunk.size
+        self.assertEqual(offset, len(self.data))
+
+    def test_sizes(self):
+        sizes = [chunk.size for chunk in self.chunks[:-1]]
+        self.assertGreaterEqual(min(sizes), 2048)
+        self.assertLessEqual(max(sizes), 32768)
+        average = sum(sizes) / len(sizes)
+        self.assertTrue(4096 < average < 16384, average)
+
+    def test_fed_in_pieces(self):
+        # Cut points don't depend on how data is split between reads
+        chunker = Chunker(**self.options)
+        view = memoryview(self.data)
+        offset = 0
+        rng = random.Random(2)
+        while offset < len(view):
+            size = rng.randint(1, 50_000)
+            chunker.feed(view[offset:offset + size])
+            offset += size
+        self.assertEqual(chunker.finish(), self.chunks)
+
+    def test_insertion(self):
+        # Only chunks around an insertion change
+        edited = self.data[:100_000] + b'inserted' + self.data[100_000:]
+        chunks = chunk_bytes(edited, **self.options)
+        before = {chunk.digest for chunk in self.chunks}
+        after = {chunk.digest for chunk in chunks}
+        self.assertLessEqual(len(before - after), 2)
+
+    def test_max_size(self):
+        # No cut points in uniform data, so every chunk is as large as allowed
+        chunks = chunk_bytes(b'\0' * 100_000, **self.options)
+        self.assertEqual([chunk.size for chunk in chunks], [32768] * 3 + [1696])
+
+    def test_empty(self):
+        self.assertEqual(chunk_bytes(b''), [])
+
+    def test_invalid_sizes(self):
+        with self.assertRaisesRegex(ValueError, "Chunk sizes must increase"):
+            Chunker(min_size=10, avg_size=5, max_size=20)
@@ -0,0 +1,122 @@
+import os
+from pathlib import Path
+from pprint import pprint as pp
+from tempfile import TemporaryDirectory
+from unittest import TestCase, mock
+
+from mimicry import compare
+from mimicry.compare import duplicate_groups, identical
+from mimicry.database import DB
+
+
+class TestCaseFolder(TestCase):
+    def setUp(self):
+        self.folder = TemporaryDirectory(prefix='mimicry-')
+        self.root = Path(self.folder.name)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def make_file(self, relpath, data):
+        path = self.root / relpath
+        path.parent.mkdir(exist_ok=True, parents=True)
+        path.write_bytes(data)
+        return path
+
+
+class TestIdentical(TestCaseFolder):
+    def setUp(self):
+        super().setUp()
+        size = 300_000
+        self.a1 = self.make_file('a1', b'a' * size)
+        self.a2 = self.make_file('a2', b'a' * size)
+        self.b1 = self.make_file('b1', b'a' * (size - 1) + b'b')
+        self.b2 = self.make_file('b2', b'a' * (size - 1) + b'b')
+        self.c = self.make_file('c', b'c' + b'a' * (size - 1))
+        self.paths = [self.a1, self.b1, self.c, self.a2, self.b2]
+
+    def test_identical(self):
+        groups = identical(self.paths)
+        self.assertEqual(groups, [[self.a1, self.a2], [self.b1, self.b2]])
+
+    def test_early_exit(self):
+        # File differing in its first byte is only read once
+        reads = []
+        original = open
+
+        def tracking_open(path, mode):
+            file_ = original(path, mode)
+            read = file_.read
+
+            def tracked(size):
+                reads.append(path)
+                return read(size)
+            file_.read = tracked
+            return file_
+        with mock.patch('builtins.open', tracking_open):
+            identical(self.paths)
+        self.assertEqual(reads.count(self.c), 1)
+        self.assertGreater(reads.count(self.a1), 3)
+
+    def test_too_many_open(self):
+        with mock.patch.object(compare, '_split_by', wraps=compare._split_by) as split:
+            groups = identical(self.paths, max_open=2)
+        self.assertEqual(groups, [[self.a1, self.a2], [self.b1, self.b2]])
+        self.assertEqual(split.call_args_list[0].args[1], 'fingerprint')
+
+    def test_unreadable(self):
+        missing = self.root / 'missing'
+        with self.assertLogs('mimicry.compare', 'WARNING'):
+            groups = identical([self.a1, missing, self.a2])
+        self.assertEqual(groups, [[self.a1, self.a2]])
+
+    def test_empty(self):
+        first = self.make_file('empty1', b'')
+        second = self.make_file('empty2', b'')
+        self.assertEqual(identical([first, second]), [[first, second]])
+        self.assertEqual(identical([first]), [])
+
+
+class TestDuplicateGroups(TestCaseFolder):
+    def setUp(self):
+        super().setUp()
+        self.db = DB(self.root / 'mimicry.db')
+        paths = [
+            self.make_file('one/x.txt', b'x' * 100),
+            self.make_file('two/x.txt', b'x' * 100),
+            self.make_file('y.txt', b'y' * 100),
+            self.make_file('unique.txt', b'u' * 50),
+        ]
+        link = self.root / 'one/link.txt'
+        os.link(paths[0], link)
+        paths.append(link)
+        for path in paths:
+            self.db.add(path, lazy=True)
+
+    def tearDown(self):
+        self.db.connection.close()
+        super().tearDown()
+
+    def relpaths(self, groups):
+        return [[record.relpath for record in group] for group in groups]
+
+    def test_size_groups(self):
+        groups = self.relpaths(self.db.size_groups())
+        self.assertEqual(groups, [['y.txt', 'one/link.txt', 'one/x.txt', 'two/x.txt']])
+
+    def test_duplicate_groups(self):
+        groups = self.relpaths(duplicate_groups(self.db))
+        self.assertEqual(groups, [['one/link.txt', 'one/x.txt', 'two/x.txt']])
+        groups = self.relpaths(duplicate_groups(self.db, hardlinks=False))
+        self.assertEqual(groups, [['one/link.txt', 'two/x.txt']])
+
+    def test_matches_hashing(self):
+        expected = self.relpaths(self.db.duplicate_groups())
+        self.assertEqual(self.relpaths(duplicate_groups(self.db)), expected)
+
+        # Every file hashed, so none are read
+        self.db.add(self.root / 'y.txt')
+        with mock.patch.object(compare, 'identical') as identical_:
+            groups = self.relpaths(duplicate_groups(self.db))
+        identical_.assert_not_called()
+        self.assertEqual(groups, expected)
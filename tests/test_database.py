@@ -1,13 +1,17 @@
 
-import os.path
+import os
 from pathlib import Path
 from pprint import pprint as pp
+import sqlite3
 from tempfile import TemporaryDirectory
+from typing import Iterator
 from unittest import TestCase
 
 
 from mimicry.database import DB, FileRecord, NotUnderRoot
+from mimicry.exceptions import MimicryError
 from mimicry.file import File
+from mimicry.tree import TreeEntry
 
 
 class TestCaseData(TestCase):
@@ -27,9 +31,9 @@ class TestCaseData(TestCase):
         # ~ import subprocess; subprocess.run(['sqlite3', cls.db_path, '.dump'])
         cls.folder.cleanup()
 
-    def make_file(self, relpath, size):
+    def make_file(self, relpath, size, fill=b'@'):
         """
-        Make a file under our temporary folder.
+        Make a file under our temporary folder, filled with `fill` bytes.
 
         Returns (`Path`): Path to created file.
         """
@@ -41,7 +45,7 @@ class TestCaseData(TestCase):
         # Create file
         path = folder / relpath.name
         with open(path, 'wb') as fp:
-            fp.write(b'@'*size)
+            fp.write(fill*size)
         return Path(path)
 
 
@@ -66,6 +70,8 @@ class TestAdd(TestCaseData):
         self.assertEqual(record.relpath, 'something/else/was/here.png')
         self.assertEqual(record.size, 1069)
         self.assertGreater(record.mtime, 1e9)
+        self.assertEqual(record.mtime_ns, os.stat(path).st_mtime_ns)
+        self.assertEqual(record.inode, os.stat(path).st_ino)
         self.assertEqual(
             record.sha256.hex(),
             'e42558af9bc23f4aad7e40f39eb6f5c4a224f714a511a3177abc6639df2b3129'
@@ -88,6 +94,78 @@ class TestAdd(TestCaseData):
         self.assertEqual(count, count_after)
 
 
+class TestAddMany(TestCaseData):
+    def test_add_many(self):
+        records = []
+        for index in range(7):
+            path = self.make_file(f'many/file{index}.txt', 100 + index)
+            records.append(FileRecord.from_file(File(path), self.db.root))
+        count = self.db.files_count()
+        num_added = self.db.add_many(records, batch_size=3)
+        self.assertEqual(num_added, 7)
+        self.assertEqual(self.db.files_count(), count + 7)
+
+        # Missing hashes calculated
+        record = self.db.get(Path(self.folder.name) / 'many/file6.txt')
+        self.assertEqual(record.size, 106)
+        self.assertEqual(len(record.sha256), 32)
+
+    def test_add_many_dequeued(self):
+        records = []
+        for index in range(4):
+            path = self.make_file(f'queued/file{index}.txt', 120 + index)
+            records.append(FileRecord.from_file(File(path), self.db.root))
+        self.db.queue(TreeEntry.from_stat(r.relpath, (self.db.root / r.relpath).stat())
+                      for r in records)
+        statements = []
+        self.db.connection.set_trace_callback(statements.append)
+        try:
+            self.db.add_many(records)
+        finally:
+            self.db.connection.set_trace_callback(None)
+        self.assertFalse(any(r.relpath in self.db.queued() for r in records))
+        self.assertEqual(sum('DELETE FROM queue' in s for s in statements), 1)
+
+    def test_folder_ids_cached(self):
+        statements = []
+        self.db.connection.set_trace_callback(statements.append)
+        try:
+            self.db.add(self.make_file('cached/folder/first.txt', 10))
+            self.assertTrue(any('INTO folders' in s for s in statements))
+            statements.clear()
+            self.db.add(self.make_file('cached/folder/second.txt', 11))
+            self.assertFalse(any('folders' in s for s in statements))
+        finally:
+            self.db.connection.set_trace_callback(None)
+
+    def test_chunks_untouched(self):
+        # Nothing to replace if chunks were never stored
+        statements = []
+        self.db.connection.set_trace_callback(statements.append)
+        try:
+            self.db.add(self.make_file('unchunked/file.txt', 13))
+            self.assertFalse(any('DELETE FROM chunks' in s for s in statements))
+        finally:
+            self.db.connection.set_trace_callback(None)
+
+    def test_folder_ids_loaded(self):
+        self.db.add(self.make_file('cached/loaded/file.txt', 12))
+        db = DB(self.db_path)
+        self.assertEqual(db._folder_ids, self.db._folder_ids)
+        self.assertIn('cached/loaded', db._folder_ids)
+        db.connection.close()
+
+    def test_add_many_given_hashes(self):
+        path = self.make_file('many/given.txt', 64)
+        record = FileRecord.from_file(File(path), self.db.root)
+        record.fingerprint = b'f' * 16
+        record.sha256 = b's' * 32
+        self.db.add_many([record])
+        record = self.db.get(path)
+        self.assertEqual(record.fingerprint, b'f' * 16)
+        self.assertEqual(record.sha256, b's' * 32)
+
+
 class TestDelete(TestCaseData):
     def test_delete(self):
         # Start with none
@@ -111,6 +189,76 @@ class TestDelete(TestCaseData):
         self.assertEqual(self.db.folders_count(), 2)
 
 
+class TestDuplicates(TestCaseData):
+    def test_duplicate_groups(self):
+        self.db.add(self.make_file('dupes/a/one.txt', 10, fill=b'1'))
+        self.db.add(self.make_file('dupes/b/one.txt', 10, fill=b'1'))
+        self.db.add(self.make_file('dupes/c/one.txt', 10, fill=b'1'))
+        self.db.add(self.make_file('dupes/a/two.txt', 20, fill=b'2'))
+        self.db.add(self.make_file('dupes/b/two.txt', 20, fill=b'2'))
+        self.db.add(self.make_file('dupes/unique.txt', 30, fill=b'3'))
+
+        groups = self.db.duplicate_groups()
+        self.assertIsInstance(groups, Iterator)
+        groups = sorted(groups, key=len)
+        self.assertEqual(len(groups), 2)
+        self.assertEqual(
+            [r.relpath for r in groups[0]], ['dupes/a/two.txt', 'dupes/b/two.txt'])
+        self.assertEqual(
+            [r.relpath for r in groups[1]],
+            ['dupes/a/one.txt', 'dupes/b/one.txt', 'dupes/c/one.txt'])
+
+        duplicates = self.db.duplicates()
+        self.assertEqual(len(duplicates), 2)
+        for sha256, group in duplicates.items():
+            self.assertTrue(all(r.sha256 == sha256 for r in group))
+
+    def test_indexes(self):
+        query = "SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='files';"
+        names = {row['name'] for row in self.db.connection.execute(query)}
+        self.assertIn('files_sha256_size', names)
+
+
+class TestHardLinks(TestCaseData):
+    def setUp(self):
+        self.original = self.make_file('links/original.txt', 40, fill=b'4')
+        self.link = Path(self.folder.name) / 'links/link.txt'
+        if not self.link.exists():
+            os.link(self.original, self.link)
+
+    def test_device_stored(self):
+        self.db.add(self.original)
+        record = self.db.get(self.original)
+        stat = self.original.stat()
+        self.assertEqual((record.device, record.inode), (stat.st_dev, stat.st_ino))
+
+    def test_duplicate_groups(self):
+        copy = self.make_file('links/copy.txt', 40, fill=b'4')
+        for path in (self.original, self.link, copy):
+            self.db.add(path)
+        groups = [g for g in self.db.duplicate_groups() if g[0].size == 40]
+        self.assertEqual(len(groups[0]), 3)
+
+        # Links collapsed to their first name
+        groups = [g for g in self.db.duplicate_groups(hardlinks=False) if g[0].size == 40]
+        relpaths = [record.relpath for record in groups[0]]
+        self.assertEqual(relpaths, ['links/copy.txt', 'links/link.txt'])
+
+        # Links alone are not duplicates
+        self.db.delete(copy)
+        groups = [g for g in self.db.duplicate_groups(hardlinks=False) if g[0].size == 40]
+        self.assertEqual(groups, [])
+
+    def test_lazy_links_not_twins(self):
+        original = self.make_file('links/lazy/original.bin', 5506)
+        link = original.with_name('link.bin')
+        os.link(original, link)
+        self.db.add(original, lazy=True)
+        self.db.add(link, lazy=True)
+        self.assertEqual(self.db.hash_pending(), 0)
+        self.assertIsNone(self.db.get(link).fingerprint)
+
+
 class TestErrors(TestCase):
     def test_not_existing_folder(self):
         path = Path('/no/such/folder/here')
@@ -119,6 +267,232 @@ class TestErrors(TestCase):
             DB(path)
 
 
+class TestLazy(TestCaseData):
+    def test_unique_size_not_hashed(self):
+        path = self.make_file('lazy/unique.bin', 5501)
+        self.db.add(path, lazy=True)
+        record = self.db.get(path)
+        self.assertEqual(record.size, 5501)
+        self.assertIsNone(record.sha256)
+
+    def test_size_twin_fingerprinted(self):
+        first = self.make_file('lazy/twin/first.bin', 5502)
+        second = self.make_file('lazy/twin/second.bin', 5502)
+        self.db.add(first, lazy=True)
+        self.db.add(second, lazy=True)
+        self.assertIsNone(self.db.get(first).fingerprint)
+        self.assertEqual(len(self.db.get(second).fingerprint), 16)
+        self.assertIsNone(self.db.get(second).sha256)
+
+    def test_fingerprint_twin_hashed(self):
+        first = self.make_file('lazy/fingerprint/first.bin', 5505)
+        second = self.make_file('lazy/fingerprint/second.bin', 5505)
+        third = self.make_file('lazy/fingerprint/third.bin', 5505)
+        for path in (first, second, third):
+            self.db.add(path, lazy=True)
+        self.assertIsNone(self.db.get(first).sha256)
+        self.assertIsNone(self.db.get(second).sha256)
+        self.assertEqual(len(self.db.get(third).sha256), 32)
+
+    def test_duplicates_hashes_pending(self):
+        first = self.make_file('lazy/pending/first.bin', 5503)
+        second = self.make_file('lazy/pending/second.bin', 5503)
+        self.db.add(first, lazy=True)
+        self.db.add(second, lazy=True)
+        duplicates = self.db.duplicates()
+        sha256 = self.db.get(first).sha256
+        self.assertEqual(sha256, self.db.get(second).sha256)
+        relpaths = {record.relpath for record in duplicates[sha256]}
+        self.assertEqual(relpaths, {'lazy/pending/first.bin', 'lazy/pending/second.bin'})
+
+    def test_different_fingerprint_not_hashed(self):
+        first = self.make_file('lazy/different/first.bin', 5504, fill=b'a')
+        second = self.make_file('lazy/different/second.bin', 5504, fill=b'b')
+        self.db.add(first, lazy=True)
+        self.db.add(second, lazy=True)
+        self.db.hash_pending()
+        for path in (first, second):
+            record = self.db.get(path)
+            self.assertEqual(len(record.fingerprint), 16)
+            self.assertIsNone(record.sha256)
+        self.assertNotEqual(
+            self.db.get(first).fingerprint, self.db.get(second).fingerprint)
+
+
+class TestMetadata(TestCaseData):
+    def test_metadata(self):
+        # Saved on creation, before any update has completed
+        metadata = self.db.metadata()
+        self.assertEqual(metadata['algorithm'], 'sha256')
+        self.assertEqual(metadata['updated'], 0)
+        self.assertEqual(self.db.label, self.db.root.name)
+
+        self.db.update_metadata(label='Blue Drive')
+        metadata = self.db.metadata()
+        self.assertEqual(metadata['label'], 'Blue Drive')
+        self.assertEqual(metadata['root'], str(self.db.root))
+        self.assertGreater(metadata['updated'], 1e9)
+
+        # Label kept unless replaced
+        self.db.update_metadata()
+        self.assertEqual(self.db.label, 'Blue Drive')
+        self.db.update_metadata(label='Red Drive')
+        self.assertEqual(self.db.label, 'Red Drive')
+
+
+class TestAlgorithm(TestCase):
+    def setUp(self):
+        self.folder = TemporaryDirectory(prefix='mimicry-')
+        self.db_path = Path(self.folder.name) / 'mimicry.db'
+        self.path = self.db_path.parent / 'hello.txt'
+        self.path.write_bytes(b'Hello')
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_default(self):
+        db = DB(self.db_path)
+        db.add(self.path)
+        self.assertEqual(db.algorithm, 'sha256')
+        record = db.get(self.path)
+        self.assertEqual(record.algorithm, 'sha256')
+        self.assertEqual(record.sha256, File(self.path).sha256)
+
+    def test_algorithm_saved(self):
+        db = DB(self.db_path, algorithm='blake2b')
+        db.add(self.path)
+        db.update_metadata()
+        record = db.get(self.path)
+        self.assertEqual(record.algorithm, 'blake2b')
+        self.assertEqual(record.sha256, File(self.path, 'blake2b').sha256)
+        db.connection.close()
+
+        # Existing algorithm wins
+        db = DB(self.db_path, algorithm='sha256')
+        self.assertEqual(db.algorithm, 'blake2b')
+
+    def test_algorithm_saved_on_creation(self):
+        # Kept even if first update is interrupted, before it completes
+        db = DB(self.db_path, algorithm='blake2b')
+        db.connection.close()
+        db = DB(self.db_path)
+        self.assertEqual(db.algorithm, 'blake2b')
+
+    def test_rehash(self):
+        db = DB(self.db_path)
+        db.add(self.path)
+        db.update_metadata()
+        self.assertEqual(db.rehash('blake2b'), 1)
+        self.assertEqual(db.algorithm, 'blake2b')
+        self.assertEqual(db.metadata()['algorithm'], 'blake2b')
+        record = db.get(self.path)
+        self.assertEqual(record.algorithm, 'blake2b')
+        self.assertEqual(record.sha256, File(self.path, 'blake2b').sha256)
+
+        # Nothing left to do
+        self.assertEqual(db.rehash('blake2b'), 0)
+
+    def test_unknown(self):
+        with self.assertRaisesRegex(MimicryError, "Unknown hash algorithm: 'md5'"):
+            DB(self.db_path, algorithm='md5')
+
+
+class TestMigrate(TestCase):
+    def test_upgrade_version_0(self):
+        with TemporaryDirectory(prefix='mimicry-') as folder:
+            db_path = Path(folder) / 'mimicry.db'
+            connection = sqlite3.connect(db_path)
+            connection.executescript("""
+                CREATE TABLE files (
+                    id INTEGER PRIMARY KEY, name TEXT NOT NULL, size INTEGER,
+                    mtime INTEGER, sha256 BLOB, updated INTEGER,
+                    folder INTEGER NOT NULL, UNIQUE (name, folder));
+                CREATE TABLE folders (id INTEGER PRIMARY KEY, relpath TEXT UNIQUE NOT NULL);
+            """)
+            connection.close()
+
+            db = DB(db_path)
+            version = db.connection.execute('PRAGMA user_version;').fetchone()[0]
+            self.assertEqual(version, DB.schema_version)
+            columns = {row['name'] for row in db.connection.execute('PRAGMA table_info(files);')}
+            expected = {'fingerprint', 'mtime_ns', 'inode', 'algorithm', 'device', 'chunked'}
+            self.assertTrue(expected <= columns)
+            self.assertEqual(db.algorithm, 'sha256')
+            db.update_metadata()
+            self.assertEqual(db.metadata()['algorithm'], 'sha256')
+            db.connection.close()
+
+    def test_upgraded_hashes_not_read(self):
+        # Fully hashed records from before fingerprints are never read again
+        with TemporaryDirectory(prefix='mimicry-') as folder:
+            root = Path(folder)
+            db_path = root / 'mimicry.db'
+            connection = sqlite3.connect(db_path)
+            connection.executescript("""
+                CREATE TABLE files (
+                    id INTEGER PRIMARY KEY, name TEXT NOT NULL, size INTEGER,
+                    mtime INTEGER, sha256 BLOB, updated INTEGER,
+                    folder INTEGER NOT NULL, UNIQUE (name, folder));
+                CREATE TABLE folders (id INTEGER PRIMARY KEY, relpath TEXT UNIQUE NOT NULL);
+                INSERT INTO folders (id, relpath) VALUES (1, '');
+            """)
+            for name in ('first.txt', 'second.txt', 'third.txt'):
+                path = root / name
+                path.write_bytes(b'same' if name != 'third.txt' else b'diff')
+                connection.execute(
+                    "INSERT INTO files (name, size, mtime, sha256, folder) VALUES (?, 4, 0, ?, 1);",
+                    (name, File(path).sha256))
+            connection.commit()
+            connection.close()
+
+            db = DB(db_path)
+            opened = []
+            file_ = db._file
+            db._file = lambda path: opened.append(path) or file_(path)
+            groups = list(db.duplicate_groups())
+            self.assertEqual(opened, [])
+            self.assertEqual([len(group) for group in groups], [2])
+
+            # New lazy record, sharing only a size, still gets a full hash
+            (root / 'fourth.txt').write_bytes(b'same')
+            db.add(root / 'fourth.txt', lazy=True)
+            self.assertIsNone(db.get(root / 'fourth.txt').sha256)
+            groups = list(db.duplicate_groups())
+            self.assertEqual([len(group) for group in groups], [3])
+            db.connection.close()
+
+
+class TestRelativePath(TestCase):
+    def test_duplicates(self):
+        # Lazy records hashed later, relative to the database's real root
+        cwd = os.getcwd()
+        with TemporaryDirectory(prefix='mimicry-') as folder:
+            try:
+                os.chdir(folder)
+                db = DB(Path('mimicry.db'))
+                self.assertTrue(db.root.is_absolute())
+                for name in ('first.txt', 'second.txt'):
+                    path = Path(folder, name).resolve()
+                    path.write_bytes(b'same')
+                    db.add(path, lazy=True)
+                groups = list(db.duplicate_groups())
+                self.assertEqual([len(group) for group in groups], [2])
+                db.connection.close()
+            finally:
+                os.chdir(cwd)
+
+    def test_nothing_lazy(self):
+        # Nothing read, nor even looked for, without lazy records
+        with TemporaryDirectory(prefix='mimicry-') as folder:
+            db = DB(Path(folder) / 'mimicry.db')
+            path = Path(folder, 'hello.txt')
+            path.write_bytes(b'Hello')
+            db.add(path)
+            db._hash_rows = None
+            self.assertEqual(db.hash_pending(), 0)
+            db.connection.close()
+
+
 class TestQuery(TestCaseData):
     """
     Read only queries over same database.
@@ -135,7 +509,7 @@ class TestQuery(TestCaseData):
         """
         query = "SELECT name FROM sqlite_master WHERE type='table' ORDER BY name;"
         names = [row['name'] for row in self.db.connection.execute(query)]
-        self.assertEqual(names, ['files', 'folders', 'metadata'])
+        self.assertEqual(names, ['chunks', 'files', 'folders', 'metadata', 'queue'])
 
     def test_file_iteration(self):
         count = 0
@@ -147,6 +521,20 @@ class TestQuery(TestCaseData):
         self.assertGreater(count, 0)
         self.assertEqual(count, self.db.files_count())
 
+    def test_file_iteration_ordered(self):
+        self.db.add(self.make_file('some/path-x/first.txt', 1))
+        self.db.add(self.make_file('some/path/deeper/first.txt', 1))
+        keys = [os.path.split(r.relpath) for r in self.db.files(ordered=True)]
+        self.assertEqual(keys, sorted(keys))
+        self.assertEqual(len(keys), self.db.files_count())
+
+    def test_file_iteration_snapshot(self):
+        records = self.db.files(ordered=True)
+        next(records)
+        count = self.db.files_count()
+        self.db.add(self.make_file('some/path/zzz.txt', 1))
+        self.assertEqual(len(list(records)), count - 1)
+
     def test_files_size(self):
         bytes_at_start = self.db.files_size()
         self.assertIsInstance(bytes_at_start, int)
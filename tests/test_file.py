@@ -1,12 +1,14 @@
 
+import hashlib
 from pathlib import Path
 from pprint import pprint as pp
 import re
 import sys
+from tempfile import TemporaryDirectory
 from unittest import TestCase
 
-from mimicry.exceptions import NotAbsolute, NotAFile
-from mimicry.file import File
+from mimicry.exceptions import MimicryError, NotAbsolute, NotAFile
+from mimicry.file import File, read_buffer
 
 from . import DATA_FOLDER
 
@@ -33,6 +35,31 @@ class TestFile(TestCase):
         self.assertEqual(self.file.name, 'text1.txt')
         self.assertEqual(self.file.size, 1337)
 
+    def test_fingerprint(self):
+        fingerprint = self.file.fingerprint
+        self.assertIsInstance(fingerprint, bytes)
+        self.assertEqual(len(fingerprint), 16)
+        self.assertTrue(fingerprint is self.file.fingerprint)
+
+    def test_fingerprint_samples_ends(self):
+        with TemporaryDirectory(prefix='mimicry-') as folder:
+            size = File.fingerprint_sample * 3
+            first = Path(folder, 'first.bin')
+            second = Path(folder, 'second.bin')
+            first.write_bytes(b'@' * size)
+            second.write_bytes(b'@' * size)
+            self.assertEqual(File(first).fingerprint, File(second).fingerprint)
+
+            # Change to middle of file is not seen...
+            middle = bytearray(b'@' * size)
+            middle[size // 2] = 0
+            second.write_bytes(middle)
+            self.assertEqual(File(first).fingerprint, File(second).fingerprint)
+
+            # ...but a change to its last byte is.
+            second.write_bytes(b'@' * (size - 1) + b'!')
+            self.assertNotEqual(File(first).fingerprint, File(second).fingerprint)
+
     def test_sha256_hash(self):
         # SHA256 hash is byte string
         hashed = self.file.sha256
@@ -45,6 +72,65 @@ class TestFile(TestCase):
         hashed2 = self.file.sha256
         self.assertTrue(hashed is hashed2)
 
+    def test_sha256_sizes(self):
+        # Empty, single read, and many reads into a small buffer
+        with TemporaryDirectory(prefix='mimicry-') as folder:
+            for size in (0, 1, 1000, 2048, 5000):
+                path = Path(folder) / f'{size}.bin'
+                data = bytes(range(256)) * (size // 256) + b'x' * (size % 256)
+                path.write_bytes(data)
+                file_ = File(path)
+                file_.read_size_min = file_.read_size_max = 1024
+                self.assertEqual(file_.sha256, hashlib.sha256(data).digest())
+
+    def test_fingerprint_while_hashing(self):
+        # Same fingerprint from the full hash's single read, whatever the sizes
+        with TemporaryDirectory(prefix='mimicry-') as folder:
+            sample = 1000
+            for size in (0, 1, 999, 1000, 1001, 1999, 2000, 2001, 5555):
+                path = Path(folder) / f'{size}.bin'
+                path.write_bytes(bytes(range(256)) * (size // 256) + b'x' * (size % 256))
+                expected = File(path)
+                expected.fingerprint_sample = sample
+                file_ = File(path)
+                file_.fingerprint_sample = sample
+                file_.read_size_min = file_.read_size_max = 700
+                reads = []
+                file_.on_read = reads.append
+                file_.sha256
+                self.assertEqual(file_.fingerprint, expected.fingerprint, size)
+                self.assertEqual(sum(reads), size)
+
+    def test_chunks(self):
+        with TemporaryDirectory(prefix='mimicry-') as folder:
+            path = Path(folder) / 'random.bin'
+            data = bytes(range(256)) * 2000
+            path.write_bytes(data)
+            file_ = File(path, chunking=True)
+            file_.read_size_min = file_.read_size_max = 10_000
+            self.assertEqual(file_.sha256, hashlib.sha256(data).digest())
+            self.assertEqual(sum(chunk.size for chunk in file_.chunks), len(data))
+
+            # Same chunks, read in a single pass of their own
+            self.assertEqual(File(path).chunks, file_.chunks)
+
+    def test_read_buffer_reused(self):
+        first = read_buffer(1000)
+        second = read_buffer(10)
+        self.assertEqual(len(second), 10)
+        self.assertIs(first.obj, second.obj)
+        self.assertGreaterEqual(len(read_buffer(2_000_000)), 2_000_000)
+
+    def test_other_algorithm(self):
+        file_ = File(self.path, 'blake2b')
+        expected = hashlib.blake2b(self.path.read_bytes(), digest_size=32)
+        self.assertEqual(file_.sha256, expected.digest())
+        self.assertNotEqual(file_.sha256, self.file.sha256)
+
+    def test_unknown_algorithm(self):
+        with self.assertRaisesRegex(MimicryError, "Unknown hash algorithm: 'md5'"):
+            File(self.path, 'md5').sha256
+
     def test_relative_to(self):
         # Calculate relative path
         this_folder = Path(__file__).parent
@@ -0,0 +1,102 @@
+import hashlib
+from pathlib import Path
+from pprint import pprint as pp
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from mimicry.database import DB, FileRecord
+from mimicry.exceptions import MimicryError
+from mimicry.index import HashIndex, index_path, write_index
+from mimicry.updater import Updater
+
+
+class TestHashIndex(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = TemporaryDirectory(prefix='mimicry-')
+        cls.db = DB(Path(cls.folder.name) / 'mimicry.db')
+
+        # Fake records, no actual files needed
+        records = []
+        for index in range(1000):
+            sha256 = hashlib.sha256(str(index % 900).encode()).digest()
+            record = FileRecord(
+                name=f'{index}.bin', relpath=f'fake/{index}.bin',
+                size=index, mtime=0, sha256=sha256, fingerprint=b'')
+            records.append(record)
+        cls.db.add_many(records)
+        cls.path = write_index(cls.db)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.db.connection.close()
+        cls.folder.cleanup()
+
+    def test_path(self):
+        self.assertEqual(self.path, Path(self.folder.name) / 'mimicry.idx')
+        self.assertEqual(self.path, index_path(self.db.path))
+
+    def test_lookups(self):
+        with HashIndex(self.path) as index:
+            self.assertEqual(len(index), 1000)
+            for sha256 in self.db.hashes():
+                self.assertIn(sha256, index)
+            self.assertNotIn(b'\x00' * 32, index)
+            self.assertNotIn(b'\xff' * 32, index)
+            self.assertNotIn(hashlib.sha256(b'missing').digest(), index)
+
+    def test_find(self):
+        sha256 = hashlib.sha256(b'5').digest()
+        with HashIndex(self.path) as index:
+            found = index.find(sha256)
+        self.assertEqual(sorted(size for size, pk in found), [5, 905])
+        for size, pk in found:
+            row = self.db.connection.execute(
+                "SELECT sha256, size FROM files WHERE id=?;", (pk,)).fetchone()
+            self.assertEqual(tuple(row), (sha256, size))
+
+    def test_algorithm(self):
+        with HashIndex(self.path, algorithm='sha256') as index:
+            self.assertEqual(index.algorithm, 'sha256')
+        with self.assertRaisesRegex(MimicryError, "Hash index uses sha256, not blake2b"):
+            HashIndex(self.path, algorithm='blake2b')
+
+    def test_old_version(self):
+        with TemporaryDirectory(prefix='mimicry-') as folder:
+            path = Path(folder) / 'old.idx'
+            path.write_bytes(b'MIMIDX01' + bytes(8))
+            with self.assertRaisesRegex(MimicryError, "Unsupported hash index version"):
+                HashIndex(path)
+
+    def test_removed_by_update(self):
+        # Index left by an earlier update would be stale, so is removed
+        with TemporaryDirectory(prefix='mimicry-') as folder:
+            root = Path(folder)
+            (root / 'first.txt').write_bytes(b'first')
+            Updater(root, export_index=True).update()
+            path = index_path(root / Updater.db_file)
+            self.assertTrue(path.is_file())
+            Updater(root).update()
+            self.assertFalse(path.exists())
+
+    def test_closed(self):
+        with HashIndex(self.path) as index:
+            pass
+        with self.assertRaisesRegex(MimicryError, "Hash index file is closed"):
+            index.find(hashlib.sha256(b'5').digest())
+
+    def test_empty(self):
+        with TemporaryDirectory(prefix='mimicry-') as folder:
+            db = DB(Path(folder) / 'mimicry.db')
+            path = write_index(db)
+            with HashIndex(path) as index:
+                self.assertEqual(len(index), 0)
+                self.assertNotIn(b'\x00' * 32, index)
+            db.connection.close()
+
+    def test_not_an_index(self):
+        with TemporaryDirectory(prefix='mimicry-') as folder:
+            path = Path(folder) / 'bogus.idx'
+            path.write_bytes(b'Not an index at all')
+            with self.assertRaisesRegex(MimicryError, "Not a hash index file"):
+                HashIndex(path)
@@ -0,0 +1,70 @@
+from concurrent.futures import ThreadPoolExecutor
+from pprint import pprint as pp
+import threading
+import time
+from unittest import TestCase
+
+from mimicry.database import FileRecord
+from mimicry.links import HardLinks, distinct
+from mimicry.tree import TreeEntry
+
+
+def entry(relpath, inode, links, size=10):
+    return TreeEntry(relpath, size, 0.0, 0, 0, inode, 1, links)
+
+
+class TestHardLinks(TestCase):
+    def setUp(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def hash(self, entry):
+        with self.lock:
+            self.calls.append(entry.relpath)
+        time.sleep(0.01)
+        record = FileRecord.from_entry(entry)
+        record.sha256 = entry.inode.to_bytes(32, 'big')
+        return record
+
+    def test_hashed_once(self):
+        links = HardLinks()
+        entries = [entry(f'{inode}-{index}', inode, 3) for index in range(3) for inode in (1, 2)]
+        with ThreadPoolExecutor(4) as executor:
+            records = list(executor.map(lambda e: links.hash(e, self.hash), entries))
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(links.num_shared, 4)
+        self.assertEqual([r.relpath for r in records], [e.relpath for e in entries])
+        for record, entry_ in zip(records, entries):
+            self.assertEqual(record.sha256, entry_.inode.to_bytes(32, 'big'))
+
+        # Forgotten once every name has been seen
+        self.assertEqual(links._slots, {})
+
+    def test_single_link(self):
+        links = HardLinks()
+        links.hash(entry('a', 1, 1), self.hash)
+        links.hash(entry('b', 1, 1), self.hash)
+        self.assertEqual(self.calls, ['a', 'b'])
+
+    def test_first_failed(self):
+        links = HardLinks()
+
+        def fail(entry):
+            raise PermissionError(entry.relpath)
+        with self.assertRaises(PermissionError):
+            links.hash(entry('a', 1, 2), fail)
+        record = links.hash(entry('b', 1, 2), self.hash)
+        self.assertEqual(self.calls, ['b'])
+        self.assertIsNotNone(record.sha256)
+
+
+class TestDistinct(TestCase):
+    def test_distinct(self):
+        records = [
+            FileRecord('a', 'a', 1, 0.0, inode=1, device=1),
+            FileRecord('b', 'b', 1, 0.0, inode=1, device=1),
+            FileRecord('c', 'c', 1, 0.0, inode=1, device=2),
+            FileRecord('d', 'd', 1, 0.0),
+            FileRecord('e', 'e', 1, 0.0),
+        ]
+        self.assertEqual([r.name for r in distinct(records)], ['a', 'c', 'd', 'e'])
@@ -0,0 +1,61 @@
+import json
+from pathlib import Path
+from pprint import pprint as pp
+import sqlite3
+import sys
+from tempfile import TemporaryDirectory
+from unittest import TestCase, skipUnless
+
+from mimicry.metrics import Metrics, proc_io
+from mimicry.progress import Phase
+
+
+class TestMetrics(TestCase):
+    def test_phases(self):
+        metrics = Metrics()
+        with Phase(metrics, 'hash') as phase:
+            phase.advance(3, 3000)
+        with Phase(metrics, 'hash') as phase:
+            phase.advance(1, 1000)
+        hashed = metrics.summary()['phases']['hash']
+        self.assertEqual(hashed['runs'], 2)
+        self.assertEqual((hashed['files'], hashed['bytes']), (4, 4000))
+        self.assertGreater(hashed['wall_seconds'], 0)
+        self.assertGreaterEqual(hashed['cpu_seconds'], 0)
+        self.assertGreater(hashed['bytes_per_second'], 0)
+
+    def test_stop_without_start(self):
+        metrics = Metrics()
+        metrics.stop('walk')
+        self.assertEqual(metrics.phases, {})
+
+    def test_sql_statements(self):
+        metrics = Metrics()
+        connection = sqlite3.connect(':memory:')
+        metrics.watch(connection)
+        metrics.start('write')
+        connection.execute("CREATE TABLE numbers (number INTEGER);")
+        connection.executemany("INSERT INTO numbers VALUES (?);", [(1,), (2,)])
+        metrics.stop('write')
+        connection.close()
+        self.assertGreaterEqual(metrics.phases['write']['sql_statements'], 3)
+
+    @skipUnless(sys.platform.startswith('linux'), "Needs '/proc/self/io'")
+    def test_proc_io(self):
+        before = proc_io()
+        with TemporaryDirectory(prefix='mimicry-') as folder:
+            (Path(folder) / 'data.bin').write_bytes(b'x' * 10_000)
+        after = proc_io()
+        self.assertEqual(
+            set(before), {'read_syscalls', 'write_syscalls', 'read_bytes', 'write_bytes'})
+        self.assertGreaterEqual(after['write_bytes'] - before['write_bytes'], 10_000)
+
+    def test_write(self):
+        metrics = Metrics()
+        Phase(metrics, 'walk').finish()
+        with TemporaryDirectory(prefix='mimicry-') as folder:
+            path = Path(folder) / 'metrics.json'
+            metrics.write(path, label='Blue')
+            data = json.loads(path.read_text())
+        self.assertEqual(data['label'], 'Blue')
+        self.assertEqual(list(data['phases']), ['walk'])
@@ -0,0 +1,125 @@
+from pprint import pprint as pp
+import threading
+from unittest import mock
+
+from mimicry.database import DB
+from mimicry.pipeline import Listing, Pipeline
+from mimicry.updater import Updater
+
+from .test_updater import TestCaseTree
+
+
+class TestPipeline(TestCaseTree):
+    def expected(self, **kwargs):
+        """
+        Records from a fresh, ordinary update of the current tree.
+        """
+        db_path = self.root / Updater.db_file
+        if db_path.exists():
+            db_path.unlink()
+        updater = Updater(self.root, **kwargs)
+        updater.update()
+        records = self.records(updater)
+        updater.db.connection.close()
+        db_path.unlink()
+        return records
+
+    def run_pipeline(self, updater, **kwargs):
+        """
+        Run pipeline with given arguments, as `Updater.update()` would.
+        """
+        updater.db = DB(updater.db_path)
+        Pipeline(updater, **kwargs).run()
+
+    def test_update(self):
+        self.make_tree()
+        expected = self.expected()
+        updater = Updater(self.root, pipeline=True, workers=3)
+        updater.update()
+        self.assertEqual(self.records(updater), expected)
+        self.assertEqual(updater.db.queued(), [])
+
+    def test_incremental(self):
+        self.make_tree()
+        Updater(self.root, pipeline=True).update()
+
+        # Change, add, and delete files, more than fit in one batch or queue
+        self.make_file('alpha/two.txt', 201, fill=b'2')
+        for index in range(10):
+            self.make_file(f'delta/{index}.txt', index)
+        (self.root / 'beta/gamma/three.txt').unlink()
+        (self.root / 'five.txt').unlink()
+        events = []
+        updater = Updater(self.root, pipeline=True, batch_size=2, on_progress=events.append)
+        self.run_pipeline(updater, queue_size=1)
+        records = self.records(updater)
+        updater.db.connection.close()
+        self.assertEqual(records, self.expected())
+
+        ended = {event.phase: event for event in events if event.status == 'end'}
+        self.assertEqual(ended['walk'].files, 14)
+        self.assertEqual(ended['hash'].files, 11)
+        self.assertEqual(ended['orphans'].files, 2)
+
+    def test_lazy(self):
+        self.make_tree()
+        updater = Updater(self.root, pipeline=True, lazy=True)
+        updater.update()
+        records = self.records(updater)
+        updater.db.connection.close()
+        self.assertEqual(records, self.expected(lazy=True))
+        self.assertIsNone(records['five.txt'].sha256)
+
+    def test_error(self):
+        # Failure while hashing stops every stage, without hanging
+        self.make_tree()
+        for index in range(50):
+            self.make_file(f'delta/{index}.txt', index)
+        updater = Updater(self.root, pipeline=True, workers=2)
+        with mock.patch.object(Updater, '_prepare', side_effect=PermissionError("Denied")):
+            with self.assertRaisesRegex(PermissionError, "Denied"):
+                self.run_pipeline(updater, queue_size=2)
+        self.assertEqual(self.records(updater), {})
+
+    def test_writer_thread(self):
+        # Writes happen off the event loop's thread
+        self.make_tree()
+        updater = Updater(self.root, pipeline=True)
+        threads = []
+        add_many = DB.add_many
+
+        def spy(db, *args, **kwargs):
+            threads.append(threading.current_thread().name)
+            return add_many(db, *args, **kwargs)
+        with mock.patch.object(DB, 'add_many', spy):
+            updater.update()
+        self.assertTrue(threads)
+        self.assertTrue(all(name.startswith('write') for name in threads), threads)
+        self.assertEqual(len(self.records(updater)), 6)
+
+    def test_unreadable(self):
+        # Files that can't be stat'ed, or hashed, are skipped with a warning
+        self.make_tree()
+        updater = Updater(self.root, pipeline=True)
+        hash_ = updater._hash
+
+        def fail(entry):
+            if entry.relpath == 'alpha/one.txt':
+                raise PermissionError(13, "Permission denied")
+            return hash_(entry)
+        updater._hash = fail
+
+        class Unreadable:
+            def stat(self, follow_symlinks=True):
+                raise PermissionError(13, "Permission denied")
+
+        def listing(relpath, entry):
+            return Listing(relpath, Unreadable() if relpath == 'five.txt' else entry)
+        with mock.patch('mimicry.pipeline.Listing', listing):
+            with self.assertLogs('mimicry', 'WARNING') as logs:
+                updater.update()
+        self.assertEqual(len(logs.output), 2)
+        records = self.records(updater)
+        self.assertEqual(len(records), 4)
+        self.assertNotIn('five.txt', records)
+        self.assertEqual(len(updater._skipped), 0)
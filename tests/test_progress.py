@@ -0,0 +1,106 @@
+import io
+import json
+from pathlib import Path
+from pprint import pprint as pp
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from mimicry.progress import (
+    Event, JsonLinesSink, Phase, TerminalRenderer, combine, format_duration)
+
+
+def make_event(**kwargs):
+    data = {
+        'phase': 'hash', 'status': 'progress', 'files': 5, 'bytes': 5_000_000,
+        'total_files': 10, 'total_bytes': 10_000_000, 'elapsed': 5.0,
+        'files_per_second': 1.0, 'bytes_per_second': 1_000_000.0, 'eta': 5.0,
+        'time': 1.7e9,
+    }
+    data.update(kwargs)
+    return Event(**data)
+
+
+class TestPhase(TestCase):
+    def test_events(self):
+        events = []
+        with Phase(events.append, 'hash', 3, 300, interval=0.0) as phase:
+            phase.advance(1, 100)
+            phase.advance(1, 100)
+        self.assertEqual(
+            [event.status for event in events], ['start', 'progress', 'progress', 'end'])
+        last = events[-1]
+        self.assertEqual((last.phase, last.files, last.bytes), ('hash', 2, 200))
+        self.assertEqual(last.eta, 0.0)
+        self.assertGreater(last.bytes_per_second, 0)
+
+        # Time remaining estimated from bytes
+        progress = events[1]
+        expected = 200 / progress.bytes_per_second
+        self.assertAlmostEqual(progress.eta, expected, places=3)
+
+    def test_interval(self):
+        events = []
+        phase = Phase(events.append, 'walk', interval=60.0)
+        for _ in range(1000):
+            phase.advance(1, 10)
+        phase.finish()
+        phase.finish()
+        self.assertEqual([event.status for event in events], ['start', 'end'])
+        self.assertEqual(events[-1].files, 1000)
+        self.assertIsNone(events[0].eta)
+
+    def test_no_callback(self):
+        phase = Phase(None, 'walk', interval=0.0)
+        phase.advance(2, 20)
+        phase.finish()
+        self.assertEqual((phase.files, phase.bytes), (2, 20))
+
+    def test_callback_errors_ignored(self):
+        def broken(event):
+            raise RuntimeError("Oops")
+        with self.assertLogs('mimicry.progress', 'ERROR'):
+            Phase(broken, 'walk').finish()
+
+    def test_combine(self):
+        first, second = [], []
+        Phase(combine(first.append, second.append), 'walk').finish()
+        self.assertEqual(len(first), 2)
+        self.assertEqual(first, second)
+
+
+class TestSinks(TestCase):
+    def test_json_lines(self):
+        with TemporaryDirectory(prefix='mimicry-') as folder:
+            path = Path(folder) / 'events.jsonl'
+            sink = JsonLinesSink(path)
+            sink(make_event(status='start'))
+            sink(make_event(status='end'))
+            sink.close()
+            lines = path.read_text().splitlines()
+        self.assertEqual(len(lines), 2)
+        data = json.loads(lines[1])
+        self.assertEqual(data['status'], 'end')
+        self.assertEqual(data['bytes_per_second'], 1_000_000.0)
+
+    def test_render(self):
+        renderer = TerminalRenderer(io.StringIO())
+        self.assertEqual(
+            renderer.render(make_event()),
+            "hash    5 of 10 files, 5.0MB of 10MB (50%) at 1.0MB/s ETA 00:00:05")
+        self.assertEqual(
+            renderer.render(make_event(status='end', total_files=None, total_bytes=None)),
+            "hash    5 files, 5.0MB at 1.0MB/s in 00:00:05")
+
+    def test_stream_not_terminal(self):
+        stream = io.StringIO()
+        renderer = TerminalRenderer(stream)
+        self.assertFalse(renderer.interactive)
+        renderer(make_event())
+        renderer(make_event(status='end'))
+        self.assertEqual(len(stream.getvalue().splitlines()), 2)
+        self.assertNotIn('\r', stream.getvalue())
+
+    def test_format_duration(self):
+        self.assertEqual(format_duration(0), '00:00:00')
+        self.assertEqual(format_duration(3725.9), '01:02:05')
+        self.assertEqual(format_duration(2 * 86400 + 61), '2d 00:01:01')
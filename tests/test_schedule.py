@@ -0,0 +1,68 @@
+from pathlib import Path
+from pprint import pprint as pp
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from mimicry import schedule as schedule_module
+from mimicry.exceptions import NotSupported
+from mimicry.schedule import physical_offset, schedule
+from mimicry.tree import Tree, TreeEntry
+
+
+class TestSchedule(TestCase):
+    def setUp(self):
+        self.folder = TemporaryDirectory(prefix='mimicry-')
+        self.root = Path(self.folder.name)
+        for name in ('c.txt', 'a.txt', 'b.txt', 'd/e.txt'):
+            path = self.root / name
+            path.parent.mkdir(exist_ok=True)
+            path.write_bytes(name.encode() * 1000)
+        (self.root / 'empty.txt').touch()
+        self.entries = list(Tree(self.root).entries(ordered=True))
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def relpaths(self, entries):
+        return [entry.relpath for entry in entries]
+
+    def test_name(self):
+        self.assertEqual(schedule(self.entries, self.root), self.entries)
+
+    def test_inode(self):
+        scheduled = schedule(self.entries, self.root, 'inode')
+        inodes = [entry.inode for entry in scheduled]
+        self.assertEqual(inodes, sorted(inodes))
+
+    def test_extent(self):
+        scheduled = schedule(self.entries, self.root, 'extent')
+        self.assertCountEqual(scheduled, self.entries)
+        try:
+            offsets = [physical_offset(self.root / entry.relpath) for entry in scheduled]
+        except NotSupported:
+            self.skipTest("File system does not support FIEMAP")
+
+        # Empty file has no extents, so goes last
+        self.assertEqual(scheduled[-1].relpath, 'empty.txt')
+        self.assertIsNone(offsets[-1])
+        self.assertEqual(offsets[:-1], sorted(offsets[:-1]))
+
+    def test_extent_fallback(self):
+        def unsupported(path):
+            raise NotSupported("Nope")
+        original = schedule_module.physical_offset
+        schedule_module.physical_offset = unsupported
+        try:
+            scheduled = schedule(self.entries, self.root, 'extent')
+        finally:
+            schedule_module.physical_offset = original
+        self.assertEqual(scheduled, schedule(self.entries, self.root, 'inode'))
+
+    def test_missing_file(self):
+        entries = self.entries + [TreeEntry('gone.txt', 1, 0.0, 0, 0, 0, 0)]
+        scheduled = schedule(entries, self.root, 'extent')
+        self.assertCountEqual(self.relpaths(scheduled), self.relpaths(entries))
+
+    def test_unknown_order(self):
+        with self.assertRaisesRegex(ValueError, "Unknown order 'random'"):
+            schedule(self.entries, self.root, 'random')
@@ -0,0 +1,62 @@
+import os
+from pprint import pprint as pp
+import sys
+import threading
+from time import perf_counter
+from unittest import TestCase, skipUnless
+
+from mimicry.throttle import Throttle, TokenBucket, lower_priority
+
+
+class TestTokenBucket(TestCase):
+    def test_within_capacity(self):
+        bucket = TokenBucket(1000, capacity=100)
+        self.assertEqual(bucket.take(60), 0.0)
+        self.assertEqual(bucket.take(40), 0.0)
+
+    def test_borrow(self):
+        bucket = TokenBucket(1000, capacity=100)
+        started = perf_counter()
+        waited = bucket.take(150)
+        self.assertAlmostEqual(waited, 0.05, delta=0.01)
+        self.assertGreaterEqual(perf_counter() - started, 0.04)
+
+        # Debt repaid, bucket now empty
+        self.assertAlmostEqual(bucket.take(10), 0.01, delta=0.01)
+
+    def test_bad_rate(self):
+        with self.assertRaisesRegex(ValueError, "Rate must be positive, given: 0"):
+            TokenBucket(0)
+
+
+class TestThrottle(TestCase):
+    def test_unlimited(self):
+        throttle = Throttle()
+        self.assertIsNone(throttle.bytes)
+        self.assertIsNone(throttle.files)
+        throttle.file()
+        throttle.read(10**12)
+
+    def test_files(self):
+        throttle = Throttle(files_per_second=100)
+        started = perf_counter()
+        for _ in range(110):
+            throttle.file()
+        self.assertGreaterEqual(perf_counter() - started, 0.08)
+
+
+class TestLowerPriority(TestCase):
+    @skipUnless(sys.platform.startswith('linux'), "Linux schedules threads individually")
+    def test_lower_priority(self):
+        niceness = []
+
+        def worker():
+            lower_priority()
+            niceness.append(os.getpriority(os.PRIO_PROCESS, threading.get_native_id()))
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+        self.assertEqual(niceness, [19])
+
+        # Calling thread unaffected
+        self.assertLess(os.getpriority(os.PRIO_PROCESS, threading.get_native_id()), 19)
@@ -1,10 +1,13 @@
 
+import os
+from pathlib import Path
 from pprint import pprint as pp
-from unittest import TestCase
+from tempfile import TemporaryDirectory
+from unittest import TestCase, mock
 
 from mimicry.exceptions import NotAFolder
 from mimicry.file import File
-from mimicry.tree import Tree
+from mimicry.tree import Tree, TreeEntry
 
 from . import DATA_FOLDER
 
@@ -25,6 +28,35 @@ class TreeTest(TestCase):
         self.assertEqual(tree.total_files, 8)
         self.assertEqual(tree.total_bytes, 2286)
 
+    def test_single_pass(self):
+        tree = Tree(DATA_FOLDER, precount=False)
+        self.assertIsNone(tree.total_files)
+        self.assertIsNone(tree.progress)
+        files = list(tree.files())
+        self.assertEqual(len(files), 6)
+        self.assertEqual(tree.total_files, 6)
+        self.assertEqual(tree.total_bytes, 1375)
+
+    def test_single_pass_estimate(self):
+        tree = Tree(DATA_FOLDER, precount=False, estimate=(12, 2750))
+        self.assertEqual(tree.progress, 0.0)
+        files = tree.files()
+        for _ in range(3):
+            next(files)
+        self.assertEqual(tree.progress, 0.25)
+        list(files)
+        self.assertEqual(tree.progress, 0.5)
+
+    def test_progress_events(self):
+        events = []
+        tree = Tree(
+            DATA_FOLDER, precount=False, estimate=(12, 2750), on_progress=events.append)
+        list(tree.entries())
+        self.assertEqual([event.status for event in events], ['start', 'end'])
+        self.assertEqual(events[-1].phase, 'walk')
+        self.assertEqual((events[-1].files, events[-1].bytes), (6, 1375))
+        self.assertEqual(events[-1].total_files, 12)
+
     def test_iterate(self):
         tree = Tree(DATA_FOLDER)
         files = []
@@ -36,6 +68,57 @@ class TreeTest(TestCase):
         self.assertEqual(len(files), 6)
         self.assertEqual(total_bytes, 1375)
 
+    def test_entries(self):
+        tree = Tree(DATA_FOLDER)
+        entries = list(tree.entries())
+        self.assertEqual(len(entries), 6)
+        for entry in entries:
+            self.assertIsInstance(entry, TreeEntry)
+            self.assertGreater(entry.inode, 0)
+            self.assertGreater(entry.mtime, 1_000_000_000)
+        relpaths = [entry.relpath for entry in entries]
+        self.assertEqual(relpaths, [
+            'ignore.me',
+            'text1.txt',
+            'seasons/autumn.mp3',
+            'seasons/spring.mp3',
+            'seasons/summer.mp3',
+            'seasons/winter.mp3',
+        ])
+        self.assertEqual(sum(entry.size for entry in entries), 1375)
+
+    def test_entries_ordered(self):
+        with TemporaryDirectory(prefix='mimicry-') as folder:
+            for relpath in ('b.txt', 'a/z.txt', 'a-x/y.txt', 'a/b/c.txt', 'A.txt'):
+                path = Path(folder, relpath)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.touch()
+            tree = Tree(folder)
+            relpaths = [entry.relpath for entry in tree.entries(ordered=True)]
+        self.assertEqual(relpaths, ['A.txt', 'b.txt', 'a/z.txt', 'a-x/y.txt', 'a/b/c.txt'])
+        self.assertEqual(relpaths, sorted(relpaths, key=os.path.split))
+
+    def test_unreadable_folder(self):
+        # Folder skipped, with all under it, rather than stopping the walk
+        scandir = os.scandir
+
+        def denied(path):
+            if os.path.basename(path) == 'locked':
+                raise PermissionError(13, "Permission denied", path)
+            return scandir(path)
+
+        with TemporaryDirectory(prefix='mimicry-') as folder:
+            for relpath in ('a.txt', 'locked/b.txt', 'locked/deeper/c.txt', 'open/d.txt'):
+                path = Path(folder, relpath)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.touch()
+            with mock.patch('mimicry.tree.os.scandir', denied):
+                with self.assertLogs('mimicry.tree', 'WARNING') as logs:
+                    tree = Tree(folder)
+                    relpaths = [entry.relpath for entry in tree.entries(ordered=True)]
+        self.assertEqual(relpaths, ['a.txt', 'open/d.txt'])
+        self.assertIn("Skipping unreadable folder", logs.output[0])
+
     def test_iterate_ignore(self):
         ignore = [
             'ignore.me',
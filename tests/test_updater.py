@@ -0,0 +1,437 @@
+from dataclasses import replace
+import json
+import os
+from pathlib import Path
+from pprint import pprint as pp
+import random
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from unittest import TestCase
+
+from mimicry.chunking import chunk_bytes
+from mimicry.file import File
+from mimicry.tree import Tree, TreeEntry
+from mimicry.updater import Updater
+
+
+class TestCaseTree(TestCase):
+    """
+    `TestCase` that creates a fresh temporary file tree for every test.
+    """
+    def setUp(self):
+        self.folder = TemporaryDirectory(prefix='mimicry-')
+        self.root = Path(self.folder.name)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def make_file(self, relpath, size, fill=b'@'):
+        """
+        Make a file under our temporary folder, filled with `fill` bytes.
+
+        Returns (`Path`): Path to created file.
+        """
+        path = self.root / relpath
+        path.parent.mkdir(exist_ok=True, parents=True)
+        path.write_bytes(fill * size)
+        return path
+
+    def make_tree(self):
+        """
+        Create a handful of files, some of them duplicates.
+        """
+        self.make_file('alpha/one.txt', 100, fill=b'1')
+        self.make_file('alpha/two.txt', 200, fill=b'2')
+        self.make_file('beta/one.txt', 100, fill=b'1')
+        self.make_file('beta/gamma/three.txt', 300, fill=b'3')
+        self.make_file('beta/gamma/four.txt', 300, fill=b'4')
+        self.make_file('five.txt', 500, fill=b'5')
+
+    def records(self, updater):
+        return {record.relpath: record for record in updater.db.files()}
+
+
+class TestUpdate(TestCaseTree):
+    def test_update(self):
+        self.make_tree()
+        updater = Updater(self.root)
+        updater.update()
+        records = self.records(updater)
+        self.assertEqual(len(records), 6)
+        self.assertNotIn('mimicry.db', records)
+        for record in records.values():
+            self.assertEqual(len(record.sha256), 32)
+        self.assertEqual(
+            records['alpha/one.txt'].sha256, records['beta/one.txt'].sha256)
+
+    def test_incremental(self):
+        self.make_tree()
+        Updater(self.root).update()
+
+        # Same size, new contents
+        path = self.make_file('alpha/two.txt', 200, fill=b'x')
+        os.utime(path, ns=(0, 1_000_000_000_000_000_001))
+
+        updater = Updater(self.root)
+        updated = []
+        update_records = updater.update_records
+
+        def spy(entries):
+            entries = list(entries)
+            updated.extend(entry.relpath for entry in entries)
+            update_records(entries)
+        updater.update_records = spy
+        updater.update()
+
+        self.assertEqual(updated, ['alpha/two.txt'])
+        record = self.records(updater)['alpha/two.txt']
+        self.assertEqual(record.mtime_ns, 1_000_000_000_000_000_001)
+        self.assertEqual(record.sha256, File(path).sha256)
+
+    def test_should_update(self):
+        self.make_tree()
+        updater = Updater(self.root)
+        updater.update()
+        records = self.records(updater)
+        entries = {entry.relpath: entry for entry in Tree(self.root).entries()}
+        entry = entries['five.txt']
+        record = records['five.txt']
+        self.assertFalse(updater.should_update(entry, record))
+        self.assertTrue(updater.should_update(entry, None))
+        self.assertTrue(updater.should_update(replace(entry, ctime_ns=1), record))
+        self.assertTrue(updater.should_update(replace(entry, inode=1), record))
+        updater.check_inodes = False
+        self.assertFalse(updater.should_update(replace(entry, inode=1), record))
+
+    def test_backfill(self):
+        # Records from before full metadata was stored get it, unread
+        self.make_tree()
+        os.link(self.root / 'five.txt', self.root / 'link.txt')
+        for options in ({}, {'streaming': True}, {'pipeline': True}):
+            updater = Updater(self.root)
+            updater.update()
+            updater.db.connection.execute(
+                "UPDATE files SET mtime_ns=NULL, ctime_ns=NULL, inode=NULL, device=NULL;")
+            groups = updater.db.duplicate_groups(hardlinks=False)
+            self.assertEqual(len(list(groups)), 2)
+
+            updater = Updater(self.root, batch_size=2, **options)
+            hashed = []
+            updater._hash = hashed.append
+            updater.update()
+            self.assertEqual(hashed, [])
+            for relpath, record in self.records(updater).items():
+                self.assertIsNotNone(record.mtime_ns, relpath)
+                self.assertIsNotNone(record.ctime_ns, relpath)
+                self.assertIsNotNone(record.inode, relpath)
+                self.assertIsNotNone(record.device, relpath)
+            groups = updater.db.duplicate_groups(hardlinks=False)
+            self.assertEqual(len(list(groups)), 1, options)
+
+    def test_change_algorithm(self):
+        self.make_tree()
+        Updater(self.root).update()
+        updater = Updater(self.root, algorithm='blake2b')
+        updater.update()
+        self.assertEqual(updater.db.algorithm, 'blake2b')
+        for relpath, record in self.records(updater).items():
+            self.assertEqual(record.algorithm, 'blake2b')
+            self.assertEqual(record.sha256, File(self.root / relpath, 'blake2b').sha256)
+
+        # Algorithm kept by later updates
+        updater = Updater(self.root)
+        updater.update()
+        self.assertEqual(updater.db.algorithm, 'blake2b')
+
+    def test_change_algorithm_resumed(self):
+        # Re-hashing is queued, so an interrupted change picks up where it left off
+        self.make_tree()
+        Updater(self.root).update()
+        updater = Updater(self.root, algorithm='blake2b', batch_size=2)
+        prepare = updater._prepare
+        prepared = []
+
+        def interrupt(entry):
+            if len(prepared) == 3:
+                raise KeyboardInterrupt()
+            prepared.append(entry.relpath)
+            return prepare(entry)
+
+        updater._prepare = interrupt
+        with self.assertRaises(KeyboardInterrupt):
+            updater.update()
+        algorithms = [record.algorithm for record in self.records(updater).values()]
+        self.assertEqual(algorithms.count('blake2b'), 2)
+        self.assertEqual(len(updater.db.queued()), 4)
+
+        updater = Updater(self.root)
+        updater.update()
+        self.assertEqual(updater.db.queued(), [])
+        for relpath, record in self.records(updater).items():
+            self.assertEqual(record.algorithm, 'blake2b')
+            self.assertEqual(record.sha256, File(self.root / relpath, 'blake2b').sha256)
+
+    def test_queue_emptied(self):
+        self.make_tree()
+        updater = Updater(self.root)
+        updater.update()
+        self.assertEqual(updater.db.queued(), [])
+
+    def test_resume(self):
+        self.make_tree()
+
+        # Interrupt update after first batch of two files
+        updater = Updater(self.root, batch_size=2)
+        prepare = updater._prepare
+        prepared = []
+
+        def interrupt(entry):
+            if len(prepared) == 3:
+                raise KeyboardInterrupt()
+            prepared.append(entry.relpath)
+            return prepare(entry)
+        updater._prepare = interrupt
+        with self.assertRaises(KeyboardInterrupt):
+            updater.update()
+        self.assertEqual(len(self.records(updater)), 2)
+        self.assertEqual(len(updater.db.queued()), 4)
+
+        # Resume, without walking tree again
+        self.make_file('six.txt', 600, fill=b'6')
+        updater = Updater(self.root)
+        updater.read_files = None
+        updater.update()
+        self.assertEqual(len(self.records(updater)), 6)
+        self.assertEqual(updater.db.queued(), [])
+
+        # New file found next time
+        updater = Updater(self.root)
+        updater.update()
+        self.assertIn('six.txt', self.records(updater))
+
+    def test_resume_missing(self):
+        self.make_tree()
+        updater = Updater(self.root)
+        updater.update()
+        entry = TreeEntry.from_path(self.root, 'five.txt')
+        updater.db.queue([entry])
+        (self.root / 'five.txt').unlink()
+
+        updater = Updater(self.root)
+        updater.update()
+        self.assertEqual(updater.db.queued(), [])
+
+    def test_resume_unreadable(self):
+        self.make_tree()
+        updater = Updater(self.root)
+        updater.update()
+        entries = [
+            TreeEntry.from_path(self.root, relpath)
+            for relpath in ('alpha/one.txt', 'five.txt', 'alpha/two.txt')]
+        updater.db.queue(entries)
+
+        # Replace one file by a folder, and fail to read another
+        (self.root / 'five.txt').unlink()
+        (self.root / 'five.txt').mkdir()
+        updater = Updater(self.root)
+        hash_ = updater._hash
+
+        def fail(entry):
+            if entry.relpath == 'alpha/one.txt':
+                raise PermissionError(13, "Permission denied")
+            return hash_(entry)
+        updater._hash = fail
+        with self.assertLogs('mimicry.updater', 'WARNING') as logs:
+            updater.update()
+        self.assertEqual(len(logs.output), 2)
+        self.assertEqual(updater.db.queued(), [])
+
+        # Next update walks the tree as usual
+        updater = Updater(self.root)
+        updater.update()
+        self.assertEqual(updater.db.queued(), [])
+        self.assertNotIn('five.txt', self.records(updater))
+
+    def test_streaming(self):
+        self.make_tree()
+        updater = Updater(self.root)
+        updater.update()
+        expected = self.records(updater)
+
+        # Change, add, and delete files
+        self.make_file('alpha/two.txt', 201, fill=b'2')
+        self.make_file('alpha/six.txt', 600, fill=b'6')
+        (self.root / 'beta/gamma/three.txt').unlink()
+        streaming = Updater(self.root, streaming=True, batch_size=2)
+        streaming.update()
+        records = self.records(streaming)
+
+        updater.db.connection.close()
+        (self.root / Updater.db_file).unlink()
+        updater = Updater(self.root)
+        updater.update()
+        expected = self.records(updater)
+        self.assertEqual(records.keys(), expected.keys())
+        self.assertEqual(records['alpha/two.txt'].size, 201)
+        self.assertEqual(records['alpha/six.txt'], expected['alpha/six.txt'])
+
+    def test_workers(self):
+        self.make_tree()
+        updater = Updater(self.root)
+        updater.update()
+        expected = self.records(updater)
+        updater.db.connection.close()
+        (self.root / Updater.db_file).unlink()
+
+        updater = Updater(self.root, workers=4)
+        updater.update()
+        self.assertEqual(self.records(updater), expected)
+
+    def test_order(self):
+        self.make_tree()
+        updater = Updater(self.root)
+        updater.update()
+        expected = self.records(updater)
+        updater.db.connection.close()
+
+        for order in ('inode', 'extent'):
+            for streaming in (False, True):
+                (self.root / Updater.db_file).unlink()
+                updater = Updater(
+                    self.root, order=order, streaming=streaming, batch_size=2)
+                updater.update()
+                self.assertEqual(self.records(updater), expected)
+                updater.db.connection.close()
+
+    def test_order_invalid(self):
+        with self.assertRaisesRegex(ValueError, "Unknown order 'random'"):
+            Updater(self.root, order='random')
+
+    def test_progress(self):
+        self.make_tree()
+        events = []
+        Updater(self.root, on_progress=events.append).update()
+        phases = [event.phase for event in events if event.status == 'start']
+        self.assertEqual(phases, ['walk', 'records', 'orphans', 'hash', 'write'])
+        ended = {event.phase: event for event in events if event.status == 'end'}
+        self.assertEqual(ended.keys(), set(phases))
+        self.assertEqual((ended['walk'].files, ended['walk'].bytes), (6, 1500))
+        self.assertEqual((ended['hash'].files, ended['hash'].total_bytes), (6, 1500))
+        self.assertEqual(ended['write'].files, 6)
+
+        # Streaming too, with totals estimated from the first run
+        events.clear()
+        Updater(self.root, streaming=True, on_progress=events.append).update()
+        ended = {event.phase: event for event in events if event.status == 'end'}
+        self.assertEqual(ended.keys(), {'walk', 'orphans', 'hash', 'write'})
+        self.assertEqual(ended['walk'].total_files, 6)
+        self.assertEqual(ended['hash'].files, 0)
+
+    def test_metrics(self):
+        self.make_tree()
+        events = []
+        path = self.root / 'metrics.json'
+        updater = Updater(self.root, on_progress=events.append, metrics_path=path)
+        updater.update()
+        data = json.loads(path.read_text())
+        path.unlink()
+        self.assertEqual(
+            set(data['phases']), {'update', 'walk', 'records', 'orphans', 'hash', 'write'})
+        self.assertEqual(data['phases']['hash']['bytes'], 1500)
+        self.assertGreater(data['phases']['write']['sql_statements'], 0)
+        self.assertEqual(data['database']['files'], 6)
+
+        # Other callbacks still called
+        self.assertIn('walk', {event.phase for event in events})
+
+    def test_throttled(self):
+        # 1,500 bytes in six files, each read once, for fingerprint and hash
+        self.make_tree()
+        updater = Updater(self.root, max_bytes_per_second=1000, idle_priority=True)
+        started = perf_counter()
+        updater.update()
+        self.assertGreaterEqual(perf_counter() - started, 0.4)
+        self.assertEqual(len(self.records(updater)), 6)
+
+    def test_hardlinks(self):
+        self.make_tree()
+        for index in range(5):
+            os.link(self.root / 'five.txt', self.root / f'link-{index}.txt')
+        updater = Updater(self.root, workers=3)
+        updater.update()
+        self.assertEqual(updater.links.num_shared, 5)
+        records = self.records(updater)
+        self.assertEqual(records['link-4.txt'].sha256, records['five.txt'].sha256)
+        groups = updater.db.duplicate_groups(hardlinks=False)
+        self.assertEqual([len(group) for group in groups], [2])
+
+    def test_hardlinks_snapshot(self):
+        # New snapshot linking to the last one, as `rsync --link-dest` makes
+        self.make_tree()
+        Updater(self.root, chunking=True).update()
+        for relpath in ('five.txt', 'alpha/two.txt'):
+            path = self.root / 'snapshot' / relpath
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.link(self.root / relpath, path)
+
+        # Hashes, and chunks, of files linked to are reused, not read again
+        updater = Updater(self.root, chunking=True)
+        hashed = []
+        hash_ = updater._hash
+
+        def spy(entry):
+            hashed.append(entry.relpath)
+            return hash_(entry)
+        updater._hash = spy
+        updater.update()
+        self.assertEqual(hashed, [])
+        self.assertEqual(updater.links.num_shared, 4)
+        records = self.records(updater)
+        self.assertEqual(records['snapshot/five.txt'].sha256, records['five.txt'].sha256)
+        self.assertEqual(records['snapshot/five.txt'].chunked, 1)
+        query = "SELECT count(DISTINCT file) FROM chunks;"
+        self.assertEqual(updater.db.connection.execute(query).fetchone()[0], 8)
+
+    def test_chunking(self):
+        self.make_tree()
+        data = random.Random(1).randbytes(400_000)
+        self.make_file('images/first.img', 1, fill=data)
+        self.make_file('images/second.img', 1, fill=data[:300_000] + b'edited' + data[300_000:])
+        Updater(self.root).update()
+
+        # Files already hashed are read again, to chunk them
+        updater = Updater(self.root, chunking=True)
+        updater.update()
+        records = self.records(updater)
+        self.assertEqual(records['images/first.img'].chunked, len(chunk_bytes(data)))
+        self.assertEqual(records['five.txt'].chunked, 1)
+        shared = updater.db.shared(min_bytes=1000)
+        self.assertEqual(shared[0][:2], ('images/first.img', 'images/second.img'))
+        self.assertGreater(shared[0][2], 200_000)
+        shared = updater.db.shared(by='folder', min_bytes=1000)
+        self.assertEqual(shared, [])
+
+        # Chunks deleted with their files, or replaced when files change
+        (self.root / 'images/second.img').unlink()
+        self.make_file('alpha/two.txt', 201, fill=b'2')
+        updater = Updater(self.root, chunking=True)
+        updater.update()
+        query = "SELECT count(DISTINCT file) FROM chunks;"
+        self.assertEqual(updater.db.connection.execute(query).fetchone()[0], 7)
+        self.assertEqual(updater.db.shared(), [('alpha/one.txt', 'beta/one.txt', 100)])
+
+    def test_chunking_lazy(self):
+        with self.assertRaisesRegex(ValueError, "Chunking needs every file read"):
+            Updater(self.root, chunking=True, lazy=True)
+
+    def test_workers_invalid(self):
+        with self.assertRaisesRegex(ValueError, "Need at least one worker"):
+            Updater(self.root, workers=0)
+
+    def test_lazy(self):
+        self.make_tree()
+        updater = Updater(self.root, lazy=True, workers=2)
+        updater.update()
+        records = self.records(updater)
+        self.assertIsNone(records['five.txt'].sha256)
+        self.assertEqual(len(updater.db.duplicates()), 1)
@@ -4,7 +4,22 @@ import functools
 from pprint import pprint as pp
 from unittest import TestCase
 
-from mimicry.utils import file_size, normalise, round_significant
+from mimicry.utils import chunked, file_size, merge_join, normalise, round_significant
+
+
+class TestChunked(TestCase):
+    def test_chunked(self):
+        self.assertEqual(list(chunked(range(5), 2)), [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(chunked(range(4), 2)), [[0, 1], [2, 3]])
+        self.assertEqual(list(chunked([], 2)), [])
+
+    def test_chunked_generator(self):
+        chunks = chunked((i for i in range(3)), 10)
+        self.assertEqual(next(chunks), [0, 1, 2])
+
+    def test_bad_size(self):
+        with self.assertRaisesRegex(ValueError, "Chunk size must be positive"):
+            list(chunked(range(3), 0))
 
 
 class TestFileSize(TestCase):
@@ -98,6 +113,26 @@ class TestFileSize(TestCase):
             self.assertEqual(file_size(size, traditional=True), expected)
 
 
+class TestMergeJoin(TestCase):
+    def test_merge_join(self):
+        left = ['a', 'c', 'd', 'f']
+        right = ['b', 'c', 'f', 'g']
+        expected = [
+            ('a', None),
+            (None, 'b'),
+            ('c', 'c'),
+            ('d', None),
+            ('f', 'f'),
+            (None, 'g'),
+        ]
+        self.assertEqual(list(merge_join(left, right, key=str.upper)), expected)
+
+    def test_empty(self):
+        self.assertEqual(list(merge_join([], [], key=str)), [])
+        self.assertEqual(list(merge_join(['a'], [], key=str)), [('a', None)])
+        self.assertEqual(list(merge_join([], ['a'], key=str)), [(None, 'a')])
+
+
 class TestNormalise(TestCase):
     def test_normalise(self):
         strings = [